@@ -0,0 +1,315 @@
+"""
+Minimal OpenAI-compatible chat completions server used to exercise the LLM code paths offline.
+
+Usage:
+    python -m benchmarks.fake_openai --port 8765 --latency 0.5 --rate-limit-ratio 0.1
+
+Then point the code at it, e.g. `analyse_places(..., base_url="http://127.0.0.1:8765/v1")` or
+`OPENAI_BASE_URL=http://127.0.0.1:8765/v1`.
+
+The server also stands in for the Batch API (/v1/files and /v1/batches): batches are answered in the background,
+--batch-latency seconds after they are created.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+def fake_value(schema: Dict[str, Any], definitions: Optional[Dict[str, Any]] = None) -> Any:
+    """Builds a placeholder value matching a JSON schema."""
+    definitions = definitions or schema.get("definitions", {}) or schema.get("$defs", {})
+    if "$ref" in schema:
+        return fake_value(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in schema:
+        return fake_value(schema["anyOf"][0], definitions)
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return {
+            name: fake_value(prop, definitions)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [fake_value(schema.get("items", {}), definitions)]
+    if kind == "integer":
+        return 3
+    if kind == "number":
+        return 3.0
+    if kind == "boolean":
+        return True
+    return "fake answer"
+
+
+def _echo_batch(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers batched requests ([{"id", "text"}, ...]) by mapping each id to its own text."""
+    user_messages = [m for m in request.get("messages", []) if m.get("role") == "user"]
+    try:
+        items = json.loads(user_messages[-1]["content"])
+        return {str(item["id"]): item["text"] for item in items}
+    except (IndexError, KeyError, TypeError, ValueError):
+        return {}
+
+
+def fake_completion(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers a chat completion request with a schema-conforming placeholder."""
+    message: Dict[str, Any] = {"role": "assistant", "content": None}
+    finish_reason = "stop"
+
+    if request.get("tools"):
+        function = request["tools"][0]["function"]
+        message["tool_calls"] = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {
+                    "name": function["name"],
+                    "arguments": json.dumps(fake_value(function.get("parameters", {}))),
+                },
+            }
+        ]
+        finish_reason = "tool_calls"
+    elif (request.get("response_format") or {}).get("type") == "json_schema":
+        schema = request["response_format"]["json_schema"].get("schema", {})
+        message["content"] = json.dumps(fake_value(schema))
+    elif (request.get("response_format") or {}).get("type") == "json_object":
+        message["content"] = json.dumps(_echo_batch(request))
+    else:
+        # Echoes the last user message back, which keeps the text extraction paths meaningful
+        user_messages = [m for m in request.get("messages", []) if m.get("role") == "user"]
+        message["content"] = user_messages[-1]["content"] if user_messages else "#NONE#"
+
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in request.get("messages", []))
+    completion_chars = len(json.dumps(message))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake-model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": completion_chars // 4,
+            "total_tokens": (prompt_chars + completion_chars) // 4,
+        },
+    }
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """Maps the name of each field of a multipart/form-data body to its filename and content."""
+    message = BytesParser(policy=default_policy).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return fields
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: "FakeOpenAIServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.search(r"/files/([\w-]+)/content$", path)
+        if match and match.group(1) in self.server.files:
+            body = self.server.files[match.group(1)]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        match = re.search(r"/batches/([\w-]+)$", path)
+        if match and match.group(1) in self.server.batches:
+            self._send_json(200, self.server.batches[match.group(1)])
+            return
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/files"):
+            length = int(self.headers.get("Content-Length", 0))
+            fields = parse_multipart(self.headers.get("Content-Type", ""), self.rfile.read(length))
+            filename, content = fields.get("file", (None, b""))
+            purpose = fields.get("purpose", (None, b""))[1].decode("utf-8")
+            self._send_json(200, self.server.add_file(content, filename or "upload.jsonl", purpose))
+            return
+        if path.endswith("/batches"):
+            request = self._read_json()
+            if request.get("input_file_id") not in self.server.files:
+                self._send_json(404, {"error": {"message": f"No file {request.get('input_file_id')}"}})
+                return
+            self._send_json(200, self.server.create_batch(request))
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        request = self._read_json()
+        self.server.record_call()
+        time.sleep(self.server.latency)
+
+        if random.random() < self.server.rate_limit_ratio:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+            return
+        self._send_json(200, fake_completion(request))
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering OpenAI chat completions with placeholder content.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        latency (float): Seconds to wait before answering each request.
+        rate_limit_ratio (float): Share of requests answered with a 429.
+        batch_latency (float): Seconds a batch stays in progress before it is answered.
+        batch_failure_ratio (float): Share of the requests of a batch answered with an error.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        batch_latency: float = 0.0,
+        batch_failure_ratio: float = 0.0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeOpenAIHandler)
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.batch_latency = batch_latency
+        self.batch_failure_ratio = batch_failure_ratio
+        self.calls = 0
+        self.batch_requests = 0
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._calls_lock = threading.Lock()
+
+    def record_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        metadata = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[file_id] = {**metadata, "content": content}
+        return metadata
+
+    def create_batch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "metadata": request.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch: Dict[str, Any]):
+        content = self.files[batch["input_file_id"]]["content"]
+        lines = [json.loads(line) for line in content.splitlines() if line.strip()]
+        batch["request_counts"] = {"total": len(lines), "completed": 0, "failed": 0}
+        batch["status"] = "in_progress"
+        time.sleep(self.batch_latency)
+
+        outputs, errors = [], []
+        for line in lines:
+            result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"], "error": None}
+            if random.random() < self.batch_failure_ratio:
+                result["response"] = {
+                    "status_code": 500,
+                    "request_id": uuid.uuid4().hex,
+                    "body": {"error": {"message": "Internal error", "type": "server_error"}},
+                }
+                errors.append(result)
+                batch["request_counts"]["failed"] += 1
+            else:
+                result["response"] = {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": fake_completion(line["body"]),
+                }
+                outputs.append(result)
+                batch["request_counts"]["completed"] += 1
+            with self._calls_lock:
+                self.batch_requests += 1
+
+        batch["status"] = "finalizing"
+        if outputs:
+            batch["output_file_id"] = self.add_file(
+                "".join(json.dumps(result) + "\n" for result in outputs).encode("utf-8"), "output.jsonl", "batch_output"
+            )["id"]
+        if errors:
+            batch["error_file_id"] = self.add_file(
+                "".join(json.dumps(result) + "\n" for result in errors).encode("utf-8"), "errors.jsonl", "batch_output"
+            )["id"]
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--batch-latency", type=float, default=5.0)
+    parser.add_argument("--batch-failure-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        args.port, args.latency, args.rate_limit_ratio, args.batch_latency, args.batch_failure_ratio
+    )
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,262 @@
+"""
+Local HTTP server replaying Google Maps place pages, so that headless Chrome can scrape them offline.
+
+Place pages are rendered from `benchmarks/fixtures/place.html` and their reviews are served page by page, as
+Maps does while scrolling, by relevance or newest first. The same reviews are served in the format of the Maps reviews endpoint
+(`/maps/rpc/listugcposts`) for the HTTP engine. Recorded fixtures can be dropped in the fixtures directory:
+`<slug>.html` replaces the page of the place, `<slug>.reviews.json` (a list of {"id", "text", "date", "score"})
+its reviews and `<slug>.listugcposts.<page>.txt` the raw response of a page of the reviews endpoint.
+
+Usage:
+    python -m benchmarks.fixture_server --port 8766 --places 10 --reviews 200 --page-latency 0.3
+"""
+import argparse
+import html
+import json
+import re
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+_WORDS = (
+    "the museum was lovely and staff were kind we spent hours walking around rooms paintings were stunning "
+    "queue tickets price expensive cheap crowded quiet sculptures garden cafe shop children visit again "
+    "recommend history collection exhibition building architecture worth long short"
+).split()
+_DATES = ["a week ago", "2 weeks ago", "a month ago", "3 months ago", "6 months ago", "a year ago", "2 years ago"]
+
+
+_UNIT_DAYS = {"minute": 1 / 1440, "hour": 1 / 24, "day": 1, "week": 7, "month": 30, "year": 365}
+
+
+def _age_days(date: str) -> float:
+    """Approximate age of a relative date such as "3 weeks ago", used to serve reviews sorted by newest."""
+    match = re.search(r"(a|an|\d+)\s+(minute|hour|day|week|month|year)", date or "")
+    if match is None:
+        return float("inf")
+    return (1 if match.group(1) in ("a", "an") else int(match.group(1))) * _UNIT_DAYS[match.group(2)]
+
+
+def generate_reviews(slug: str, count: int, query: str = "", topic_ratio: float = 0.4) -> List[Dict[str, Any]]:
+    """Builds `count` deterministic reviews for a place, a share of them mentioning the searched query."""
+    reviews = []
+    for idx in range(count):
+        rng = random.Random(f"{slug}-{idx}")
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(6, 18))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        if query and rng.random() < topic_ratio:
+            sentences.insert(rng.randrange(len(sentences) + 1), f"The {query} was {rng.choice(['great', 'poor', 'ok'])}.")
+        reviews.append(
+            {
+                "id": f"{slug}-review-{idx}",
+                "text": " ".join(sentences),
+                "date": rng.choice(_DATES),
+                "score": rng.randint(1, 5),
+            }
+        )
+    return reviews
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server: "FixtureServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+
+        if len(parts) >= 3 and parts[:2] == ["maps", "place"]:
+            self.server.record_request("place")
+            page = self.server.place_page(parts[2])
+            if page is None:
+                self._send(404, b"Unknown place", "text/plain")
+            else:
+                self._send(200, page.encode("utf-8"), "text/html; charset=utf-8")
+            return
+
+        if parts == ["maps", "rpc", "listugcposts"]:
+            self.server.record_request("rpc")
+            time.sleep(self.server.page_latency)
+            body = self.server.listugcposts(url.query)
+            if body is None:
+                self._send(400, b"Unknown place", "text/plain")
+            else:
+                self._send(200, body.encode("utf-8"), "application/json; charset=utf-8")
+            return
+
+        if len(parts) == 3 and parts[:2] == ["api", "reviews"]:
+            self.server.record_request("reviews")
+            params = parse_qs(url.query)
+            time.sleep(self.server.page_latency)
+            payload = self.server.reviews_page(
+                parts[2],
+                params.get("q", [""])[0],
+                int(params.get("page", ["0"])[0]),
+                params.get("sort", ["relevant"])[0],
+            )
+            self._send(200, json.dumps(payload).encode("utf-8"), "application/json")
+            return
+
+        self._send(404, b"Not found", "text/plain")
+
+
+def listugcposts_payload(reviews: List[Dict[str, Any]], next_token: Optional[str]) -> str:
+    """Encodes reviews as a response of the Maps reviews endpoint, with the positions `src.http_reviews` reads."""
+    entries = []
+    for review in reviews:
+        details = [[review["score"]]] + [None] * 14 + [[[review["text"]]]]
+        entries.append([[review["id"], [None] * 6 + [review["date"]], details]])
+    return ")]}'\n" + json.dumps([None, next_token, entries])
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server serving place pages and their reviews.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        places (int): Number of generated places.
+        reviews_per_place (int): Number of generated reviews of each place.
+        page_size (int): Number of reviews loaded at a time.
+        page_latency (float): Seconds to wait before answering each page of reviews.
+        fixtures_dir (str): Directory with the page template and the recorded fixtures.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        places: int = 5,
+        reviews_per_place: int = 100,
+        page_size: int = 10,
+        page_latency: float = 0.2,
+        fixtures_dir: str = FIXTURES_DIR,
+    ):
+        super().__init__(("127.0.0.1", port), FixtureHandler)
+        self.places = places
+        self.reviews_per_place = reviews_per_place
+        self.page_size = page_size
+        self.page_latency = page_latency
+        self.fixtures_dir = fixtures_dir
+        self.requests: Dict[str, int] = {}
+        self._requests_lock = threading.Lock()
+        with open(os.path.join(fixtures_dir, "place.html"), "r", encoding="utf-8") as f:
+            self._template = f.read()
+
+    def record_request(self, kind: str):
+        with self._requests_lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def slugs(self) -> List[str]:
+        return [f"fixture-place-{idx}" for idx in range(self.places)]
+
+    @staticmethod
+    def place_id(idx: int) -> str:
+        return f"0x{idx + 1:x}:0x{idx + 1:016x}"
+
+    def place_urls(self) -> List[str]:
+        return [f"{self.base_url}/maps/place/{slug}/" for slug in self.slugs()]
+
+    def _recorded(self, name: str) -> Optional[str]:
+        path = os.path.join(self.fixtures_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def place_page(self, slug: str) -> Optional[str]:
+        recorded = self._recorded(f"{slug}.html")
+        if recorded is not None:
+            return recorded
+        if slug not in self.slugs():
+            return None
+        idx = self.slugs().index(slug)
+        place = {
+            "slug": slug,
+            "name": f"Fixture Museum {idx}",
+            "description": "Art museum",
+            "address": f"Via Fixture {idx}, Roma",
+            "phone": f"+39 06 000 {idx:04d}",
+            "web": f"https://museum-{idx}.example.com/",
+            "id": self.place_id(idx),
+        }
+        title = html.escape(f"{place['name']} · {place['address']}")
+        return self._template.replace("__PLACE_JSON__", json.dumps(place)).replace("__PLACE_TITLE__", title)
+
+    def _reviews(self, slug: str, query: str, sort: str = "relevant") -> List[Dict[str, Any]]:
+        recorded = self._recorded(f"{slug}.reviews.json")
+        reviews = json.loads(recorded) if recorded is not None else generate_reviews(slug, self.reviews_per_place, query)
+        if sort == "newest":
+            reviews = sorted(reviews, key=lambda review: _age_days(review["date"]))
+        return reviews
+
+    def reviews_page(self, slug: str, query: str, page: int, sort: str = "relevant") -> Dict[str, Any]:
+        reviews = self._reviews(slug, query, sort)
+        start = page * self.page_size
+        return {"reviews": reviews[start : start + self.page_size], "more": start + self.page_size < len(reviews)}
+
+    def listugcposts(self, query_string: str) -> Optional[str]:
+        """Answers a request to the reviews endpoint, reading the place, page and query from its "pb" parameter."""
+        pb = re.search(r"(?:^|&)pb=([^&]*)", query_string)
+        fields = {
+            key: unquote(value)
+            for key, value in re.findall(r"!(1s|1i|2s|3s)([^!]*)", pb.group(1) if pb else "")
+            if key not in ("1s", "1i") or value
+        }
+        place_ids = [self.place_id(idx) for idx in range(self.places)]
+        if fields.get("1s") not in place_ids:
+            return None
+        slug = self.slugs()[place_ids.index(fields["1s"])]
+        page = int(fields.get("2s") or 0)
+
+        recorded = self._recorded(f"{slug}.listugcposts.{page}.txt")
+        if recorded is not None:
+            return recorded
+        page_size = int(fields.get("1i", self.page_size))
+        sort = re.search(r"!11m4!1e(\d+)", pb.group(1))
+        reviews = self._reviews(slug, fields.get("3s", ""), "newest" if sort and sort.group(1) == "2" else "relevant")
+        start = page * page_size
+        next_token = str(page + 1) if start + page_size < len(reviews) else None
+        return listugcposts_payload(reviews[start : start + page_size], next_token)
+
+    def start(self) -> "FixtureServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--places", type=int, default=5)
+    parser.add_argument("--reviews", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--page-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = FixtureServer(args.port, args.places, args.reviews, args.page_size, args.page_latency)
+    print(f"Fixture server listening on {server.base_url}")
+    for place_url in server.place_urls():
+        print(place_url)
+    server.serve_forever()
@@ -0,0 +1,293 @@
+"""
+Offline benchmark of the scraping and analysis stages, against the fixture server and the fake OpenAI server.
+
+Usage:
+    python -m benchmarks.run --places 4 --reviews 100 --limit 50 --llm-latency 0.3 --output baseline.json
+    python -m benchmarks.run --places 4 --reviews 100 --limit 50 --llm-latency 0.3 --baseline baseline.json
+
+Each stage reports its wall clock, throughput, per-item latency percentiles, peak browser memory and LLM calls.
+With --baseline, the throughput of each stage is compared with a previous report.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fixture_server import FixtureServer
+
+STAGES = ["place", "batch", "analyse"]
+BENCHMARK_TOPIC = "audio guide"
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Summarizes latencies with their mean, p50, p95 and max."""
+    if not values:
+        return {"count": 0, "mean_s": 0.0, "p50_s": 0.0, "p95_s": 0.0, "max_s": 0.0}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean_s": round(sum(ordered) / len(ordered), 3),
+        "p50_s": at(0.5),
+        "p95_s": at(0.95),
+        "max_s": round(ordered[-1], 3),
+    }
+
+
+def _descendants_rss_mb() -> float:
+    """Resident memory of the processes started by this one (chromedriver and Chrome), in MB."""
+    if psutil is not None:
+        total = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / 2**20
+
+    # Linux fallback: walks /proc for the descendants of this process
+    parents, rss = {}, {}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        parents[int(pid)] = int(fields.get("PPid", "0").strip())
+        rss[int(pid)] = int(fields.get("VmRSS", "0 kB").split()[0]) if "VmRSS" in fields else 0
+
+    descendants, frontier = set(), {os.getpid()}
+    while frontier:
+        frontier = {pid for pid, parent in parents.items() if parent in frontier} - descendants
+        descendants |= frontier
+    return sum(rss.get(pid, 0) for pid in descendants) / 1024
+
+
+class MemorySampler:
+    """Samples the memory of the browsers in a background thread while a stage runs."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.samples.append(_descendants_rss_mb())
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "MemorySampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> Dict[str, float]:
+        if not self.samples:
+            return {"peak_mb": 0.0, "mean_mb": 0.0}
+        return {"peak_mb": round(max(self.samples), 1), "mean_mb": round(sum(self.samples) / len(self.samples), 1)}
+
+
+def run_stage(
+    name: str, function: Callable[[], Any], count_items: Callable[[Any], int], llm: FakeOpenAIServer
+) -> Tuple[Dict[str, Any], Any]:
+    """Runs a stage, measuring its duration, memory and LLM calls. Returns the stage report and the stage result"""
+    from src.metrics import metrics
+    from src.prefilter import prefilter_stats
+    from src.waits import wait_stats
+
+    metrics.reset()
+    wait_stats.reset()
+    prefilter_stats.reset()
+    calls_before = llm.calls
+    started = time.perf_counter()
+    with MemorySampler() as memory:
+        result = function()
+    wall_clock = time.perf_counter() - started
+    items = count_items(result)
+
+    report = {
+        "wall_clock_s": round(wall_clock, 3),
+        "items": items,
+        "items_per_s": round(items / wall_clock, 3) if wall_clock else 0.0,
+        "llm_calls": llm.calls - calls_before,
+        "browser_memory": memory.summary(),
+        "waits": wait_stats.summary(),
+        "prefilter": prefilter_stats.summary(),
+        "stage_timings": metrics.report()["stages"],
+        "counters": metrics.report()["counters"],
+    }
+    print(f"{name}: {items} items in {wall_clock:.1f}s ({report['items_per_s']}/s), {report['llm_calls']} LLM calls")
+    return report, result
+
+
+def timed(function: Callable, latencies: List[float]) -> Callable:
+    """Wraps a function to record the duration of each call."""
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    return wrapper
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, float]:
+    """Throughput of each stage relative to the baseline (above 1 is faster)."""
+    ratios = {}
+    for name, stage in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name, {}).get("items_per_s")
+        if previous:
+            ratios[name] = round(stage["items_per_s"] / previous, 3)
+    return ratios
+
+
+def run_benchmark(
+    places: int = 4,
+    reviews: int = 100,
+    limit: Optional[int] = 50,
+    page_latency: float = 0.2,
+    llm_latency: float = 0.3,
+    max_concurrency: Optional[int] = None,
+    stages: List[str] = STAGES,
+    engine: str = "selenium",
+    browser_profile: str = "default",
+) -> Dict[str, Any]:
+    """
+    Runs the selected stages against local servers and returns the report.
+
+    Notes:
+        - The LLM cache is redirected to a temporary file, so that every run pays for the same calls.
+        - "analyse" reuses the reviews of "batch" when it ran, otherwise it scrapes them first without reporting it.
+    """
+    fixtures = FixtureServer(places=places, reviews_per_place=reviews, page_latency=page_latency).start()
+    llm = FakeOpenAIServer(latency=llm_latency).start()
+    os.environ["OPENAI_BASE_URL"] = llm.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite")
+
+    # Imported once the environment points to the local servers
+    import src.extract_multiple as extract_multiple
+    from src.driver import WebDriverManager
+    from src.extract_reviews import extract_place
+    from src.places_analysis import analyse_places
+    from langchain_core.pydantic_v1 import BaseModel, Field
+
+    class BenchmarkQuestions(BaseModel):
+        available: bool = Field(description="Is the topic available at the place?")
+        rating: int = Field(description="How good is it, from 1 to 10?")
+        summary: str = Field(description="What do visitors say about it?")
+
+    urls = fixtures.place_urls()
+    report: Dict[str, Any] = {
+        "config": {
+            "places": places,
+            "reviews_per_place": reviews,
+            "limit": limit,
+            "page_latency_s": page_latency,
+            "llm_latency_s": llm_latency,
+            "max_concurrency": max_concurrency,
+            "engine": engine,
+            "browser_profile": browser_profile,
+        },
+        "stages": {},
+    }
+    store = None
+    WebDriverManager().set_profile(browser_profile)
+
+    if "place" in stages:
+        stage, _ = run_stage(
+            "place", lambda: extract_place(BENCHMARK_TOPIC, urls[0], limit, engine=engine), len, llm
+        )
+        report["stages"]["place"] = stage
+
+    if "batch" in stages or "analyse" in stages:
+        latencies: List[float] = []
+        original = extract_multiple.extract_place
+        extract_multiple.extract_place = timed(original, latencies)
+        try:
+            stage, store = run_stage(
+                "batch",
+                lambda: extract_multiple.extract_places_batch(
+                    BENCHMARK_TOPIC, limit, list_of_places_urls=urls, engine=engine
+                ),
+                len,
+                llm,
+            )
+        finally:
+            extract_multiple.extract_place = original
+        stage["place_latency"] = percentiles(latencies)
+        if "batch" in stages:
+            report["stages"]["batch"] = stage
+
+    if "analyse" in stages:
+        stage, analysis = run_stage(
+            "analyse",
+            lambda: analyse_places(
+                store, BenchmarkQuestions, max_concurrency=max_concurrency, base_url=llm.base_url, use_cache=False
+            ),
+            len,
+            llm,
+        )
+        stage["insight_stats"] = analysis.attrs.get("insight_stats")
+        report["stages"]["analyse"] = stage
+
+    report["fixture_requests"] = dict(fixtures.requests)
+    fixtures.shutdown()
+    llm.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--places", type=int, default=4)
+    parser.add_argument("--reviews", type=int, default=100, help="Reviews of each fixture place")
+    parser.add_argument("--limit", type=int, default=50, help="Reviews collected per place")
+    parser.add_argument("--page-latency", type=float, default=0.2, help="Seconds to serve a page of reviews")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds to answer an LLM request")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Concurrency of analyse_places")
+    parser.add_argument("--engine", default="selenium", help="Review fetch engine: selenium or http")
+    parser.add_argument("--browser-profile", default="default", help="Browser profile: default or lean")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated, among " + ", ".join(STAGES))
+    parser.add_argument("--output", default=None, help="Where to write the JSON report")
+    parser.add_argument("--baseline", default=None, help="A previous JSON report to compare with")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        places=args.places,
+        reviews=args.reviews,
+        limit=args.limit,
+        page_latency=args.page_latency,
+        llm_latency=args.llm_latency,
+        max_concurrency=args.max_concurrency,
+        engine=args.engine,
+        browser_profile=args.browser_profile,
+        stages=[stage.strip() for stage in args.stages.split(",") if stage.strip()],
+    )
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            result["speedup_vs_baseline"] = compare(result, json.load(f))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from openai import OpenAI
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Limits of a single batch input file
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 200 * 2**20
+POLL_INTERVAL = 30.0
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(Exception):
+    """Raised when a batch cannot be submitted, or ends without results."""
+
+
+def write_batch_file(requests: Iterable[Tuple[str, Dict[str, Any]]], path: Optional[str] = None) -> str:
+    """
+    Writes chat completion requests to a batch input file, one JSON request per line.
+
+    Args:
+        requests (Iterable[Tuple[str, Dict[str, Any]]]): The custom ID (unique in the batch) and the body of each
+            request, as sent to the chat completions endpoint.
+        path (Optional[str], optional): Where to write the file. Default is None (a temporary file).
+
+    Returns:
+        str: The path of the file.
+
+    Raises:
+        BatchError: If the requests exceed the number of requests or the size of a batch.
+    """
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix="batch_", suffix=".jsonl")
+        os.close(handle)
+    elif os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    count, size = 0, 0
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests:
+            line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n"
+            count += 1
+            size += len(line.encode("utf-8"))
+            if count > MAX_BATCH_REQUESTS or size > MAX_BATCH_BYTES:
+                raise BatchError(
+                    f"Too many requests for a batch (at most {MAX_BATCH_REQUESTS} and {MAX_BATCH_BYTES // 2**20}MB)"
+                )
+            f.write(line)
+    logger.debug(f"Wrote {count} requests ({size / 2**20:.1f}MB) to {path}")
+    return path
+
+
+def submit_batch(client: OpenAI, path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+    """Uploads a batch input file and creates the batch, returning its ID."""
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata=metadata,
+    )
+    logger.info(f"Submitted batch {batch.id} ({path})")
+    return batch.id
+
+
+def wait_for_batch(
+    client: OpenAI, batch_id: str, poll_interval: float = POLL_INTERVAL, timeout: Optional[float] = None
+) -> Any:
+    """
+    Polls a batch until it ends.
+
+    Args:
+        client (OpenAI): The client of the endpoint the batch was submitted to.
+        batch_id (str): The ID of the batch.
+        poll_interval (float, optional): Seconds between two polls. Default is 30.
+        timeout (Optional[float], optional): Seconds after which to stop waiting. Default is None (up to the
+            completion window of the batch).
+
+    Returns:
+        Any: The batch, in one of FINAL_STATUSES.
+
+    Raises:
+        TimeoutError: If the batch is still running after `timeout` seconds. It keeps running, and can be waited
+            for again with its ID.
+    """
+    started = time.monotonic()
+    status = None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status != status:
+            status = batch.status
+            logger.info(f"Batch {batch_id} is {status}: {_request_counts(batch)}")
+        if batch.status in FINAL_STATUSES:
+            return batch
+        if timeout is not None and time.monotonic() - started + poll_interval > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout}s, resume with its ID")
+        time.sleep(poll_interval)
+
+
+def read_batch_results(client: OpenAI, batch: Any) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """
+    Downloads the results of an ended batch.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]: The chat completion of each custom ID that succeeded, and
+            the error of each one that failed.
+
+    Raises:
+        BatchError: If the batch ended without any output (e.g. it failed validation).
+
+    Notes:
+        - Expired and cancelled batches still return the requests they completed.
+    """
+    if batch.status != "completed" and not batch.output_file_id and not batch.error_file_id:
+        errors = getattr(getattr(batch, "errors", None), "data", None) or []
+        details = "; ".join(str(getattr(error, "message", error)) for error in errors)
+        raise BatchError(f"Batch {batch.id} {batch.status} without results" + (f": {details}" if details else ""))
+
+    completions: Dict[str, Dict[str, Any]] = {}
+    failures: Dict[str, str] = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or response.get("body", {}).get("error") or response.get("status_code")
+                failures[result["custom_id"]] = str(error)
+            else:
+                completions[result["custom_id"]] = response["body"]
+    return completions, failures
+
+
+def _request_counts(batch: Any) -> Dict[str, int]:
+    counts = getattr(batch, "request_counts", None)
+    if counts is None:
+        return {}
+    return {"total": counts.total, "completed": counts.completed, "failed": counts.failed}
+
+
+def batch_summary(batch: Any) -> Dict[str, Any]:
+    """The ID, status and request counts of a batch."""
+    return {"batch_id": batch.id, "status": batch.status, **_request_counts(batch)}
+
+
+def completion_content(completion: Dict[str, Any]) -> Optional[str]:
+    """The text answered in a chat completion, or the arguments of its first tool call."""
+    message = ((completion.get("choices") or [{}])[0]).get("message") or {}
+    if message.get("content"):
+        return message["content"]
+    tool_calls: List[Dict[str, Any]] = message.get("tool_calls") or []
+    return tool_calls[0]["function"]["arguments"] if tool_calls else None
@@ -1,41 +1,262 @@
 from openai import OpenAI
 import os
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
 
+from src.dedup import near_duplicate_groups
+from src.llm_cache import get_llm_cache
+from src.llm_support import estimate_tokens
+from src.prefilter import DROP, LOCAL, prefilter_reviews, prefilter_stats
 from src.logger import get_logger
+from src.metrics import metrics
 
 logger = get_logger(__name__)
 
 
+CHUNKS_MODEL = "gpt-4o-mini"
+NONE_MARKER = "#NONE#"
+MIN_TEXT_LENGTH = 250
 
-def pick_topic_relevant_chunks(text, topic:str):
-    """Takes a RAW review and extracts from long reviews only relevant information"""
+CHUNKS_PROMPT = "You receive from the user the text of a review of a GMaps location. You will extract and return EXCLUSIVELY sentences and chunks that are referring to '{topic}' and the context to understand it. If the text contains no information about '{topic}', return '{none_marker}'"
+BATCH_CHUNKS_PROMPT = "You receive from the user a JSON list of reviews of a GMaps location, each with an 'id' and a 'text'. For each review, extract EXCLUSIVELY sentences and chunks that are referring to '{topic}' and the context to understand it. If a review contains no information about '{topic}', use '{none_marker}'. Answer with a JSON object mapping every review id to its extracted text."
 
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-    if len(text) > 250:
+def get_openai_client(base_url: Optional[str] = None) -> OpenAI:
+    """Returns a process-wide OpenAI client per endpoint, so that its HTTP connection pool is reused across calls and
+    threads. Without `base_url`, OPENAI_BASE_URL is read at every call, and the default endpoint used if unset"""
+    return _openai_client(base_url or os.environ.get("OPENAI_BASE_URL"), os.environ.get("OPENAI_API_KEY"))
+
+
+@lru_cache(maxsize=None)
+def _openai_client(base_url: Optional[str], api_key: Optional[str]) -> OpenAI:
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+
+def record_llm_usage(chat_completion, stage: str, model: str):
+    """Counts a chat completion and the tokens it consumed in the run metrics"""
+    metrics.inc("llm_requests", stage=stage, model=model)
+    usage = getattr(chat_completion, "usage", None)
+    if usage is not None:
+        metrics.inc("llm_tokens", usage.prompt_tokens or 0, stage=stage, model=model, direction="in")
+        metrics.inc("llm_tokens", usage.completion_tokens or 0, stage=stage, model=model, direction="out")
+
+
+@metrics.timed()
+def pick_topic_relevant_chunks(text, topic:str, use_cache: bool = True, base_url: Optional[str] = None):
+    """Takes a RAW review and extracts from long reviews only relevant information. Answers are cached on disk, unless use_cache is False.
+    base_url is an OpenAI-compatible endpoint to use instead of the default one"""
+
+    client = get_openai_client(base_url)
+
+    if len(text) > MIN_TEXT_LENGTH:
+        cache = get_llm_cache()
+        cache_key = cache.make_key(CHUNKS_MODEL, str(client.base_url), CHUNKS_PROMPT, topic, text)
+        content = cache.get(cache_key) if use_cache else None
+        if content is not None:
+            logger.debug(f"Cache hit while extracting chunks for topic '{topic}'")
+            return content if content != NONE_MARKER else None
+
         try:
             chat_completion = client.chat.completions.create(
                 messages=[
                     {
                         "role": "system",
-                        "content": f"You receive from the user the text of a review of a GMaps location. You will extract and return EXCLUSIVELY sentences and chunks that are referring to '{topic}' and the context to understand it. If the text contains no information about '{topic}', return '#NONE#'",
+                        "content": CHUNKS_PROMPT.format(topic=topic, none_marker=NONE_MARKER),
                     },
                     {
                         "role": "user",
                         "content": text,
                     }
                 ],
-                model="gpt-4o-mini",
+                model=CHUNKS_MODEL,
             )
+            record_llm_usage(chat_completion, "pick_topic_relevant_chunks", CHUNKS_MODEL)
             content = chat_completion.choices[0].message.content
-            if content != "#NONE#":
+            if use_cache:
+                cache.set(cache_key, content)
+            if content != NONE_MARKER:
                 logger.debug(f"Extracted relevant chunks for topic '{topic}'")
                 return content
             logger.debug(f"No relevant chunks found for topic '{topic}'")
             return None
         except Exception as e:
+            metrics.inc("llm_failures", stage="pick_topic_relevant_chunks", model=CHUNKS_MODEL)
             logger.error(f"Error occurred while extracting chunks: {e}")
             return None
-   
+
     logger.debug(f"Text length is short, returning the original text for topic '{topic}'")
-    return text
\ No newline at end of file
+    return text
+
+
+@metrics.timed()
+def pick_topic_relevant_chunks_batch(
+    texts: List[str],
+    topic: str,
+    token_budget: int = 4000,
+    use_cache: bool = True,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+    drop_unmatched: bool = False,
+    dedup: bool = False,
+    base_url: Optional[str] = None,
+) -> List[Optional[str]]:
+    """
+    Batched version of `pick_topic_relevant_chunks`: packs many long reviews in a single request.
+
+    Args:
+        texts (List[str]): The RAW reviews.
+        topic (str): The topic the extracted chunks must refer to.
+        token_budget (int, optional): Maximum (estimated) number of review tokens packed in one request. Default is 4000.
+        use_cache (bool, optional): Whether to look up and store answers in the on-disk LLM cache. Default is True.
+        prefilter (bool, optional): Whether to score the reviews locally first (see `prefilter_reviews`): those
+            clearly about the topic have their sentences extracted locally, the others are sent to the LLM.
+            Default is False.
+        synonyms (Optional[Union[List[str], Dict[str, List[str]]]], optional): Other words for the topic, used by the
+            prefilter, or a dict mapping topics to their synonyms. Default is None.
+        drop_unmatched (bool, optional): Whether the prefilter drops the reviews not containing any topic or synonym
+            word, instead of sending them to the LLM. Default is False.
+        dedup (bool, optional): Whether to process only one of each group of exact or near duplicate reviews. The
+            others get a copy of its chunks, even where their text differs from it (e.g. a lightly edited review),
+            so only enable it when such copies are acceptable. Default is False.
+        base_url (Optional[str], optional): OpenAI-compatible endpoint to use instead of the default one. Default is
+            None.
+
+    Returns:
+        List[Optional[str]]: For each review, in the same order, the relevant chunks, the text itself if it is short,
+            or None if it doesn't talk about the topic.
+
+    Notes:
+        - Reviews are sent with their position as ID and the model answers with a JSON object mapping IDs to chunks
+          or to '#NONE#'.
+        - Reviews missing from the answer (or whole batches that fail) fall back to `pick_topic_relevant_chunks`.
+        - Only reviews not found in the cache are sent; answers are cached per review.
+        - The avoided LLM work is recorded in `prefilter_stats`.
+    """
+    cache = get_llm_cache()
+    # Answers of different endpoints (e.g. a local test server) are cached apart
+    endpoint = str(get_openai_client(base_url).base_url)
+    results: List[Optional[str]] = [None] * len(texts)
+    long_ids = []
+    cache_keys = {}
+    for idx, text in enumerate(texts):
+        if text and len(text) > MIN_TEXT_LENGTH:
+            cache_keys[idx] = cache.make_key(CHUNKS_MODEL, endpoint, BATCH_CHUNKS_PROMPT, topic, text)
+            cached = cache.get(cache_keys[idx]) if use_cache else None
+            if cached is not None:
+                results[idx] = cached if cached != NONE_MARKER else None
+            else:
+                long_ids.append(idx)
+        else:
+            results[idx] = text or None
+
+    copies = {}
+    if dedup and len(long_ids) > 1:
+        clusters = near_duplicate_groups([texts[idx] for idx in long_ids])
+        copies = {idx: long_ids[cluster] for idx, cluster in zip(long_ids, clusters) if long_ids[cluster] != idx}
+        long_ids = [idx for idx in long_ids if idx not in copies]
+
+    if prefilter and long_ids:
+        if isinstance(synonyms, dict):
+            synonyms = synonyms.get(topic)
+        long_ids = _apply_prefilter(texts, long_ids, topic, synonyms, drop_unmatched, token_budget, results)
+
+    for batch_ids in _pack_batches(texts, long_ids, token_budget):
+        extracted = _extract_batch(texts, batch_ids, topic, base_url)
+        for idx in batch_ids:
+            if idx in extracted:
+                content = extracted[idx] or NONE_MARKER
+                if use_cache:
+                    cache.set(cache_keys[idx], content)
+                results[idx] = content if content != NONE_MARKER else None
+            else:
+                logger.debug(f"Review {idx} missing from batched answer, extracting it alone")
+                results[idx] = pick_topic_relevant_chunks(
+                    text=texts[idx], topic=topic, use_cache=use_cache, base_url=base_url
+                )
+
+    for idx, source in copies.items():
+        results[idx] = results[source]
+
+    logger.debug(
+        f"Extracted chunks for {len(long_ids)} uncached long reviews out of {len(texts)} for topic '{topic}'"
+    )
+    return results
+
+
+def _apply_prefilter(
+    texts: List[str],
+    ids: List[int],
+    topic: str,
+    synonyms: Optional[List[str]],
+    drop_unmatched: bool,
+    token_budget: int,
+    results: List[Optional[str]],
+) -> List[int]:
+    """Fills `results` for the reviews decided locally and returns the IDs still to send to the LLM"""
+    decisions = prefilter_reviews(
+        [texts[idx] for idx in ids], topic, synonyms=synonyms, drop_unmatched=drop_unmatched
+    )
+    escalated = []
+    for idx, decision in zip(ids, decisions):
+        if decision.action == DROP:
+            results[idx] = None
+        elif decision.action == LOCAL:
+            results[idx] = decision.text or None
+        else:
+            escalated.append(idx)
+
+    requests_avoided = len(_pack_batches(texts, ids, token_budget)) - len(_pack_batches(texts, escalated, token_budget))
+    prefilter_stats.record(
+        dropped=sum(decision.action == DROP for decision in decisions),
+        local=sum(decision.action == LOCAL for decision in decisions),
+        escalated=len(escalated),
+        requests_avoided=requests_avoided,
+    )
+    logger.debug(f"Prefilter sends {len(escalated)} of {len(ids)} long reviews to the LLM for topic '{topic}'")
+    return escalated
+
+
+def _pack_batches(texts: List[str], ids: List[int], token_budget: int) -> List[List[int]]:
+    batches, current, current_tokens = [], [], 0
+    for idx in ids:
+        tokens = estimate_tokens(texts[idx])
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _extract_batch(texts: List[str], batch_ids: List[int], topic: str, base_url: Optional[str]) -> dict[int, str]:
+    client = get_openai_client(base_url)
+    payload = json.dumps([{"id": idx, "text": texts[idx]} for idx in batch_ids], ensure_ascii=False)
+    try:
+        chat_completion = client.chat.completions.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": BATCH_CHUNKS_PROMPT.format(topic=topic, none_marker=NONE_MARKER),
+                },
+                {
+                    "role": "user",
+                    "content": payload,
+                },
+            ],
+            model=CHUNKS_MODEL,
+            response_format={"type": "json_object"},
+        )
+        record_llm_usage(chat_completion, "pick_topic_relevant_chunks_batch", CHUNKS_MODEL)
+        answer = json.loads(chat_completion.choices[0].message.content)
+        return {
+            int(idx): content
+            for idx, content in answer.items()
+            if str(idx).isdigit() and int(idx) in batch_ids and isinstance(content, str)
+        }
+    except Exception as e:
+        metrics.inc("llm_failures", stage="pick_topic_relevant_chunks_batch", model=CHUNKS_MODEL)
+        logger.error(f"Error occurred while extracting chunks in batch: {e}")
+        return {}
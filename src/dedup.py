@@ -0,0 +1,247 @@
+import re
+import string
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+NUM_PERM = 64
+LSH_BANDS = 8
+SHINGLE_SIZE = 3
+SIMILARITY_THRESHOLD = 0.8
+COUNT_COLUMN = "count"
+
+# Shingles per block, so that the (permutations x shingles) matrix stays around 100MB
+_BLOCK_SHINGLES = 200_000
+_PUNCTUATION_TABLE = str.maketrans({char: " " for char in string.punctuation})
+_PUNCTUATION_PATTERN = f"[{re.escape(string.punctuation)}]"
+# Odd multipliers combining the hashes of the words of a shingle
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+
+def shingle_hashes(texts: Sequence[str], size: int = SHINGLE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashes the word n-grams of every text (lowercased), texts shorter than `size` words being a single shingle.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The uint64 hashes of all the shingles, text after text, and the number of
+            shingles of each text.
+
+    Notes:
+        - With pyarrow, texts are lowercased, split and their words numbered by Arrow kernels, without creating a
+          Python string per word.
+    """
+    codes, word_counts = _word_codes(texts) if pa is not None else _word_codes_python(texts)
+    # Texts shorter than a shingle are padded with a word of their own
+    lengths = np.maximum(word_counts, size)
+    padded = np.full(int(lengths.sum()), codes.max() + 1 if len(codes) else 0, dtype=np.int64)
+    word_starts = np.cumsum(word_counts) - word_counts
+    padded[np.repeat(np.cumsum(lengths) - lengths - word_starts, word_counts) + np.arange(len(codes))] = codes
+    word_hashes = (padded.astype(np.uint64) + np.uint64(1)) * _SHINGLE_MULTIPLIERS[0]
+
+    # Shingles are hashed at every word of the concatenated texts, then the ones starting in the last size - 1
+    # words of a text (and so crossing into the next one) are dropped
+    count = max(len(word_hashes) - size + 1, 0)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        hashes += word_hashes[offset : offset + count] * _SHINGLE_MULTIPLIERS[offset % len(_SHINGLE_MULTIPLIERS)]
+    crossing = np.cumsum(lengths)[:-1, None] - np.arange(1, size)
+    keep = np.ones(count, dtype=bool)
+    keep[crossing.ravel()] = False
+    return hashes[keep], lengths - size + 1
+
+
+def _word_codes(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Numbers the distinct words of all the texts, returning the number of each word, text after text, and the
+    number of words of each text"""
+    words = pc.utf8_split_whitespace(
+        pc.replace_substring_regex(
+            pc.utf8_lower(pc.fill_null(pa.array(texts, type=pa.large_string()), "")), _PUNCTUATION_PATTERN, " "
+        )
+    )
+    # Leading and trailing whitespace split into empty words
+    flat = words.flatten()
+    kept = pc.not_equal(flat, "").to_numpy(zero_copy_only=False)
+    parents = pc.list_parent_indices(words).to_numpy(zero_copy_only=False)[kept]
+    counts = np.bincount(parents, minlength=len(texts)).astype(np.int64)
+    codes = pc.dictionary_encode(flat.filter(pa.array(kept))).indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    return codes, counts
+
+
+def _word_codes_python(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    words = [(text or "").lower().translate(_PUNCTUATION_TABLE).split() for text in texts]
+    counts = np.array([len(text_words) for text_words in words], dtype=np.int64)
+    codes, _ = pd.factorize(pd.Series([word for text_words in words for word in text_words], dtype=object))
+    return codes.astype(np.int64), counts
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = NUM_PERM, seed: int = 0) -> np.ndarray:
+    """
+    Computes the MinHash signature of each text.
+
+    Args:
+        texts (Sequence[str]): The texts.
+        num_perm (int, optional): Number of hash permutations, i.e. length of the signatures. Default is 64.
+        seed (int, optional): Seed of the permutations. Default is 0.
+
+    Returns:
+        np.ndarray: A (len(texts), num_perm) uint64 array.
+
+    Notes:
+        - Permutations are multiply-shift hashes of the shingles, and the minimum of each is taken per text with
+          `np.minimum.reduceat`, a block of texts at a time.
+    """
+    rng = np.random.default_rng(seed)
+    a = (rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1))[:, None]
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)[:, None]
+
+    hashes, shingle_counts = shingle_hashes(texts)
+    text_offsets = np.concatenate([[0], np.cumsum(shingle_counts)])
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    start = 0
+    while start < len(texts):
+        # At least one text per block, and as many more as fit
+        end = max(start + 1, int(np.searchsorted(text_offsets, text_offsets[start] + _BLOCK_SHINGLES, side="right")) - 1)
+        end = min(end, len(texts))
+        block = hashes[text_offsets[start] : text_offsets[end]]
+        # In place, so that a block allocates a single (permutations x shingles) array
+        permuted = a * block
+        permuted += b
+        permuted >>= np.uint64(32)
+        signatures[start:end] = np.minimum.reduceat(permuted, text_offsets[start:end] - text_offsets[start], axis=1).T
+        start = end
+    return signatures
+
+
+def near_duplicate_groups(
+    texts: Sequence[str],
+    threshold: float = SIMILARITY_THRESHOLD,
+    groups: Optional[Sequence] = None,
+    num_perm: int = NUM_PERM,
+    bands: int = LSH_BANDS,
+) -> np.ndarray:
+    """
+    Clusters exact and near duplicate texts with MinHash and LSH.
+
+    Args:
+        texts (Sequence[str]): The texts.
+        threshold (float, optional): Minimum estimated Jaccard similarity of the word 3-grams of two texts to
+            consider them duplicates. Default is 0.8.
+        groups (Optional[Sequence], optional): A key per text (e.g. the place): only texts with the same key can be
+            duplicates. Default is None (across all texts).
+        num_perm (int, optional): Length of the MinHash signatures. Default is 64.
+        bands (int, optional): Number of LSH bands; `num_perm` must be a multiple of it. Default is 8.
+
+    Returns:
+        np.ndarray: For each text, the position of the first text of its cluster (itself if it has no duplicates).
+    """
+    count = len(texts)
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+    group_codes = pd.factorize(pd.Series(groups))[0] if groups is not None else np.zeros(count, dtype=np.int64)
+
+    # Exact duplicates are collapsed first, so that MinHash only runs on distinct texts
+    exact = (
+        pd.DataFrame({"group": group_codes, "text": pd.Series(texts, dtype=object).fillna("").str.lower().str.strip()})
+        .groupby(["group", "text"], sort=False)
+        .ngroup()
+        .to_numpy()
+    )
+    _, first_positions = np.unique(exact, return_index=True)
+    clusters = _lsh_clusters(
+        [texts[idx] for idx in first_positions], group_codes[first_positions], threshold, num_perm, bands
+    )
+    return first_positions[clusters][exact]
+
+
+def _lsh_clusters(
+    texts: Sequence[str], group_codes: np.ndarray, threshold: float, num_perm: int, bands: int
+) -> np.ndarray:
+    count = len(texts)
+    signatures = minhash_signatures(texts, num_perm=num_perm)
+    group_codes = group_codes.astype(np.uint64)[:, None]
+
+    rows = num_perm // bands
+    pairs = []
+    for band in range(bands):
+        keys = np.ascontiguousarray(np.hstack([group_codes, signatures[:, band * rows : (band + 1) * rows]]))
+        _, bucket = np.unique(
+            keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel(), return_inverse=True
+        )
+        bucket = bucket.ravel()
+        # Pairs every text with the first text of its bucket
+        order = np.argsort(bucket, kind="stable")
+        sorted_buckets = bucket[order]
+        starts = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+        leaders = order[np.maximum.accumulate(np.where(starts, np.arange(count), 0))]
+        candidates = order != leaders
+        pairs.append(leaders[candidates].astype(np.int64) * count + order[candidates])
+
+    pairs = np.unique(np.concatenate(pairs))
+    pairs = np.stack([pairs // count, pairs % count], axis=1)
+    if len(pairs):
+        similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        pairs = pairs[similarity >= threshold]
+
+    parent = np.arange(count)
+
+    def find(idx: int) -> int:
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    for first, second in pairs.tolist():
+        root_a, root_b = find(first), find(second)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return np.array([find(idx) for idx in range(count)])
+
+
+def dedup_reviews(
+    store: pd.DataFrame,
+    text_column: str = "review",
+    by: Optional[str] = None,
+    threshold: float = SIMILARITY_THRESHOLD,
+) -> pd.DataFrame:
+    """
+    Collapses exact and near duplicate reviews, keeping the first of each cluster.
+
+    Args:
+        store (pd.DataFrame): DataFrame containing the reviews data.
+        text_column (str, optional): The column with the review texts. Default is "review".
+        by (Optional[str], optional): A column (e.g. "name" or "place_url") limiting duplicates to rows sharing its
+            value. Default is None (across the whole store).
+        threshold (float, optional): Minimum estimated similarity of two duplicates. Default is 0.8.
+
+    Returns:
+        pd.DataFrame: The deduplicated reviews, with a "count" column holding how many reviews each row stands for
+            (an existing "count" column is summed).
+    """
+    if store.empty:
+        return store.assign(**{COUNT_COLUMN: pd.Series(dtype=int)})
+    store = store.reset_index(drop=True)
+    clusters = near_duplicate_groups(
+        store[text_column].fillna("").astype(str).tolist(),
+        threshold=threshold,
+        groups=store[by].tolist() if by else None,
+    )
+    weights = store[COUNT_COLUMN] if COUNT_COLUMN in store.columns else pd.Series(1, index=store.index)
+    counts = weights.groupby(clusters).sum()
+    deduplicated = store.loc[np.unique(clusters)].copy()
+    deduplicated[COUNT_COLUMN] = counts.loc[deduplicated.index].to_numpy()
+    logger.debug(f"Collapsed {len(store)} reviews into {len(deduplicated)}")
+    return deduplicated.reset_index(drop=True)
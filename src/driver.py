@@ -12,16 +12,88 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.remote.webdriver import WebDriver
 
-from typing import Optional
-
+from typing import List, Optional
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
 import threading
+import time
+import weakref
 
 
 from src.logger import get_logger
+from src.metrics import metrics
 
 logger = get_logger(__name__)
 
+
+# Seconds a thread waits for a free pooled driver before giving up
+CHECKOUT_TIMEOUT = 600
+# Launches tried before the pool gives up on replacing a driver
+REPLACE_ATTEMPTS = 2
+
+# "default" loads place pages as a user would, "lean" skips everything the scraper does not read
+BROWSER_PROFILES = ("default", "lean")
+# Resources blocked by the lean profile: images (photos, avatars, map tiles), fonts and media
+LEAN_BLOCKED_URLS = [
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.ico*",
+    "*googleusercontent.com/*", "*/maps/vt*", "*/kh/v=*", "*/maps/preview/photo*",
+    "*.woff*", "*.ttf*", "*.otf*", "*fonts.gstatic.com/*",
+    "*.mp4*", "*.webm*", "*.m3u8*",
+]
+LEAN_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.default_content_setting_values.notifications": 2,
+    "profile.default_content_setting_values.geolocation": 2,
+    "profile.default_content_setting_values.media_stream": 2,
+}
+LEAN_ARGUMENTS = [
+    "--blink-settings=imagesEnabled=false",
+    "--mute-audio",
+    "--autoplay-policy=user-gesture-required",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,BackForwardCache",
+]
+
+
+class InstrumentedChrome(webdriver.Chrome):
+    """Chrome WebDriver counting and timing each WebDriver round trip (the commands of its elements included)."""
+
+    # Live instances, so that the resource governor can measure and stop runaway browsers
+    _instances: "weakref.WeakSet[InstrumentedChrome]" = weakref.WeakSet()
+    _instances_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with InstrumentedChrome._instances_lock:
+            InstrumentedChrome._instances.add(self)
+
+    @classmethod
+    def live_instances(cls) -> List["InstrumentedChrome"]:
+        with cls._instances_lock:
+            return list(cls._instances)
+
+    @property
+    def service_pid(self) -> Optional[int]:
+        """PID of the chromedriver process, the parent of the browser processes."""
+        process = getattr(getattr(self, "service", None), "process", None)
+        return getattr(process, "pid", None)
+
+    def execute(self, driver_command: str, params: Optional[dict] = None) -> dict:
+        started = time.perf_counter()
+        try:
+            return super().execute(driver_command, params)
+        finally:
+            metrics.inc("webdriver_round_trips", command=driver_command)
+            metrics.observe("webdriver_command_seconds", time.perf_counter() - started, command=driver_command)
+
+
 class WebDriverManager:
     _instance = None
     _lock = threading.Lock()
@@ -31,35 +103,326 @@ class WebDriverManager:
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(WebDriverManager, cls).__new__(cls)
+                cls._instance._pool = None
+                cls._instance._pool_headless = True
+                cls._instance._pool_max_pages = None
+                cls._instance._profile = os.environ.get("BROWSER_PROFILE", "default")
+                # Drivers the pool should own, and drivers it owns (idle or checked out)
+                cls._instance._pool_size = 0
+                cls._instance._pool_live = 0
+                cls._instance._pages_served = {}
+                cls._instance._cookies_accepted = set()
         return cls._instance
 
+    def set_profile(self, profile: str):
+        """
+        Sets the profile of the drivers launched from now on.
+
+        Args:
+            profile (str): "default", or "lean" to block images, map tiles, fonts and media, turn off the background
+                features of Chrome and return from `driver.get` as soon as the DOM is parsed.
+
+        Raises:
+            ValueError: If the profile is unknown.
+
+        Notes:
+            - The profile can also be set with BROWSER_PROFILE in the environment.
+            - Drivers already running (e.g. in a pool) keep their profile.
+        """
+        if profile not in BROWSER_PROFILES:
+            raise ValueError(f"Unknown browser profile {profile!r}, use one of {', '.join(BROWSER_PROFILES)}")
+        self._profile = profile
+
+    @property
+    def profile(self) -> str:
+        return self._profile
+
+    @staticmethod
+    def _chrome_options(headless: Optional[bool] = True, profile: str = "default") -> Options:
+        options = Options()
+        if headless:
+            options.add_argument("--headless")
+            options.add_argument("window-size=1920,1980")
+            options.add_argument("start-maximized")
+            options.add_argument("disable-infobars")
+            options.add_argument("--disable-extensions")
+            options.add_argument("--no-sandbox")
+            options.add_argument("--disable-dev-shm-usage")
+        if profile == "lean":
+            # Reviews are read through waits on their elements, so the page does not need to finish loading
+            options.page_load_strategy = "eager"
+            options.add_experimental_option("prefs", LEAN_PREFS)
+            for argument in LEAN_ARGUMENTS:
+                options.add_argument(argument)
+        return options
+
+    def _create_driver(self, headless: Optional[bool] = True) -> WebDriver:
+        driver = InstrumentedChrome(options=self._chrome_options(headless, self._profile))
+        if self._profile == "lean":
+            # Fonts and media have no content setting: their requests are failed by the network domain instead
+            try:
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+            except Exception as e:
+                logger.warning(f"Failed to block resources of a lean WebDriver instance: {e}")
+        return driver
+
     def get_driver(self, headless: Optional[bool] = True) -> WebDriver:
+        """Returns the WebDriver of the current thread. If a pool is running, a driver is checked out from it (waiting for a free one), otherwise a new one is launched"""
         if not hasattr(self._thread_local, 'driver') or not isinstance(self._thread_local.driver, WebDriver):
-            options = Options()
-            if headless:
-                options.add_argument("--headless")
-                options.add_argument("window-size=1920,1980")
-                options.add_argument("start-maximized")
-                options.add_argument("disable-infobars")
-                options.add_argument("--disable-extensions")
-                options.add_argument("--no-sandbox")
-                options.add_argument("--disable-dev-shm-usage")
-            self._thread_local.driver = webdriver.Chrome(options=options)
-            logger.debug(f"Initiated a new instance of Selenium WebDriver for thread {threading.get_ident()}")
+            if self._pool is not None:
+                self._thread_local.driver = self.checkout()
+            else:
+                self._thread_local.driver = self._create_driver(headless)
+                self._thread_local.pooled = False
+                logger.debug(f"Initiated a new instance of Selenium WebDriver for thread {threading.get_ident()}")
         return self._thread_local.driver
 
     def close_driver(self):
+        """Releases the WebDriver of the current thread: pooled drivers go back to the pool, the others are quit"""
         if hasattr(self._thread_local, 'driver') and isinstance(self._thread_local.driver, WebDriver):
-            self._thread_local.driver.close()
-            logger.debug(f"Closed Selenium WebDriver instance for thread {threading.get_ident()}")
+            if getattr(self._thread_local, 'pooled', False):
+                self.checkin(self._thread_local.driver)
+            else:
+                self._quit(self._thread_local.driver)
+                logger.debug(f"Closed Selenium WebDriver instance for thread {threading.get_ident()}")
+        self._thread_local.driver = None
+        self._thread_local.pooled = False
+
+    def _quit(self, driver: WebDriver):
+        with self._lock:
+            self._cookies_accepted.discard(driver.session_id)
+            self._pages_served.pop(driver.session_id, None)
+        try:
+            # quit() (unlike close()) also stops the chromedriver process
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Failed to quit a WebDriver instance: {e}")
+
+    def start_pool(self, size: int, headless: Optional[bool] = True, max_pages: Optional[int] = 50):
+        """
+        Launches a pool of warm WebDriver instances, shared by all threads.
+
+        Args:
+            size (int): The number of drivers to pre-launch.
+            headless (Optional[bool], optional): Whether the drivers run headless. Default is True.
+            max_pages (Optional[int], optional): A driver is quit and replaced after serving this many checkouts,
+                to bound its memory growth. None never recycles. Default is 50.
+
+        Raises:
+            Exception: The error of the first driver failing to launch. The pool is then not started, and the drivers
+                already launched are quit.
+
+        Notes:
+            - While the pool is running, `get_driver` checks a driver out and `close_driver` returns it.
+            - Drivers keep their cookies between places, so the cookies banner is only accepted once per driver.
+        """
+        with self._lock:
+            if self._pool is not None:
+                logger.debug("WebDriver pool already running.")
+                return
+            self._pool_headless = headless
+            self._pool_max_pages = max_pages
+            pool = self._pool = queue.Queue()
+            self._pool_size = size
+            self._pool_live = size
+
+        drivers, error = [], None
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(self._launch) for _ in range(size)]
+            for future in futures:
+                try:
+                    drivers.append(future.result())
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            with self._lock:
+                self._pool = None
+                self._pool_size = self._pool_live = 0
+            for driver in drivers:
+                self._quit(driver)
+            logger.error(f"Failed to start the WebDriver pool: {error}")
+            raise error
+
+        for driver in drivers:
+            pool.put(driver)
+        logger.debug(f"Started a pool of {size} WebDriver instances")
+
+    def _launch(self) -> WebDriver:
+        driver = self._create_driver(self._pool_headless)
+        with self._lock:
+            self._pages_served[driver.session_id] = 0
+        return driver
+
+    def _replace(self, driver: WebDriver) -> Optional[WebDriver]:
+        """Quits a pooled driver and launches its replacement. If every launch fails, the pool gives up the slot and
+        None is returned"""
+        self._quit(driver)
+        for attempt in range(1, REPLACE_ATTEMPTS + 1):
+            try:
+                return self._launch()
+            except Exception as e:
+                logger.error(f"Failed to launch a pooled WebDriver instance (attempt {attempt}/{REPLACE_ATTEMPTS}): {e}")
+        with self._lock:
+            self._pool_live -= 1
+        return None
+
+    def checkout(self, timeout: Optional[float] = CHECKOUT_TIMEOUT) -> WebDriver:
+        """
+        Takes a healthy driver from the pool and binds it to the current thread, waiting up to `timeout` seconds
+        for a free one.
+
+        Raises:
+            RuntimeError: If the pool is not running, or has no driver left.
+            TimeoutError: If no driver was freed within `timeout` seconds.
+        """
+        pool = self._pool
+        if pool is None:
+            raise RuntimeError("The WebDriver pool is not running, call start_pool first")
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                live = self._pool_live
+            if live <= 0 and pool.empty():
+                raise RuntimeError("The WebDriver pool has no driver left, all of them failed to launch")
+            try:
+                driver = pool.get(timeout=max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+            except queue.Empty:
+                raise TimeoutError(f"No pooled WebDriver instance was freed within {timeout}s") from None
+            if self._is_healthy(driver):
+                break
+            logger.debug("Replacing an unhealthy pooled WebDriver instance")
+            driver = self._replace(driver)
+            if driver is not None:
+                break
+
+        self._thread_local.driver = driver
+        self._thread_local.pooled = True
+        return driver
+
+    def checkin(self, driver: WebDriver):
+        """Resets a pooled driver and puts it back in the pool, recycling it if it served too many pages or is broken"""
         self._thread_local.driver = None
+        self._thread_local.pooled = False
+        if self._pool is None:
+            # The pool was shut down while the driver was checked out
+            self._quit(driver)
+            return
+        with self._lock:
+            shrink = self._pool_live > self._pool_size
+            if shrink:
+                self._pool_live -= 1
+        if shrink:
+            # The pool was resized down while the driver was checked out
+            self._quit(driver)
+            return
+
+        with self._lock:
+            pages = self._pages_served[driver.session_id] = self._pages_served.get(driver.session_id, 0) + 1
+        recycle = bool(self._pool_max_pages) and pages >= self._pool_max_pages
+        if not recycle:
+            try:
+                # Drops the page (and its memory) while keeping cookies
+                driver.get("about:blank")
+            except Exception as e:
+                logger.debug(f"Failed to reset a pooled WebDriver instance: {e}")
+                recycle = True
+
+        if recycle:
+            driver = self._replace(driver)
+            if driver is None:
+                return
+            logger.debug("Recycled a pooled WebDriver instance")
+        self._put_back(driver)
+
+    def _put_back(self, driver: WebDriver):
+        """Puts a driver in the pool, or quits it if the pool was shut down in the meantime"""
+        with self._lock:
+            # Checked under the lock, so that shutdown_pool cannot drain the pool between the check and the put
+            pool = self._pool
+            if pool is not None:
+                pool.put(driver)
+        if pool is None:
+            self._quit(driver)
+
+    def resize_pool(self, size: int):
+        """Grows or shrinks the pool to `size` drivers. Idle drivers in excess are quit right away, checked out ones
+        when they are checked in"""
+        with self._lock:
+            if self._pool is None:
+                return
+            self._pool_size = max(1, size)
+            missing = self._pool_size - self._pool_live
+            self._pool_live += max(0, missing)
+
+        for _ in range(missing):
+            try:
+                self._put_back(self._launch())
+            except Exception as e:
+                logger.error(f"Failed to launch a pooled WebDriver instance while resizing the pool: {e}")
+                with self._lock:
+                    self._pool_live -= 1
+        while missing < 0:
+            try:
+                driver = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pool_live -= 1
+            self._quit(driver)
+            missing += 1
+        logger.debug(f"Resized the WebDriver pool to {size} instances")
+
+    @staticmethod
+    def kill_driver(driver: WebDriver):
+        """Stops a browser from another thread, e.g. one using too much memory. A pooled driver is replaced the next
+        time it is checked out or in, and the place being scraped with it fails"""
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Failed to kill a WebDriver instance: {e}")
+
+    def shutdown_pool(self):
+        """Quits every idle driver of the pool. Drivers still checked out are quit when they are checked in"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        while True:
+            try:
+                self._quit(pool.get_nowait())
+            except queue.Empty:
+                break
+        logger.debug("Shut down the WebDriver pool")
+
+    @staticmethod
+    def _is_healthy(driver: WebDriver) -> bool:
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def needs_cookies_acceptance(self, driver: WebDriver) -> bool:
+        with self._lock:
+            return driver.session_id not in self._cookies_accepted
+
+    def mark_cookies_accepted(self, driver: WebDriver):
+        with self._lock:
+            self._cookies_accepted.add(driver.session_id)
 
 
 def accept_cookies_conditions():
-    driver = WebDriverManager().get_driver(headless=None)
+    driver_manager = WebDriverManager()
+    driver = driver_manager.get_driver(headless=None)
+    if not driver_manager.needs_cookies_acceptance(driver):
+        logger.debug("Cookies conditions already accepted by this driver.")
+        return
     try:
         accept_button = WebDriverWait(driver=driver, timeout=5).until(EC.presence_of_element_located((By.XPATH, "//button[@class='VfPpkd-LgbsSe VfPpkd-LgbsSe-OWXEXe-k8QpJ VfPpkd-LgbsSe-OWXEXe-dgl2Hf nCP5yc AjY5Oe DuMIQc LQeN7 XWZjwc']")))
         accept_button.click()
         logger.debug("Accepted cookies conditions.")
     except (NoSuchElementException, TimeoutException):
-        logger.error("Failed to find the accept cookies button.")
\ No newline at end of file
+        logger.error("Failed to find the accept cookies button.")
+    # A driver without a banner (e.g. a profile with cookies already accepted) would otherwise wait for it every page
+    driver_manager.mark_cookies_accepted(driver)
\ No newline at end of file
@@ -1,69 +1,195 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import json
+import os
 import pandas as pd
 from tqdm import tqdm
+from src.driver import WebDriverManager
 from src.extract_reviews import extract_place
+from src.governor import ConcurrencyGovernor
+from src.journal import RunJournal, journal_log_path, journal_path_for
+from src.metrics import metrics
+from src.sinks import open_sink
+from src.prefilter import prefilter_stats
+from src.waits import wait_stats
 
 
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Union
 
 from src.logger import get_logger
 
 logger = get_logger(__name__)
 
+MAX_WORKERS = 5
+# Places fetched at the same time by the HTTP engine, which needs no browser
+HTTP_MAX_WORKERS = 16
 
 def extract_places_batch(
-    topic: str,
+    topic: Union[str, List[str]],
     limit: int,
     list_of_places_urls: Optional[List[str]] = None,
     input_file: Optional[str] = None,
-) -> pd.DataFrame:
+    use_driver_pool: bool = True,
+    pages_per_driver: Optional[int] = 50,
+    output_file: Optional[str] = None,
+    materialize: bool = True,
+    resume: bool = False,
+    metrics_path: Optional[str] = None,
+    engine: str = "selenium",
+    sort: str = "relevant",
+    stop_at_review_ids: Optional[Dict[str, Iterable[str]]] = None,
+    max_workers: Optional[Union[int, str]] = None,
+    browser_profile: Optional[str] = None,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+) -> Optional[pd.DataFrame]:
     """
     Processes a batch of Google Maps place URLs to extract reviews related to a specific topic.
 
     Args:
-        topic (str): The specific topic or keyword to search for in the reviews.
-        limit (int): The maximum number of reviews to collect for each place.
+        topic (Union[str, List[str]]): The specific topic or keyword to search for in the reviews. With a list of
+            topics, each place is loaded once and searched for every topic, and the rows get a "topic" column.
+        limit (int): The maximum number of reviews to collect for each place (and topic).
         list_of_places_urls (Optional[List[str]], optional): A list of Google Maps place URLs to process. Default is None.
         input_file (Optional[str], optional): The file path to load a list of URLs from a JSON file. Default is None.
+        use_driver_pool (bool, optional): Whether to reuse a pool of warm browsers across places instead of launching
+            one per place. Default is True.
+        pages_per_driver (Optional[int], optional): With the pool, how many places a browser serves before being
+            replaced. Default is 50.
+        output_file (Optional[str], optional): A .csv or .parquet file where the reviews are streamed as soon as each
+            place is done. Default is None (kept in memory).
+        materialize (bool, optional): Whether to load and return all the reviews at the end. Set it to False with an
+            `output_file` to keep memory bounded on large batches. Default is True.
+        resume (bool, optional): Whether to resume the run that was writing to the CSV `output_file`: finished places
+            are skipped and partially scraped ones continue from the reviews they already went through. Default is False.
+        metrics_path (Optional[str], optional): If given, the metrics of the run (see `src.metrics`) are written to
+            "<metrics_path>.json" and "<metrics_path>.prom" at the end. Default is None.
+        engine (str, optional): "selenium" or "http", see `extract_place`. With "http" no browser pool is started
+            and up to 16 places are fetched at a time. Default is "selenium".
+        sort (str, optional): The order reviews are gone through, "relevant" or "newest". Default is "relevant".
+        stop_at_review_ids (Optional[Dict[str, Iterable[str]]], optional): The review IDs already stored for each
+            place URL, where collection stops (see `extract_place`). Default is None.
+        max_workers (Optional[Union[int, str]], optional): The number of places processed at the same time. "auto"
+            lets a `ConcurrencyGovernor` adapt it (and the browser pool) to the measured throughput, errors and browser
+            memory, and kill runaway browsers. Default is None: 5 with the browser, 16 with the HTTP engine.
+        browser_profile (Optional[str], optional): "lean" launches browsers that skip images, map tiles, fonts and
+            media, see `WebDriverManager.set_profile`. Default is None (the profile already set, "default" unless
+            BROWSER_PROFILE is set in the environment).
+        prefilter (bool, optional): Whether to score reviews locally before asking the LLM for their chunks, see
+            `pick_topic_relevant_chunks_batch`. Default is False.
+        synonyms (Optional[Union[List[str], Dict[str, List[str]]]], optional): Other words for the topic used by the
+            prefilter, or a dict mapping each topic to its synonyms. Default is None.
 
     Returns:
-        pd.DataFrame: A DataFrame containing all the extracted reviews related to the topic from the batch of URLs.
+        Optional[pd.DataFrame]: A DataFrame containing all the extracted reviews related to the topic from the batch of URLs,
+            or None if `materialize` is False.
+
+    Raises:
+        ValueError: If `resume` is set without a CSV `output_file`, or if `max_workers` is invalid.
 
     Notes:
         - If both `list_of_places_urls` and `input_file` are provided, the function will prioritize `list_of_places_urls`.
         - The function uses `ThreadPoolExecutor` for parallel processing of multiple URLs to speed up extraction.
+        - Browsers are fully quit at the end of the batch, even if it is interrupted.
         - The final DataFrame aggregates reviews from all processed URLs.
+        - With a CSV `output_file`, reviews are flushed to disk page by page and a run journal (status, collected
+          reviews and last review ID of each place) is kept next to it, in "<output_file>.journal.json".
     """
 
     list_of_places_urls = loads_urls(list_of_places_urls, input_file)
 
-    # Initialize an empty DataFrame
-    final_store = pd.DataFrame()
+    if resume and not (output_file and output_file.endswith(".csv")):
+        raise ValueError("Resuming a batch requires the CSV output_file it was writing to")
+
+    # Reviews are streamed to the sink as they are collected, and checkpointed when writing to a CSV file
+    journal = None
+    if output_file and output_file.endswith(".csv"):
+        journal_path = journal_path_for(output_file)
+        if not resume:
+            for path in (journal_path, journal_log_path(journal_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+        journal = RunJournal(journal_path)
+        journal.start(list_of_places_urls, topic=topic, limit=limit)
+        list_of_places_urls = journal.urls_to_process(list_of_places_urls)
+        logger.debug(f"Run journal: {journal.summary()}")
+    sink = open_sink(output_file, append=resume)
 
     logger.debug(f"Starting batch extraction of {len(list_of_places_urls)} places...")
-    # Use ThreadPoolExecutor for parallel execution
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {
-            executor.submit(extract_place, topic, url, limit): url
-            for url in list_of_places_urls
-        }
-
-        for future in tqdm(
-            as_completed(futures), total=len(futures), desc="Processing Places", postfix="\n"
-        ):
-            try:
-                results_store = future.result()
-
-                if not isinstance(results_store, pd.DataFrame):
-                    logger.error(f"Expected DataFrame from extract_place, got {type(results_store)}")
-                elif not results_store.empty:
-                    final_store = pd.concat([final_store, results_store], ignore_index=True)
-            except Exception as e:
-                logger.error(f"Error processing a place: {e}")
-
-    logger.debug(f"Completed batch extraction. Total extracted reviews: {len(final_store)}")
-    return final_store
+    # Places falling back from the HTTP engine launch their own browser
+    use_driver_pool = use_driver_pool and engine == "selenium"
+    driver_manager = WebDriverManager()
+    if browser_profile is not None:
+        driver_manager.set_profile(browser_profile)
+    workers = max_workers if isinstance(max_workers, int) else (HTTP_MAX_WORKERS if engine == "http" else MAX_WORKERS)
+    governor = None
+    if max_workers == "auto":
+        governor = ConcurrencyGovernor(
+            max_workers=4 * HTTP_MAX_WORKERS if engine == "http" else None,
+            initial_workers=min(workers, max(1, len(list_of_places_urls))),
+            on_resize=driver_manager.resize_pool if use_driver_pool else None,
+        )
+        workers = governor.max_workers
+        logger.info(f"Adapting concurrency between {governor.min_workers} and {governor.max_workers} workers")
+    elif max_workers is not None and not isinstance(max_workers, int):
+        raise ValueError(f"Invalid max_workers {max_workers!r}, use an int or 'auto'")
+
+    def process(url: str):
+        with governor.slot() if governor is not None else nullcontext():
+            return extract_place(
+                topic,
+                url,
+                limit,
+                sink=sink,
+                journal=journal,
+                engine=engine,
+                sort=sort,
+                stop_at_review_ids=(stop_at_review_ids or {}).get(url),
+                prefilter=prefilter,
+                synonyms=synonyms,
+            )
+
+    try:
+        if use_driver_pool and list_of_places_urls:
+            driver_manager.start_pool(
+                size=governor.target if governor else min(workers, len(list_of_places_urls)),
+                max_pages=pages_per_driver,
+            )
+        if governor is not None:
+            governor.start()
+        # Use ThreadPoolExecutor for parallel execution
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(process, url): url
+                for url in list_of_places_urls
+            }
+
+            for future in tqdm(
+                as_completed(futures), total=len(futures), desc="Processing Places", postfix="\n"
+            ):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error processing a place: {e}")
+                    if journal is not None:
+                        journal.mark_failed(futures[future], str(e))
+    finally:
+        if governor is not None:
+            governor.stop()
+            logger.info(f"Concurrency governor: {governor.summary()}")
+        if use_driver_pool:
+            driver_manager.shutdown_pool()
+        sink.close()
+
+    logger.debug(f"Completed batch extraction. Total extracted reviews: {sink.records_written}")
+    if journal is not None:
+        journal.compact()
+        logger.info(f"Run journal: {journal.summary()}")
+    logger.info(f"Wait stats: {wait_stats.summary()}")
+    logger.info(f"Prefilter stats: {prefilter_stats.summary()}")
+    if metrics_path:
+        metrics.write_report(metrics_path)
+    return sink.to_dataframe() if materialize else None
  
 
 
@@ -11,90 +11,302 @@ from src.extract_support import (
     extract_place_info,
     navigate_to_reviews,
     discover_reviews,
-    process_reviews,simplify_url
+    process_reviews_records,simplify_url,
+    records_from_raw_reviews,
+    ReviewCursor,
+    SORT_ORDERS,
 )
+from src.http_reviews import SORT_ORDERS as HTTP_SORT_ORDERS, HttpEngineError, fetch_place, iter_review_pages
+from src.journal import RunJournal
+from src.metrics import metrics
+from src.sinks import MemorySink, RecordSink
 
 
 from traceback import format_exc
 
+import threading
 import pandas as pd
-from typing import Optional
-
-import time
-import random
+from typing import Dict, Iterable, List, Optional, Union
 
 from src.logger import get_logger
 
 logger = get_logger(__name__)
 
+ENGINES = ("selenium", "http")
+# Browsers launched at the same time by places falling back from the HTTP engine
+_FALLBACK_BROWSERS = threading.BoundedSemaphore(5)
+
 
 def extract_place(
-    topic: str,
+    topic: Union[str, List[str]],
     place_gmaps_url: str,
     limit: Optional[int] = None,
     store: Optional[pd.DataFrame] = None,
+    sink: Optional[RecordSink] = None,
+    journal: Optional[RunJournal] = None,
+    extract_chunks: bool = True,
+    engine: str = "selenium",
+    sort: str = "relevant",
+    stop_at_review_ids: Optional[Iterable[str]] = None,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
 ) -> pd.DataFrame:
     """Extracts and collects reviews related to a specific topic from a Google Maps place page.
 
     Args:
-        topic (str): The specific topic or keyword to search for in the reviews.
+        topic (Union[str, List[str]]): The specific topic or keyword to search for in the reviews. With a list of
+            topics, the place is loaded once and searched for each topic in turn, and every row gets a "topic" column.
         place_gmaps_url (str): The URL of the Google Maps place from which to extract reviews.
         store (Optional[pd.DataFrame], optional): An existing DataFrame to update with the newly collected reviews.
             If None, a new DataFrame will be created. Default is None.
-        limit (Optional[int], optional): The maximum number of reviews to collect. If None, all available reviews
-            related to the topic will be collected. Default is None.
+        limit (Optional[int], optional): The maximum number of reviews to collect (for each topic). If None, all
+            available reviews related to the topic will be collected. Default is None.
+        sink (Optional[RecordSink], optional): If given, reviews are appended to it page by page as they are collected,
+            and an empty DataFrame is returned. Default is None.
+        journal (Optional[RunJournal], optional): If given, the progress of the place is checkpointed in it after every
+            page, and reviews it records as already discovered are skipped. Default is None.
+        extract_chunks (bool, optional): Whether to reduce each review to its topic-relevant chunks with the LLM.
+            With False the full texts are collected and the browser never waits on the LLM. Default is True.
+        engine (str, optional): "selenium" scrapes the place page in a browser. "http" fetches the place page and its
+            pages of reviews directly, without a browser, and falls back to "selenium" for the reviews it could not
+            get. Default is "selenium".
+        sort (str, optional): The order reviews are gone through, "relevant" or "newest". Default is "relevant".
+        stop_at_review_ids (Optional[Iterable[str]], optional): Review IDs already stored for this place. With
+            sort="newest", collection stops at the first of them, so that only the reviews posted since are
+            collected. Default is None.
+        prefilter (bool, optional): Whether to score reviews locally before asking the LLM for their chunks, see
+            `pick_topic_relevant_chunks_batch`. Default is False.
+        synonyms (Optional[Union[List[str], Dict[str, List[str]]]], optional): Other words for the topic used by the
+            prefilter, or a dict mapping each topic to its synonyms. Default is None.
 
     Returns:
         pd.DataFrame: A DataFrame containing the collected reviews related to the specified topic.
 
+    Raises:
+        ValueError: If the engine or the sort order is unknown.
+
     Notes:
         - The function initializes a WebDriver instance to navigate to the provided Google Maps place URL.
         - It then navigates to the reviews section, searches for the specified topic, and collects relevant reviews.
         - If errors occur during navigation or review collection (e.g., due to timeouts, JavaScript errors, or WebDriver issues),
           the function will skip the place and print an error message.
         - The function returns an updated DataFrame containing the newly collected reviews along with any previously stored reviews.
+        - With the "http" engine, place details are limited to the name and address found in the static page.
+        - A review relevant to several topics is returned once per topic.
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', use one of {ENGINES}")
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order '{sort}', use one of {list(SORT_ORDERS)}")
+    tag_topic = not isinstance(topic, str)
+    topics = list(dict.fromkeys(topic)) if tag_topic else [topic]
+
     local_store = pd.DataFrame()
+    own_sink = sink is None
+    sink = MemorySink() if own_sink else sink
+
+    # One discovery cursor per topic, in the order the topics are searched
+    searches: Dict[str, ReviewCursor] = {}
+    for search_topic in topics:
+        cursor = ReviewCursor(stop_ids=stop_at_review_ids)
+        if journal is not None:
+            if tag_topic and journal.topic_done(place_gmaps_url, search_topic):
+                continue
+            # Continues a partially scraped place from the reviews it already went through
+            journal_topic = search_topic if tag_topic else None
+            cursor = ReviewCursor(
+                seen_ids=journal.seen_review_ids(place_gmaps_url, journal_topic), stop_ids=stop_at_review_ids
+            )
+            cursor.discovered = len(cursor.seen_ids)
+        searches[search_topic] = cursor
+    if journal is not None:
+        journal.mark_in_progress(place_gmaps_url)
+
+    chunk_options = {"prefilter": prefilter, "synonyms": synonyms}
+    # Costs are broken down per place in the metrics report
+    with metrics.place_context(simplify_url(place_gmaps_url)), metrics.span("extract_place"):
+        if not searches:
+            journal.mark_done(place_gmaps_url, journal.collected(place_gmaps_url))
+        elif engine == "selenium":
+            _extract_place_selenium(
+                place_gmaps_url, limit, sink, searches, journal, extract_chunks, tag_topic, sort=sort, **chunk_options
+            )
+        else:
+            completed = _extract_place_http(
+                place_gmaps_url, limit, sink, searches, journal, extract_chunks, tag_topic, sort=sort, **chunk_options
+            )
+            remaining = {key: cursor for key, cursor in searches.items() if key not in completed}
+            if remaining:
+                # The browser continues from the reviews the cursors already went through, scrolling past them
+                metrics.inc("engine_fallbacks", engine=engine)
+                for topic_key, cursor in remaining.items():
+                    logger.debug(f"The browser scrolls past {len(cursor.seen_ids)} reviews about '{topic_key}' first")
+                with _FALLBACK_BROWSERS:
+                    _extract_place_selenium(
+                        place_gmaps_url, limit, sink, remaining, journal, extract_chunks, tag_topic, sort=sort, **chunk_options
+                    )
 
+    if own_sink:
+        local_store = sink.to_dataframe()
+    if store is not None:
+        logger.debug("Merging collected reviews with existing store.")
+        return pd.concat([store, local_store], ignore_index=True)
+    return local_store
+
+
+def _topic_place_info(place_info: dict, topic: str, tag_topic: bool) -> dict:
+    return {**place_info, "topic": topic} if tag_topic else place_info
+
+
+def _extract_place_selenium(
+    place_gmaps_url: str,
+    limit: Optional[int],
+    sink: RecordSink,
+    searches: Dict[str, ReviewCursor],
+    journal: Optional[RunJournal],
+    extract_chunks: bool,
+    tag_topic: bool,
+    sort: str = "relevant",
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+):
     # Each thread will initialize its own WebDriver
     driver_manager = WebDriverManager()
     driver = driver_manager.get_driver(headless=True)
     logger.debug(f"Navigating to {simplify_url(place_gmaps_url)}")
 
-    # Waits a random amount of time to avoid calls all together
-    time.sleep(random.randint(0, 4) / 10)
-
     try:
         driver.get(place_gmaps_url)
         accept_cookies_conditions()
 
         place_info = extract_place_info(place_gmaps_url)
-        navigate_to_reviews(place_gmaps_url=place_gmaps_url, topic=topic)
+        all_completed = True
+        # Every topic is searched in the same page, which is only loaded once
+        for topic, cursor in searches.items():
+            navigate_to_reviews(place_gmaps_url=place_gmaps_url, topic=topic, sort=sort)
+            cursor.new_page()
 
-        local_store = _collect_reviews(topic, place_info, limit)
-        logger.debug(
-            f"Collected {len(local_store)} reviews for {place_info.get('name', None) or simplify_url(place_gmaps_url)}"
-        )
+            collected, completed = _collect_reviews(
+                topic,
+                _topic_place_info(place_info, topic, tag_topic),
+                limit,
+                sink,
+                cursor,
+                journal,
+                extract_chunks=extract_chunks,
+                journal_topic=topic if tag_topic else None,
+                prefilter=prefilter,
+                synonyms=synonyms,
+            )
+            metrics.inc("reviews_collected", collected)
+            logger.debug(
+                f"Collected {collected} reviews about '{topic}' for "
+                f"{place_info.get('name', None) or simplify_url(place_gmaps_url)}"
+            )
+            if journal is not None and tag_topic and completed:
+                journal.mark_topic_done(place_gmaps_url, topic)
+            all_completed = all_completed and completed
+
+        if not all_completed:
+            metrics.inc("place_errors", engine="selenium")
+        if journal is not None:
+            if all_completed:
+                journal.mark_done(place_gmaps_url, journal.collected(place_gmaps_url))
+            else:
+                journal.mark_failed(place_gmaps_url, "Review collection interrupted")
 
     except WebDriverException as e:
+        metrics.inc("place_errors", engine="selenium")
         logger.error(
             f"Error in processing {simplify_url(place_gmaps_url)}, will skip it. Details: {e}"
         )
+        if journal is not None:
+            journal.mark_failed(place_gmaps_url, str(e))
     finally:
         driver_manager.close_driver()
 
-    if store:
-        logger.debug("Merging collected reviews with existing store.")
-        return pd.concat([store, local_store], ignore_index=True)
-    return local_store
+
+def _extract_place_http(
+    place_gmaps_url: str,
+    limit: Optional[int],
+    sink: RecordSink,
+    searches: Dict[str, ReviewCursor],
+    journal: Optional[RunJournal],
+    extract_chunks: bool,
+    tag_topic: bool,
+    sort: str = "relevant",
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+) -> List[str]:
+    """
+    Collects the reviews of a place with the HTTP engine, topic after topic.
+
+    Returns:
+        List[str]: The topics whose reviews were all gone through. The reviews already collected for the other topics
+            are in the sink and in their cursor, so that the browser continues from them.
+    """
+    completed = []
+    collected = 0
+    try:
+        place_info, place_id = fetch_place(place_gmaps_url)
+        for topic, cursor in searches.items():
+            topic_place_info = _topic_place_info(place_info, topic, tag_topic)
+            for raw_reviews in iter_review_pages(
+                place_gmaps_url, place_id, topic, cursor, limit, sort=HTTP_SORT_ORDERS[sort]
+            ):
+                new_reviews = records_from_raw_reviews(
+                    topic,
+                    raw_reviews,
+                    topic_place_info,
+                    extract_chunks=extract_chunks,
+                    prefilter=prefilter,
+                    synonyms=synonyms,
+                )
+                sink.append(new_reviews)
+                collected += len(new_reviews)
+                if journal is not None:
+                    # Reviews must be on disk before the journal says they were collected
+                    sink.flush()
+                    journal.record_progress(
+                        place_gmaps_url,
+                        cursor.seen_ids,
+                        journal.collected(place_gmaps_url) + len(new_reviews),
+                        cursor.last_review_id,
+                        topic=topic if tag_topic else None,
+                    )
+            completed.append(topic)
+            if journal is not None and tag_topic:
+                journal.mark_topic_done(place_gmaps_url, topic)
+    except HttpEngineError as e:
+        logger.warning(
+            f"HTTP engine failed on {simplify_url(place_gmaps_url)} after {collected} reviews, "
+            f"falling back to the browser. Details: {e}"
+        )
+        return completed
+    finally:
+        metrics.inc("reviews_collected", collected)
+
+    logger.debug(f"Collected {collected} reviews for {place_info.get('name', None) or simplify_url(place_gmaps_url)}")
+    if journal is not None:
+        journal.mark_done(place_gmaps_url, journal.collected(place_gmaps_url))
+    return completed
 
 
 @retry(
     exceptions=[WebDriverException, TimeoutException], tries=2, delay=1, jitter=(1, 3), logger=logger
 )
 def _collect_reviews(
-    topic: str, place_info: dict, limit: Optional[int]
-) -> pd.DataFrame:
+    topic: str,
+    place_info: dict,
+    limit: Optional[int],
+    sink: RecordSink,
+    cursor: ReviewCursor,
+    journal: Optional[RunJournal] = None,
+    extract_chunks: bool = True,
+    journal_topic: Optional[str] = None,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+) -> tuple[int, bool]:
     """
     Collects reviews related to a specific topic from the Google Maps place page.
 
@@ -102,30 +314,59 @@ def _collect_reviews(
         topic (str): The specific topic or keyword to search for in the reviews.
         place_info (dict): A dictionary containing information about the place.
         limit (Optional[int], optional): The maximum number of reviews to collect. Default is None.
+        sink (RecordSink): Where the collected reviews are appended, page by page.
+        cursor (ReviewCursor): The discovery cursor, shared across retries so that they resume where they left.
+        journal (Optional[RunJournal], optional): Where progress is checkpointed after every page. Default is None.
+        extract_chunks (bool, optional): Whether to reduce reviews to their topic-relevant chunks. Default is True.
+        journal_topic (Optional[str], optional): The topic progress is checkpointed under, when a place is searched
+            for several topics. Default is None.
+        prefilter (bool, optional): Whether to score reviews locally before the LLM. Default is False.
+        synonyms (Optional[Union[List[str], Dict[str, List[str]]]], optional): Other words for the topic, used by
+            the prefilter. Default is None.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the collected reviews.
+        tuple[int, bool]: The number of reviews appended to the sink, and whether all of them were gone through
+            (False if collection stopped on an error or before the list was exhausted, a stop ID or the limit).
     """
-    local_store = pd.DataFrame()
-    reviews_list = discover_reviews(limit=limit)
+    collected = 0
+    url = place_info["place_url"]
+    reviews_list = discover_reviews(cursor=cursor, limit=limit)
     still_to_go = True
 
     while still_to_go:
         try:
-            new_reviews = process_reviews(
-                topic=topic, reviews_list=reviews_list, place_info=place_info
+            new_reviews = process_reviews_records(
+                topic=topic,
+                reviews_list=reviews_list,
+                place_info=place_info,
+                extract_chunks=extract_chunks,
+                prefilter=prefilter,
+                synonyms=synonyms,
             )
-            local_store = pd.concat([local_store, new_reviews], ignore_index=True)
+            sink.append(new_reviews)
+            collected += len(new_reviews)
+            if journal is not None:
+                # Reviews must be on disk before the journal says they were collected
+                sink.flush()
+                journal.record_progress(
+                    url,
+                    cursor.seen_ids,
+                    journal.collected(url) + len(new_reviews),
+                    cursor.last_review_id,
+                    topic=journal_topic,
+                )
 
-            reviews_list = discover_reviews(
-                last_cc_element=reviews_list[-1] if len(reviews_list) > 0 else None,
-                limit=limit,
-            )
+            reviews_list = discover_reviews(cursor=cursor, limit=limit)
 
             if len(reviews_list) == 0:
                 still_to_go = False
 
         except (TimeoutException, JavascriptException, WebDriverException) as e:
             logger.error(f"Error during an iteration in review processing - Details: {e}. Will resume from where I left.")
-            still_to_go = False
-    return local_store
+            return collected, False
+    # Discovery only comes back empty-handed once the list is exhausted, a stop ID is met or the limit is reached
+    limit_reached = limit is not None and limit > 0 and cursor.discovered >= limit
+    completed = cursor.exhausted or cursor.reached_stop or limit_reached
+    if not completed:
+        logger.warning(f"Review discovery of {url} ended before the end of the list")
+    return collected, completed
@@ -1,7 +1,8 @@
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Iterable, Dict, Union
+import json
+import uuid
 from selenium.webdriver.remote.webelement import WebElement
 import pandas as pd
-import time
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
@@ -9,6 +10,8 @@ from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 from src.driver import WebDriverManager
+from src.metrics import metrics
+from src.waits import wait_for_dom_idle, wait_until
 
 from src.logger import get_logger
 
@@ -22,29 +25,147 @@ REVIEW_DATE_EL_CLASS = "rsqaWe"
 REVIEW_POSITIVE_STAR_EL_CLASS = "hCCjke.google-symbols.NhBTye.elGi1d"
 REVIEW_SECTION_EL_XPATH = "//div[contains(@class, 'pV4rW q8YqMd')]//div[contains(@class, 'etWJQ kdfrQc NUqjXc')]//button[contains(@class, 'g88MCb S9kvJb')]"
 REVIEWS_SEARCHBOX_EL_CLASS = "sW8iyd"
-
-
+REVIEW_ID_ATTRIBUTE = "data-review-id"
+SORT_BUTTON_CSS = 'button[data-value="Sort"]'
+SORT_MENU_ITEM_CSS = 'div[role="menuitemradio"]'
+# Position of each sort order in the sort menu of the reviews tab
+SORT_ORDERS = {"relevant": 0, "newest": 1}
+
+CURSOR_ATTRIBUTE = "data-gmaps-cursor"
+# When the reviews of a row were read, which their relative dates ("a week ago") refer to
+SCRAPED_AT_COLUMN = "scraped_at"
+
+# Returns (and tags with the cursor token) up to maxCount review nodes not yet returned to this cursor, with
+# their review ID. When there are none, scrolls the last review into view so that the next page gets loaded.
+DISCOVER_NEW_REVIEWS_JS = """
+const [selector, idAttribute, cursorAttribute, token, maxCount] = arguments;
+const fresh = document.querySelectorAll(`${selector}:not([${cursorAttribute}="${token}"])`);
+if (fresh.length === 0) {
+    const all = document.querySelectorAll(selector);
+    if (all.length > 0) { all[all.length - 1].scrollIntoView({block: "center"}); }
+    return [];
+}
+const found = [];
+for (const el of fresh) {
+    if (maxCount !== null && found.length >= maxCount) { break; }
+    el.setAttribute(cursorAttribute, token);
+    found.push([el, el.getAttribute(idAttribute)]);
+}
+return found;
+"""
+
+# Expands every "More" button and reads all the review fields in a single WebDriver round trip.
+# The last review is scrolled into view so that the next page of reviews starts loading.
+BULK_EXTRACT_REVIEWS_JS = """
+const [reviewEls, selectors] = arguments;
+const toSelector = (cls) => "." + cls;
+for (const el of reviewEls) {
+    const moreButton = el.querySelector(toSelector(selectors.more));
+    if (moreButton) { moreButton.click(); }
+}
+const records = reviewEls.map((el) => {
+    const textEl = el.querySelector(toSelector(selectors.text));
+    const dateEl = el.querySelector(toSelector(selectors.date));
+    return {
+        review_id: el.getAttribute(selectors.idAttribute),
+        review: textEl ? textEl.innerText : "",
+        date: dateEl ? dateEl.innerText : "",
+        score: el.querySelectorAll(toSelector(selectors.star)).length,
+    };
+});
+if (reviewEls.length > 0) {
+    reviewEls[reviewEls.length - 1].scrollIntoView({block: "center"});
+}
+return JSON.stringify(records);
+"""
+
+
+class ReviewCursor:
+    """
+    Remembers which reviews of the current page have already been discovered, so that each pass of
+    `discover_reviews` only returns the ones appended since the previous pass.
+
+    Args:
+        seen_ids (Optional[Iterable[str]], optional): Review IDs to skip, e.g. collected by a previous run. Default is None.
+        stop_ids (Optional[Iterable[str]], optional): Review IDs ending the discovery: with reviews sorted by newest,
+            the first one already stored means the rest are stored too. Default is None.
+    """
+
+    def __init__(self, seen_ids: Optional[Iterable[str]] = None, stop_ids: Optional[Iterable[str]] = None):
+        self.token = uuid.uuid4().hex[:12]
+        self.seen_ids = set(seen_ids or ())
+        self.stop_ids = set(stop_ids or ())
+        self.reached_stop = False
+        # Set once no more review loaded within the timeout of `discover_reviews`: the list is at its end
+        self.exhausted = False
+        self.discovered = 0
+        self.last_review_id: Optional[str] = None
+
+    def take(self, review_ids: List[Optional[str]]) -> int:
+        """Checks the IDs of newly found reviews, in page order, and returns how many of them to go through: all of
+        them, or up to the first stop ID. Reviews already seen are left to the caller to skip"""
+        for position, review_id in enumerate(review_ids):
+            if review_id is not None and review_id in self.stop_ids:
+                self.reached_stop = True
+                return position
+        return len(review_ids)
+
+    def new_page(self):
+        """Starts discovering a freshly loaded list of reviews (e.g. the browser taking over from the HTTP engine):
+        its elements are not tagged yet, and the reviews already seen are scrolled past until new ones load"""
+        self.token = uuid.uuid4().hex[:12]
+        self.exhausted = False
+
+
+@metrics.timed()
 def discover_reviews(
-    last_cc_element: Optional[WebElement] = None, limit: Optional[int] = None
+    cursor: Optional[ReviewCursor] = None,
+    limit: Optional[int] = None,
+    new_reviews_timeout: float = 5,
 ) -> List[WebElement]:
+    """Returns the review elements loaded since the last call with the same cursor, waiting up to new_reviews_timeout seconds for the next page to load. At most `limit` reviews are discovered by a cursor.
+    Reviews already seen by the cursor (e.g. collected before a resume) are scrolled past, so an empty list means that
+    the limit or a stop ID was reached, or that no more review loaded: the list is then marked as `cursor.exhausted`"""
     driver = WebDriverManager().get_driver()
-
-    all_reviews_els = driver.find_elements(By.CLASS_NAME, REVIEWS_ELS_CLASS)
-    logger.debug(f"Found {len(all_reviews_els)} review elements.")
-
-    # If a limit is provided, slice the list to only include up to that many elements
-    if limit is not None and limit > 0:
-        all_reviews_els = all_reviews_els[:limit]
-
-    # If last_cc_element is provided, find its index and return elements after it
-    if last_cc_element:
-        try:
-            idx = all_reviews_els.index(last_cc_element)
-            new_els = all_reviews_els[idx + 1 :]
-        except ValueError:
-            new_els = all_reviews_els  # last_cc_element not found, return all
-    else:
-        new_els = all_reviews_els
+    cursor = cursor or ReviewCursor()
+
+    new_els = []
+    while not new_els:
+        if cursor.reached_stop:
+            logger.debug("Reached a review already stored.")
+            return []
+        remaining = None
+        if limit is not None and limit > 0:
+            remaining = limit - cursor.discovered
+            if remaining <= 0:
+                logger.debug("Review limit reached.")
+                return []
+
+        found = wait_until(
+            driver,
+            lambda driver: driver.execute_script(
+                DISCOVER_NEW_REVIEWS_JS, "." + REVIEWS_ELS_CLASS, REVIEW_ID_ATTRIBUTE, CURSOR_ATTRIBUTE, cursor.token, remaining
+            ),
+            timeout=new_reviews_timeout,
+            label="new_reviews",
+        ) or []
+        if not found:
+            cursor.exhausted = True
+            logger.debug("No more reviews loaded.")
+            return []
+
+        for review_el, review_id in found[: cursor.take([review_id for _, review_id in found])]:
+            # Re-rendered nodes lose the cursor tag, their ID tells them apart
+            if review_id is not None and review_id in cursor.seen_ids:
+                continue
+            if review_id is not None:
+                cursor.seen_ids.add(review_id)
+                cursor.last_review_id = review_id
+            new_els.append(review_el)
+        cursor.discovered += len(new_els)
+        if not new_els:
+            # Only seen reviews on this pass: they are now tagged, so the next pass scrolls to load more
+            logger.debug(f"Skipped {len(found)} review elements already seen.")
 
     logger.debug(f"Returning {len(new_els)} new review elements.")
     return new_els
@@ -70,23 +191,104 @@ def get_url_element(
         return default
 
 
+@metrics.timed()
+def extract_reviews_bulk(reviews_list: List[WebElement]) -> List[dict[str, Any]]:
+    """Expands and reads all the given review elements with a single execute_script call, returning review_id, review, date and score for each"""
+    if not reviews_list:
+        return []
+    driver = WebDriverManager().get_driver()
+    selectors = {
+        "more": MORE_BTN_CLASS,
+        "text": REVIEW_TEXT_EL_CLASS,
+        "date": REVIEW_DATE_EL_CLASS,
+        "star": REVIEW_POSITIVE_STAR_EL_CLASS,
+        "idAttribute": REVIEW_ID_ATTRIBUTE,
+    }
+    return json.loads(driver.execute_script(BULK_EXTRACT_REVIEWS_JS, reviews_list, selectors))
+
+
 def process_reviews(
     topic: str,
     reviews_list: List[WebElement],
     place_info: Optional[dict[str, Any]] = None,
+    bulk: bool = True,
 ) -> pd.DataFrame:
-    """Runs through the list of reviews, extracts the relevant information and stores them in a pandas store. It will also include place_info in the row, if provided"""
-    review_data_list = []
-    from src.clean_review import pick_topic_relevant_chunks
-    driver = WebDriverManager().get_driver()
+    """Runs through the list of reviews, extracts the relevant information and stores them in a pandas store. It will also include place_info in the row, if provided.
+    Topic-relevant chunks are extracted for the whole list at once, with batched LLM requests.
+    With bulk=True (default) the whole list is read in one WebDriver round trip, otherwise each review is scrolled to and read one by one."""
+    return pd.DataFrame(
+        process_reviews_records(topic=topic, reviews_list=reviews_list, place_info=place_info, bulk=bulk)
+    )
+
 
+@metrics.timed("process_reviews")
+def process_reviews_records(
+    topic: str,
+    reviews_list: List[WebElement],
+    place_info: Optional[dict[str, Any]] = None,
+    bulk: bool = True,
+    extract_chunks: bool = True,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+) -> List[dict[str, Any]]:
+    """Same as process_reviews, returning the rows as a list of records instead of a DataFrame.
+    With extract_chunks=False the full review texts are returned, leaving the LLM chunk extraction to the caller.
+    prefilter and synonyms are passed to `pick_topic_relevant_chunks_batch`."""
     logger.debug(f"Processing {len(reviews_list)} reviews for topic '{topic}'.")
 
+    if bulk:
+        raw_reviews = extract_reviews_bulk(reviews_list)
+    else:
+        raw_reviews = _extract_reviews_one_by_one(reviews_list)
+
+    return records_from_raw_reviews(
+        topic, raw_reviews, place_info, extract_chunks=extract_chunks, prefilter=prefilter, synonyms=synonyms
+    )
+
+
+def records_from_raw_reviews(
+    topic: str,
+    raw_reviews: List[dict[str, Any]],
+    place_info: Optional[dict[str, Any]] = None,
+    extract_chunks: bool = True,
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+) -> List[dict[str, Any]]:
+    """Turns raw reviews (review_id, review, date and score), however they were read, into rows with the place_info
+    and when they were read ("scraped_at", in ISO format).
+    With extract_chunks=True each review is reduced to its topic-relevant chunks and irrelevant ones are dropped,
+    optionally scoring them locally first (prefilter and synonyms, see `pick_topic_relevant_chunks_batch`)."""
+    from src.clean_review import pick_topic_relevant_chunks_batch
+
+    # Stamped before the LLM calls, as close as possible to when the page was loaded
+    scraped_at = pd.Timestamp.now().isoformat()
+    if not extract_chunks:
+        return [
+            {**raw, **(place_info or {}), SCRAPED_AT_COLUMN: scraped_at} for raw in raw_reviews if raw["review"]
+        ]
+
+    relevant_texts = pick_topic_relevant_chunks_batch(
+        texts=[raw["review"] for raw in raw_reviews], topic=topic, prefilter=prefilter, synonyms=synonyms
+    )
+    review_data_list = [
+        {**raw, "review": relevant_text, **(place_info or {}), SCRAPED_AT_COLUMN: scraped_at}
+        for raw, relevant_text in zip(raw_reviews, relevant_texts)
+        if relevant_text
+    ]
+
+    logger.debug(f"Processed {len(review_data_list)} relevant reviews.")
+    return review_data_list
+
+
+def _extract_reviews_one_by_one(reviews_list: List[WebElement]) -> List[dict[str, Any]]:
+    raw_reviews = []
+    driver = WebDriverManager().get_driver()
+
     for review_el in reviews_list:
         driver.execute_script(
             "arguments[0].scrollIntoView({block: 'center'});", review_el
         )
-        time.sleep(1)
+        wait_for_dom_idle(driver, idle_ms=200, timeout=1, label="review_scroll")
 
         try:
             more_button = review_el.find_element(By.CLASS_NAME, MORE_BTN_CLASS)
@@ -104,26 +306,25 @@ def process_reviews(
             review_score = len(
                 review_el.find_elements(By.CLASS_NAME, REVIEW_POSITIVE_STAR_EL_CLASS)
             )
-
-            relevant_text = pick_topic_relevant_chunks(text=review, topic=topic)
-            if relevant_text:
-                review_data_list.append(
-                    {
-                        "review": relevant_text,
-                        "date": date,
-                        "score": review_score,
-                        **place_info,
-                    }
-                )
+            raw_reviews.append(
+                {
+                    "review_id": review_el.get_attribute(REVIEW_ID_ATTRIBUTE),
+                    "review": review,
+                    "date": date,
+                    "score": review_score,
+                }
+            )
         except Exception as e:
             logger.error(f"Failed to extract data from an element: {e}")
 
-    logger.debug(f"Processed {len(review_data_list)} relevant reviews.")
-    return pd.DataFrame(review_data_list)
+    return raw_reviews
 
 from urllib3.exceptions import HTTPError
 
-def navigate_to_reviews(place_gmaps_url: str, topic: str):
+@metrics.timed()
+def navigate_to_reviews(place_gmaps_url: str, topic: str, timeout: float = 10, sort: str = "relevant"):
+    """Opens the reviews tab of the place page and searches the topic in its reviews. Called again on the same page,
+    it replaces the previous search. With sort="newest" the reviews are then sorted from the most recent one"""
     try:
         driver = WebDriverManager().get_driver()
         reviews_section = WebDriverWait(driver=driver, timeout=10).until(
@@ -133,10 +334,23 @@ def navigate_to_reviews(place_gmaps_url: str, topic: str):
             "arguments[0].scrollIntoView({block: 'center'});", reviews_section
         )
         reviews_section.click()
+        # Reviews of a previous search in the same page are replaced by the ones of this search
+        previous_reviews = driver.find_elements(By.CLASS_NAME, REVIEWS_ELS_CLASS)[:1]
         reviews_search_box = driver.find_element(By.CLASS_NAME, REVIEWS_SEARCHBOX_EL_CLASS)
+        reviews_search_box.clear()
         reviews_search_box.send_keys(topic)
         reviews_search_box.send_keys(Keys.RETURN)
-        time.sleep(3)
+        if previous_reviews:
+            wait_until(driver, EC.staleness_of(previous_reviews[0]), timeout=timeout, label="reviews_replaced")
+        wait_until(
+            driver,
+            EC.presence_of_element_located((By.CLASS_NAME, REVIEWS_ELS_CLASS)),
+            timeout=timeout,
+            label="reviews_present",
+        )
+        wait_for_dom_idle(driver, timeout=timeout, label="reviews_search")
+        if sort != "relevant":
+            sort_reviews(sort, timeout=timeout)
         logger.debug(f"Navigated to reviews section for URL: {simplify_url(place_gmaps_url)}")
     except HTTPError as e:
         logger.error(f"Couldn't connect to URL: {simplify_url(place_gmaps_url)}")
@@ -145,6 +359,37 @@ def navigate_to_reviews(place_gmaps_url: str, topic: str):
 
 
 
+def sort_reviews(sort: str, timeout: float = 10):
+    """Picks a sort order (see SORT_ORDERS) in the sort menu of the open reviews tab, and waits for the reviews to be
+    reloaded in that order"""
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order '{sort}', use one of {list(SORT_ORDERS)}")
+    driver = WebDriverManager().get_driver()
+    previous_reviews = driver.find_elements(By.CLASS_NAME, REVIEWS_ELS_CLASS)[:1]
+
+    WebDriverWait(driver=driver, timeout=timeout).until(
+        EC.element_to_be_clickable((By.CSS_SELECTOR, SORT_BUTTON_CSS))
+    ).click()
+    menu_items = wait_until(
+        driver,
+        lambda driver: driver.find_elements(By.CSS_SELECTOR, SORT_MENU_ITEM_CSS),
+        timeout=timeout,
+        label="sort_menu",
+        raise_on_timeout=True,
+    )
+    menu_items[SORT_ORDERS[sort]].click()
+
+    if previous_reviews:
+        wait_until(driver, EC.staleness_of(previous_reviews[0]), timeout=timeout, label="reviews_replaced")
+    wait_until(
+        driver,
+        EC.presence_of_element_located((By.CLASS_NAME, REVIEWS_ELS_CLASS)),
+        timeout=timeout,
+        label="reviews_present",
+    )
+    wait_for_dom_idle(driver, timeout=timeout, label="reviews_sort")
+
+
 ORIGINAL_MUSEUM_NAME_CLASS = "bwoZTb"
 ENG_MUSEUM_NAME_CLASS = "DUwDvf.lfPIob"
 DESCRIPTION_CLASS = "PYvSYb"
@@ -153,6 +398,7 @@ ADDRESS_CLASS = 'button[data-item-id="address"] .Io6YTe'
 PHONE_CLASS = 'button[data-item-id*="phone"] .Io6YTe'
 WEB_CLASS = 'a[data-item-id="authority"]'
 
+@metrics.timed()
 def extract_place_info(place_gmaps_url: str = None) -> dict[str, str]:
 
     driver = WebDriverManager().get_driver()
@@ -180,6 +426,19 @@ def extract_place_info(place_gmaps_url: str = None) -> dict[str, str]:
 
 import re
 
+# Place IDs ("feature IDs") appear in place URLs (after "!1s") and in place pages
+PLACE_ID_PATTERN = re.compile(r"(0x[0-9a-f]+:0x[0-9a-f]+)")
+
+
+def place_id_from_url(url: str) -> str:
+    """Returns the place ID of a Google Maps place URL. URLs without one are returned without their query string,
+    so that the same place found from different searches or viewports has the same ID"""
+    match = PLACE_ID_PATTERN.search(url)
+    if match:
+        return match.group(1)
+    return url.split("?", 1)[0]
+
+
 def simplify_url(url):
     # The regex pattern to extract the desired part of the URL
     pattern = r"^https:\/\/www\.google\.com\/maps\/place\/[^\/]+\/"
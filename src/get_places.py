@@ -1,12 +1,17 @@
 from src.driver import WebDriverManager, accept_cookies_conditions
+from src.extract_support import place_id_from_url
+from src.waits import wait_for_count_change, wait_stats
 
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
-import time
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchWindowException
+from selenium.common.exceptions import NoSuchWindowException, TimeoutException, WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, List
+from urllib.parse import quote_plus
+import math
 from IPython.display import Image, display
 
 
@@ -17,13 +22,22 @@ logger = get_logger(__name__)
 SEARCH_RESULT_ELEMENT = "a.hfpxzc"
 SEARCH_BOX_EL_ID = "searchboxinput"
 
+# Maps lists at most about this many results for a search, whatever the size of the viewport
+MAPS_RESULTS_CAP = 120
+# Width in pixels of the map area covered by each tile, at the chosen zoom
+TILE_PIXELS = 1024
+MAX_WORKERS = 5
+
 
 def gather_all_places(
     query: str,
     language: str = "en",
     coordinates: tuple[float, float, float] = (42.010398, 2.1113405, 10.1),
     output_file: Optional[str] = None,
-    limit: Optional[int] = None
+    limit: Optional[int] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    zoom: float = 15,
+    max_workers: int = MAX_WORKERS,
 ) -> list[str]:
     """
     Gathers a list of places corresponding to a given search query on Google Maps.
@@ -35,17 +49,26 @@ def gather_all_places(
             and zoom level to start the search from. Default is (42.010398, 2.1113405, 10.1).
         output_file (Optional[str], optional): The file path to store the collected URLs. Default is None.
         limit (Optional[int]): Limit the number of outputs
+        bbox (Optional[tuple[float, float, float, float]], optional): A bounding box (south, west, north, east) to
+            search without any interaction: it is split into tiles searched in parallel headless browsers, see
+            `gather_places_tiled`. Default is None (interactive search around `coordinates`).
+        zoom (float, optional): With `bbox`, the zoom level of the tiles. Default is 15.
+        max_workers (int, optional): With `bbox`, the number of browsers searching tiles at the same time. Default is 5.
 
     Returns:
         list[str]: A list of URLs for the places found corresponding to the search query.
 
     Notes:
-        - The function opens Google Maps in a web browser and prompts the user to manually zoom in on the
+        - Without `bbox`, the function opens Google Maps in a web browser and prompts the user to manually zoom in on the
           desired area before starting the extraction process.
         - The user is required to press Enter to start the extraction after zooming in.
         - The function continues scrolling through the search results until all results are collected.
         - If an output_file is provided, the results will be stored in the specified file as a JSON list.
     """
+    if bbox is not None:
+        return gather_places_tiled(
+            query, bbox, zoom=zoom, language=language, output_file=output_file, limit=limit, max_workers=max_workers
+        )
 
     driver_manager = WebDriverManager()
     driver = driver_manager.get_driver(headless=False)
@@ -71,41 +94,179 @@ def gather_all_places(
 
         display(Image(driver.get_screenshot_as_png(), width=600))
 
-        previous_count = 0
+        _collect_search_results(driver, places_urls, limit)
 
-        while True:
-            search_result_els = driver.find_elements(By.CSS_SELECTOR, SEARCH_RESULT_ELEMENT)
-            current_count = len(search_result_els)
 
-            if current_count == previous_count:
-                break
+    except (KeyboardInterrupt, NoSuchWindowException) as e:
+        logger.error("Early termination or window closed. Returning results collected so far.")
+        
+    finally:
+        logger.debug(f"Finished gathering places. Total places found: {len(places_urls)}")
+        logger.debug(f"Wait stats: {wait_stats.summary()}")
+        driver_manager.close_driver()
 
-            for place in search_result_els[previous_count:]:
-                driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", place)
-                url = place.get_attribute('href')
-                if url and url not in places_urls:
-                    places_urls.append(url)
+    if output_file:
+        store_output(places_urls, output_file)
 
-            if limit and current_count>= limit:
-                break
+    return places_urls
 
-            previous_count = current_count
-            time.sleep(2)
 
-        if limit and current_count> limit:
-            places_urls = places_urls[:limit]
+def _collect_search_results(driver: WebDriver, places_urls: List[str], limit: Optional[int] = None) -> List[str]:
+    """Scrolls through the search results of the page, appending the new place URLs to `places_urls` until no more
+    results load or `limit` results were listed"""
+    previous_count = 0
+    current_count = 0
 
+    while True:
+        search_result_els = driver.find_elements(By.CSS_SELECTOR, SEARCH_RESULT_ELEMENT)
+        current_count = len(search_result_els)
 
-    except (KeyboardInterrupt, NoSuchWindowException) as e:
-        logger.error("Early termination or window closed. Returning results collected so far.")
-        
+        if current_count == previous_count:
+            break
+
+        for place in search_result_els[previous_count:]:
+            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", place)
+            url = place.get_attribute('href')
+            if url and url not in places_urls:
+                places_urls.append(url)
+
+        if limit and current_count>= limit:
+            break
+
+        previous_count = current_count
+        wait_for_count_change(driver, SEARCH_RESULT_ELEMENT, current_count, timeout=10, label="search_results")
+
+    if limit and len(places_urls) > limit:
+        del places_urls[limit:]
+    return places_urls
+
+
+def split_bbox(bbox: tuple[float, float, float, float], zoom: float) -> List[tuple[float, float]]:
+    """
+    Splits a bounding box into the centres of the tiles covering it at a zoom level.
+
+    Args:
+        bbox (tuple[float, float, float, float]): The bounding box, as (south, west, north, east) in degrees.
+        zoom (float): The zoom level of the tiles, as in Maps URLs.
+
+    Returns:
+        List[tuple[float, float]]: The (latitude, longitude) of the centre of each tile, row after row.
+
+    Raises:
+        ValueError: If the bounding box is empty.
+    """
+    south, west, north, east = bbox
+    if south >= north or west >= east:
+        raise ValueError(f"Invalid bounding box {bbox}, expected (south, west, north, east)")
+
+    # Degrees of longitude covered by TILE_PIXELS at this zoom, and the matching latitude span (Web Mercator)
+    lon_span = 360 * TILE_PIXELS / (256 * 2**zoom)
+    lat_span = lon_span * math.cos(math.radians((south + north) / 2))
+
+    rows = max(1, math.ceil((north - south) / lat_span))
+    columns = max(1, math.ceil((east - west) / lon_span))
+    return [
+        (south + (north - south) * (row + 0.5) / rows, west + (east - west) * (column + 0.5) / columns)
+        for row in range(rows)
+        for column in range(columns)
+    ]
+
+
+def _search_tile(query: str, center: tuple[float, float], zoom: float, language: str) -> List[str]:
+    """Searches the query in the viewport of a tile, returning the URLs of all the places listed"""
+    driver_manager = WebDriverManager()
+    driver = driver_manager.get_driver(headless=True)
+    places_urls = []
+    try:
+        driver.get(
+            f"https://www.google.com/maps/search/{quote_plus(query)}/@{center[0]:.6f},{center[1]:.6f},{zoom}z?hl={language}"
+        )
+        accept_cookies_conditions()
+        try:
+            WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.CSS_SELECTOR, SEARCH_RESULT_ELEMENT)))
+        except TimeoutException:
+            # No results, or a single one opened directly as a place page
+            if "/maps/place/" in driver.current_url:
+                places_urls.append(driver.current_url)
+            return places_urls
+        _collect_search_results(driver, places_urls)
     finally:
-        logger.debug(f"Finished gathering places. Total places found: {len(places_urls)}")
         driver_manager.close_driver()
 
+    if len(places_urls) >= MAPS_RESULTS_CAP:
+        logger.warning(
+            f"The tile at {center} listed {len(places_urls)} places, the most Maps shows: some may be missing, "
+            f"use a higher zoom"
+        )
+    return places_urls
+
+
+def gather_places_tiled(
+    query: str,
+    bbox: tuple[float, float, float, float],
+    zoom: float = 15,
+    language: str = "en",
+    output_file: Optional[str] = None,
+    limit: Optional[int] = None,
+    max_workers: int = MAX_WORKERS,
+) -> list[str]:
+    """
+    Gathers the places matching a query over a whole area, without any interaction.
+
+    Args:
+        query (str): The search query to find places on Google Maps.
+        bbox (tuple[float, float, float, float]): The area to search, as (south, west, north, east) in degrees.
+        zoom (float, optional): The zoom level of each tile. Higher zooms give smaller tiles, so more of them, each
+            less likely to hit the cap on the results Maps lists for a search. Default is 15.
+        language (str, optional): The language to be used in Google Maps. Default is "en" (English).
+        output_file (Optional[str], optional): The file path to store the collected URLs. Default is None.
+        limit (Optional[int], optional): Stop once this many distinct places are found. Default is None.
+        max_workers (int, optional): The number of headless browsers searching tiles at the same time. Default is 5.
+
+    Returns:
+        list[str]: The URLs of the places found, one per place.
+
+    Notes:
+        - Places are told apart by their place ID: the same place listed by several tiles has different URLs.
+        - Tiles hitting the results cap are logged, as a hint to search again at a higher zoom.
+        - A tile failing in the browser, or for which no pooled browser could be checked out, is skipped and logged;
+          the places of the other tiles are still returned.
+    """
+    tiles = split_bbox(bbox, zoom)
+    logger.info(f"Searching '{query}' in {len(tiles)} tiles at zoom {zoom}")
+
+    places_by_id: dict[str, str] = {}
+    driver_manager = WebDriverManager()
+    try:
+        driver_manager.start_pool(size=min(max_workers, len(tiles)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_search_tile, query, center, zoom, language): center for center in tiles}
+            for future in as_completed(futures):
+                try:
+                    tile_urls = future.result()
+                except WebDriverException as e:
+                    logger.error(f"Failed to search the tile at {futures[future]}, skipping it. Details: {e}")
+                    continue
+                except (RuntimeError, TimeoutError) as e:
+                    # Raised by the checkout of a pooled browser: none was freed in time, or none is left
+                    logger.error(f"No browser to search the tile at {futures[future]}, skipping it. Details: {e}")
+                    continue
+                for url in tile_urls:
+                    places_by_id.setdefault(place_id_from_url(url), url)
+                logger.debug(f"Tile at {futures[future]}: {len(tile_urls)} places, {len(places_by_id)} distinct so far")
+
+                if limit and len(places_by_id) >= limit:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+    finally:
+        driver_manager.shutdown_pool()
+        logger.debug(f"Wait stats: {wait_stats.summary()}")
+
+    places_urls = list(places_by_id.values())[:limit] if limit else list(places_by_id.values())
+    logger.info(f"Found {len(places_urls)} distinct places in {len(tiles)} tiles")
     if output_file:
         store_output(places_urls, output_file)
-
     return places_urls
 
 
@@ -0,0 +1,289 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from src.metrics import metrics
+from src.waits import wait_stats
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Seconds between two adjustments of the number of workers
+ADJUST_INTERVAL = 30.0
+# Share of the places of a window failing (or of the waits timing out) above which workers are halved
+ERROR_RATE_LIMIT = 0.2
+# Waits that only time out when Maps throttles or shows a consent wall (running out of reviews is expected)
+THROTTLE_WAIT_LABELS = ("reviews_present", "reviews_replaced", "sort_menu")
+# Share of the available memory the browsers may use, when no ceiling is given
+MEMORY_SHARE = 0.8
+# Memory of a single browser above which it is considered runaway, killed and replaced
+BROWSER_MEMORY_LIMIT_MB = 2048
+# Memory assumed for a browser before any is measured
+BROWSER_ESTIMATE_MB = 400
+# Windows during which workers are not added again after an addition made throughput worse
+GROWTH_COOLDOWN = 3
+
+
+def _process_table() -> Dict[int, Tuple[int, int]]:
+    """Maps the PID of every process to its parent PID and resident memory in KB."""
+    if psutil is not None:
+        table = {}
+        for process in psutil.process_iter(["ppid", "memory_info"]):
+            memory = process.info.get("memory_info")
+            table[process.pid] = (process.info.get("ppid") or 0, memory.rss // 1024 if memory else 0)
+        return table
+
+    table = {}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        rss = int(fields["VmRSS"].split()[0]) if "VmRSS" in fields else 0
+        table[int(pid)] = (int(fields.get("PPid", "0").strip()), rss)
+    return table
+
+
+def process_tree_rss_mb(root_pid: int, table: Optional[Dict[int, Tuple[int, int]]] = None) -> float:
+    """Resident memory of a process and all its descendants, in MB."""
+    table = table if table is not None else _process_table()
+    children: Dict[int, List[int]] = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    total, frontier = 0, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        total += table.get(pid, (0, 0))[1]
+        frontier.extend(children.get(pid, []))
+    return total / 1024
+
+
+def available_memory_mb() -> Optional[float]:
+    """Memory available to new processes, in MB, or None if it cannot be read."""
+    if psutil is not None:
+        return psutil.virtual_memory().available / 2**20
+    try:
+        with open("/proc/meminfo", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["MemAvailable"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def measure_browsers() -> List[Tuple[Any, float]]:
+    """Returns every live browser with the resident memory (in MB) of its chromedriver and Chrome processes."""
+    from src.driver import InstrumentedChrome
+
+    drivers = [driver for driver in InstrumentedChrome.live_instances() if driver.service_pid]
+    if not drivers:
+        return []
+    table = _process_table()
+    return [(driver, process_tree_rss_mb(driver.service_pid, table)) for driver in drivers]
+
+
+class ConcurrencyGovernor:
+    """
+    Adapts the number of places processed at the same time to what the machine and Maps sustain.
+
+    Args:
+        min_workers (int, optional): The fewest workers allowed. Default is 1.
+        max_workers (Optional[int], optional): The most workers allowed. Default is None: as many browsers as fit in
+            the memory ceiling, up to twice the number of CPUs.
+        initial_workers (Optional[int], optional): Workers to start with. Default is None (min(5, max_workers)).
+        memory_limit_mb (Optional[float], optional): Ceiling on the memory of all the browsers. Default is None:
+            80% of the memory available when the governor is created.
+        browser_memory_limit_mb (float, optional): Memory above which a single browser is killed and replaced.
+            Default is 2048.
+        interval (float, optional): Seconds between two adjustments. Default is 30.
+        on_resize (Optional[Callable[[int], None]], optional): Called with the new number of workers after each
+            change, e.g. to resize the browser pool. Default is None.
+
+    Notes:
+        - Workers wrap each place in `slot()`, which blocks while the target number of workers is busy.
+        - Every `interval` seconds, the governor looks at the places completed, the failed places and the throttling
+          timeouts of the window, and at the memory of the browsers:
+            - failures or timeouts above 20% halve the workers (throttling or consent walls),
+            - browsers above the memory ceiling remove a worker,
+            - otherwise a worker is added if there is memory for one more browser, and removed again if the
+              throughput of the next window is lower, after which growth pauses for a few windows.
+        - Browsers above `browser_memory_limit_mb` are killed at every check: the place they were scraping fails and
+          the pool replaces them.
+    """
+
+    def __init__(
+        self,
+        min_workers: int = 1,
+        max_workers: Optional[int] = None,
+        initial_workers: Optional[int] = None,
+        memory_limit_mb: Optional[float] = None,
+        browser_memory_limit_mb: float = BROWSER_MEMORY_LIMIT_MB,
+        interval: float = ADJUST_INTERVAL,
+        on_resize: Optional[Callable[[int], None]] = None,
+    ):
+        available = available_memory_mb()
+        self.memory_limit_mb = memory_limit_mb if memory_limit_mb is not None else (
+            available * MEMORY_SHARE if available is not None else None
+        )
+        if max_workers is None:
+            max_workers = 2 * (os.cpu_count() or 2)
+            if self.memory_limit_mb is not None:
+                max_workers = min(max_workers, int(self.memory_limit_mb // BROWSER_ESTIMATE_MB))
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.target = min(self.max_workers, max(self.min_workers, initial_workers or 5))
+        self.browser_memory_limit_mb = browser_memory_limit_mb
+        self.interval = interval
+        self.on_resize = on_resize
+
+        self._condition = threading.Condition()
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._window_started = time.perf_counter()
+        self._window_errors = self._error_count()
+        self._window_waits = self._throttle_waits()
+        self._last_change = 0
+        self._last_throughput: Optional[float] = None
+        self._cooldown = 0
+        self.history: List[Dict[str, Any]] = []
+        self.browsers_killed = 0
+        self.peak_memory_mb = 0.0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Holds one of the worker slots while processing a place, waiting for a free one."""
+        with self._condition:
+            while self._active >= self.target:
+                self._condition.wait()
+            self._active += 1
+        try:
+            yield
+        except Exception:
+            with self._condition:
+                self._failed += 1
+            raise
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._completed += 1
+                self._condition.notify_all()
+
+    def start(self) -> "ConcurrencyGovernor":
+        self._thread = threading.Thread(target=self._run, daemon=True, name="concurrency-governor")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.error(f"Concurrency governor failed to adjust: {e}")
+
+    @staticmethod
+    def _error_count() -> float:
+        return metrics.total("place_errors") + metrics.total("engine_fallbacks")
+
+    @staticmethod
+    def _throttle_waits() -> Tuple[int, int]:
+        summary = wait_stats.summary()
+        waits = [summary[label] for label in THROTTLE_WAIT_LABELS if label in summary]
+        return sum(stats["count"] for stats in waits), sum(stats["timeouts"] for stats in waits)
+
+    def _set_target(self, target: int, reason: str, window: Dict[str, Any]):
+        target = min(self.max_workers, max(self.min_workers, target))
+        if target == self.target:
+            return
+        self._last_change = target - self.target
+        logger.info(f"Concurrency governor: {self.target} -> {target} workers ({reason})")
+        metrics.inc("governor_adjustments", direction="up" if target > self.target else "down", reason=reason)
+        self.history.append({**window, "from": self.target, "to": target, "reason": reason})
+        with self._condition:
+            self.target = target
+            self._condition.notify_all()
+        if self.on_resize is not None:
+            self.on_resize(target)
+
+    def adjust(self):
+        """Takes the measurements of the window that just ended and changes the number of workers accordingly."""
+        now = time.perf_counter()
+        with self._condition:
+            completed, self._completed = self._completed, 0
+            failed, self._failed = self._failed, 0
+        errors = self._error_count()
+        waits, timeouts = self._throttle_waits()
+        window_errors = failed + errors - self._window_errors
+        window_waits, window_timeouts = waits - self._window_waits[0], timeouts - self._window_waits[1]
+        seconds = now - self._window_started
+        self._window_started, self._window_errors, self._window_waits = now, errors, (waits, timeouts)
+
+        browsers = measure_browsers()
+        for driver, rss in browsers:
+            if rss > self.browser_memory_limit_mb:
+                logger.warning(f"Killing a browser using {rss:.0f}MB, above {self.browser_memory_limit_mb}MB")
+                metrics.inc("browsers_killed")
+                self.browsers_killed += 1
+                from src.driver import WebDriverManager
+
+                WebDriverManager.kill_driver(driver)
+        memory = sum(rss for _, rss in browsers if rss <= self.browser_memory_limit_mb)
+        per_browser = memory / len(browsers) if browsers else BROWSER_ESTIMATE_MB
+        self.peak_memory_mb = max(self.peak_memory_mb, memory)
+
+        throughput = completed / seconds if seconds > 0 else 0.0
+        window = {
+            "places": completed,
+            "throughput_per_min": round(60 * throughput, 2),
+            "errors": window_errors,
+            "timeouts": window_timeouts,
+            "memory_mb": round(memory, 1),
+        }
+        if completed == 0 and window_errors == 0 and window_timeouts == 0:
+            # Nothing finished yet: no signal to act on
+            return
+
+        error_rate = window_errors / max(1, completed)
+        timeout_rate = window_timeouts / max(1, window_waits)
+        # Workers added at the end of the previous window, judged by the throughput of this one
+        added, self._last_change = max(0, self._last_change), 0
+        if error_rate > ERROR_RATE_LIMIT or timeout_rate > ERROR_RATE_LIMIT:
+            self._cooldown = GROWTH_COOLDOWN
+            self._set_target(self.target // 2, "errors", window)
+        elif self.memory_limit_mb is not None and memory > self.memory_limit_mb:
+            self._set_target(self.target - 1, "memory", window)
+        elif added and self._last_throughput is not None and throughput < self._last_throughput:
+            self._cooldown = GROWTH_COOLDOWN
+            self._set_target(self.target - added, "throughput dropped", window)
+        elif self._cooldown > 0:
+            self._cooldown -= 1
+        elif self.memory_limit_mb is None or memory + per_browser <= self.memory_limit_mb:
+            self._set_target(self.target + 1, "throughput", window)
+        self._last_throughput = throughput
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "workers": self.target,
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "memory_limit_mb": round(self.memory_limit_mb, 1) if self.memory_limit_mb is not None else None,
+            "peak_memory_mb": round(self.peak_memory_mb, 1),
+            "browsers_killed": self.browsers_killed,
+            "adjustments": self.history,
+        }
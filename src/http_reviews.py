@@ -0,0 +1,256 @@
+import html
+import json
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote_plus, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.extract_support import PLACE_ID_PATTERN, ReviewCursor, simplify_url
+from src.metrics import metrics
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Reviews are fetched from the same paginated endpoint the reviews tab of a place page calls while scrolling
+REVIEWS_RPC_PATH = "/maps/rpc/listugcposts"
+# Template of the "pb" parameter of that request: place ID, page size, page token, sort order and searched text
+REVIEWS_RPC_PB = (
+    "!1m6!1s{place_id}!6m4!4m1!1e1!4m1!1e3!2m2!1i{page_size}!2s{token}!5m2!1s{session}!7e81"
+    "!8m9!2b1!3b1!5b1!7b1!12m4!1b1!2b1!4m1!1e1!11m4!1e{sort}!2m1!1e2!3s{query}!13m1!1e1"
+)
+# Sort orders of the reviews tab
+SORT_MOST_RELEVANT = 1
+SORT_NEWEST = 2
+SORT_ORDERS = {"relevant": SORT_MOST_RELEVANT, "newest": SORT_NEWEST}
+
+PAGE_SIZE = 20
+MAX_CONNECTIONS = 32
+REQUEST_TIMEOUT = 15
+# Prefix guarding the JSON responses of Maps against cross-site script inclusion
+XSSI_PREFIX = ")]}'"
+
+# Positions of the fields in the response payload, and in each of its reviews
+NEXT_TOKEN_PATH = (1,)
+REVIEWS_PATH = (2,)
+REVIEW_ID_PATH = (0, 0)
+REVIEW_DATE_PATH = (0, 1, 6)
+REVIEW_SCORE_PATH = (0, 2, 0, 0)
+REVIEW_TEXT_PATH = (0, 2, 15, 0, 0)
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+}
+# Skips the cookie consent page, as accept_cookies_conditions does in the browser
+CONSENT_COOKIES = {"CONSENT": "YES+", "SOCS": "CAESEwgDEgk0ODE3Nzk3MjQaAmVuIAEaBgiA_LyaBg"}
+
+
+class HttpEngineError(Exception):
+    """Raised when a place or its reviews cannot be fetched or parsed over HTTP."""
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by all threads, keeping up to MAX_CONNECTIONS connections alive per host.
+
+    Notes:
+        - Connection errors and 429/5xx responses are retried with an exponential backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",)
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS, max_retries=retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(HEADERS)
+            session.cookies.update(CONSENT_COOKIES)
+            _session = session
+        return _session
+
+
+def _get(url: str, label: str) -> str:
+    with metrics.span(label):
+        try:
+            response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            metrics.inc("http_requests", request=label, status="error")
+            raise HttpEngineError(f"Request to {simplify_url(url)} failed: {e}") from e
+    metrics.inc("http_requests", request=label, status=response.status_code)
+    if response.status_code != 200:
+        raise HttpEngineError(f"Request to {simplify_url(url)} returned HTTP {response.status_code}")
+    return response.text
+
+
+def _at(payload: Any, path: Tuple[int, ...]) -> Any:
+    """Reads a nested position of a payload, None if any level is missing."""
+    for idx in path:
+        if not isinstance(payload, list) or idx >= len(payload):
+            return None
+        payload = payload[idx]
+    return payload
+
+
+def _meta_tags(page: str) -> Dict[str, str]:
+    """Maps the itemprop/property/name of the meta tags of a page to their content."""
+    tags = {}
+    for tag in re.findall(r"<meta\s[^>]*>", page):
+        attributes = dict(re.findall(r'([\w:-]+)="([^"]*)"', tag))
+        key = attributes.get("itemprop") or attributes.get("property") or attributes.get("name")
+        if key and "content" in attributes:
+            tags.setdefault(key, html.unescape(attributes["content"]))
+    return tags
+
+
+def find_place_id(place_url: str, page: Optional[str] = None) -> Optional[str]:
+    """Finds the place ID in the place URL, or else in its page."""
+    match = PLACE_ID_PATTERN.search(place_url) or (PLACE_ID_PATTERN.search(page) if page else None)
+    return match.group(1) if match else None
+
+
+def parse_place_info(place_url: str, page: str) -> Dict[str, str]:
+    """
+    Reads the place details of a place page, in the format of `extract_place_info`.
+
+    Notes:
+        - Only the name and the address are in the static page, the other details are left empty.
+    """
+    tags = _meta_tags(page)
+    title = tags.get("name") or tags.get("og:title") or ""
+    name, _, address = title.partition(" · ")
+    if not name:
+        # The name is also the first segment of place URLs
+        segments = urlparse(place_url).path.split("/")
+        name = unquote_plus(segments[3]) if len(segments) > 3 and segments[2] == "place" else ""
+    return {"place_url": place_url, "name": name, "description": "", "address": address, "phone": "", "web": ""}
+
+
+def fetch_place(place_url: str) -> Tuple[Dict[str, str], str]:
+    """
+    Fetches a place page, returning the place details and the place ID.
+
+    Raises:
+        HttpEngineError: If the page cannot be fetched or has no place ID.
+    """
+    page = _get(place_url, "fetch_place_page")
+    place_id = find_place_id(place_url, page)
+    if place_id is None:
+        raise HttpEngineError(f"No place ID found for {simplify_url(place_url)}")
+    return parse_place_info(place_url, page), place_id
+
+
+def build_reviews_url(
+    place_url: str,
+    place_id: str,
+    token: str = "",
+    query: str = "",
+    page_size: int = PAGE_SIZE,
+    sort: int = SORT_MOST_RELEVANT,
+) -> str:
+    """Builds the URL of a page of reviews, on the host of the place URL."""
+    parsed = urlparse(place_url)
+    pb = REVIEWS_RPC_PB.format(
+        place_id=place_id,
+        page_size=page_size,
+        token=quote(token, safe=""),
+        session="",
+        sort=sort,
+        query=quote(query, safe=""),
+    )
+    return f"{parsed.scheme}://{parsed.netloc}{REVIEWS_RPC_PATH}?authuser=0&hl=en&pb={pb}"
+
+
+def parse_reviews_payload(text: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Parses a page of reviews into the records `extract_reviews_bulk` returns (review_id, review, date, score).
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[str]]: The reviews and the token of the next page (None on the last one).
+
+    Raises:
+        HttpEngineError: If the response is not in the expected format.
+    """
+    text = text.strip()
+    if text.startswith(XSSI_PREFIX):
+        text = text[len(XSSI_PREFIX) :]
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise HttpEngineError(f"Unexpected reviews response: {e}") from e
+    if not isinstance(payload, list):
+        raise HttpEngineError("Unexpected reviews response: not a list")
+
+    reviews = []
+    for entry in _at(payload, REVIEWS_PATH) or []:
+        review_id = _at(entry, REVIEW_ID_PATH)
+        if review_id is None:
+            raise HttpEngineError("Unexpected reviews response: review without ID")
+        reviews.append(
+            {
+                "review_id": review_id,
+                "review": _at(entry, REVIEW_TEXT_PATH) or "",
+                "date": _at(entry, REVIEW_DATE_PATH) or "",
+                "score": _at(entry, REVIEW_SCORE_PATH) or 0,
+            }
+        )
+    return reviews, _at(payload, NEXT_TOKEN_PATH) or None
+
+
+def iter_review_pages(
+    place_url: str,
+    place_id: str,
+    query: str,
+    cursor: ReviewCursor,
+    limit: Optional[int] = None,
+    page_size: int = PAGE_SIZE,
+    sort: int = SORT_MOST_RELEVANT,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yields the reviews of a place page after page, skipping the ones already in the cursor and stopping at the
+    first of its stop IDs.
+
+    Args:
+        place_url (str): The Google Maps place URL.
+        place_id (str): Its place ID.
+        query (str): The text searched in the reviews, as typed in the search box of the reviews tab.
+        cursor (ReviewCursor): Tracks the reviews already discovered, so that a browser can take over from it.
+        limit (Optional[int], optional): The maximum number of reviews discovered by the cursor. Default is None.
+        page_size (int, optional): Number of reviews requested at a time. Default is 20.
+        sort (int, optional): Sort order of the reviews. Default is SORT_MOST_RELEVANT.
+
+    Raises:
+        HttpEngineError: If a page cannot be fetched or parsed.
+    """
+    token = ""
+    while not cursor.reached_stop and (limit is None or limit <= 0 or cursor.discovered < limit):
+        url = build_reviews_url(place_url, place_id, token, query, page_size, sort)
+        reviews, token = parse_reviews_payload(_get(url, "fetch_reviews_page"))
+
+        reviews = reviews[: cursor.take([review["review_id"] for review in reviews])]
+        fresh = [review for review in reviews if review["review_id"] not in cursor.seen_ids]
+        if limit is not None and limit > 0:
+            fresh = fresh[: limit - cursor.discovered]
+        for review in fresh:
+            cursor.seen_ids.add(review["review_id"])
+            cursor.last_review_id = review["review_id"]
+        cursor.discovered += len(fresh)
+        if fresh:
+            yield fresh
+        if token is None or cursor.reached_stop:
+            cursor.exhausted = token is None
+            return
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+def journal_path_for(output_file: str) -> str:
+    """Returns where the journal of a run writing to `output_file` is stored."""
+    return f"{output_file}.journal.json"
+
+
+def journal_log_path(path: str) -> str:
+    """Returns where the updates made since the last snapshot of a journal are appended."""
+    return f"{path}.log"
+
+
+class RunJournal:
+    """
+    Persistent record of the progress of a batch extraction, one entry per place URL.
+
+    Args:
+        path (Optional[str]): The JSON file where the journal is stored. It is loaded if it already exists.
+            None keeps the journal in memory only.
+
+    Notes:
+        - Each entry holds the status (pending, in_progress, done, failed), the number of collected reviews, the
+          IDs of the reviews already discovered (only while the place is not done) and the last review ID.
+        - Places searched for several topics keep the discovered IDs and the last review ID of each topic apart,
+          under "topics", with the topics already gone through marked as done.
+        - Updates are appended to a JSONL log next to the file (see `journal_log_path`), progress records holding
+          only the review IDs discovered since the previous one, so that a checkpoint costs the same at the end of a
+          long run as at its start. The log is replayed and compacted into the JSON file (rewritten atomically) when
+          the journal is loaded, started and compacted, so it survives crashes and Ctrl-C.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self.params: Dict[str, Any] = {}
+        self.places: Dict[str, Dict[str, Any]] = {}
+        # Review IDs of each place (and topic) already in `places`, to log only the new ones
+        self._known_ids: Dict[Tuple[str, Optional[str]], Set[str]] = {}
+        self._log = None
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+            self.params = content.get("params", {})
+            self.places = content.get("places", {})
+        if path is not None and os.path.exists(journal_log_path(path)):
+            self._replay(journal_log_path(path))
+        if self.places:
+            logger.debug(f"Loaded run journal {path} with {len(self.places)} places")
+
+    def start(self, urls: Iterable[str], **params: Any):
+        """Registers the URLs of a run (keeping the state of known ones) and the parameters it runs with."""
+        with self._lock:
+            if self.params and params and self.params != params:
+                logger.error(f"Resuming a run started with {self.params} using {params}")
+            self.params = params
+            for url in urls:
+                self.places.setdefault(url, self._new_entry())
+            self._compact()
+
+    def compact(self):
+        """Writes the whole journal to its JSON file and empties its log, e.g. once the run is finished."""
+        with self._lock:
+            self._compact()
+
+    @staticmethod
+    def _new_entry() -> Dict[str, Any]:
+        return {"status": PENDING, "collected": 0, "review_ids": [], "last_review_id": None, "error": None, "updated_at": None}
+
+    def _update(self, url: str, **fields: Any):
+        with self._lock:
+            self._apply({"url": url, "set": {**fields, "updated_at": time.time()}})
+
+    def _apply(self, record: Dict[str, Any], log: bool = True):
+        """Applies an update to `places` (idempotently, so that a log can be replayed twice), then logs it"""
+        entry = self.places.setdefault(record["url"], self._new_entry())
+        if "set" in record:
+            entry.update(record["set"])
+            if "review_ids" in record["set"] or "topics" in record["set"]:
+                for key in [key for key in self._known_ids if key[0] == record["url"]]:
+                    del self._known_ids[key]
+        if "add_ids" in record:
+            topic = record.get("topic")
+            if topic is None:
+                target = entry
+            else:
+                target = entry.setdefault("topics", {}).setdefault(
+                    topic, {"review_ids": [], "last_review_id": None, "done": False}
+                )
+            known = self._ids(record["url"], topic, target)
+            target["review_ids"].extend(review_id for review_id in record["add_ids"] if review_id not in known)
+            known.update(record["add_ids"])
+            target["last_review_id"] = record["last_review_id"]
+            entry.update(collected=record["collected"], updated_at=record["updated_at"])
+        if log:
+            self._append(record)
+
+    def _ids(self, url: str, topic: Optional[str], target: Dict[str, Any]) -> Set[str]:
+        key = (url, topic)
+        if key not in self._known_ids:
+            self._known_ids[key] = set(target.get("review_ids", []))
+        return self._known_ids[key]
+
+    def mark_in_progress(self, url: str):
+        self._update(url, status=IN_PROGRESS, error=None)
+
+    def record_progress(
+        self,
+        url: str,
+        review_ids: Iterable[str],
+        collected: int,
+        last_review_id: Optional[str] = None,
+        topic: Optional[str] = None,
+    ):
+        """Records the reviews discovered so far for a place (for one of its topics, if given) and how many were
+        collected (and already flushed). Only the IDs not recorded yet are logged."""
+        with self._lock:
+            entry = self.places.setdefault(url, self._new_entry())
+            target = entry if topic is None else entry.get("topics", {}).get(topic, {})
+            known = self._ids(url, topic, target)
+            record = {
+                "url": url,
+                "topic": topic,
+                "add_ids": [review_id for review_id in review_ids if review_id not in known],
+                "last_review_id": last_review_id,
+                "collected": collected,
+                "updated_at": time.time(),
+            }
+            self._apply(record)
+
+    def mark_topic_done(self, url: str, topic: str):
+        with self._lock:
+            topics = dict(self.places.get(url, {}).get("topics", {}))
+            last_review_id = topics.get(topic, {}).get("last_review_id")
+            topics[topic] = {"review_ids": [], "last_review_id": last_review_id, "done": True}
+            self._apply({"url": url, "set": {"topics": topics, "updated_at": time.time()}})
+
+    def topic_done(self, url: str, topic: str) -> bool:
+        with self._lock:
+            return self.places.get(url, {}).get("topics", {}).get(topic, {}).get("done", False)
+
+    def mark_done(self, url: str, collected: int):
+        # The discovered IDs are only needed to continue a partial place
+        self._update(url, status=DONE, collected=collected, review_ids=[], topics={})
+
+    def mark_failed(self, url: str, error: str):
+        self._update(url, status=FAILED, error=error)
+
+    def status(self, url: str) -> str:
+        with self._lock:
+            return self.places.get(url, {}).get("status", PENDING)
+
+    def seen_review_ids(self, url: str, topic: Optional[str] = None) -> List[str]:
+        with self._lock:
+            if topic is not None:
+                return list(self.places.get(url, {}).get("topics", {}).get(topic, {}).get("review_ids", []))
+            return list(self.places.get(url, {}).get("review_ids", []))
+
+    def collected(self, url: str) -> int:
+        with self._lock:
+            return self.places.get(url, {}).get("collected", 0)
+
+    def urls_to_process(self, urls: Iterable[str]) -> List[str]:
+        """Returns the URLs that are not done yet, in their original order."""
+        return [url for url in urls if self.status(url) != DONE]
+
+    def summary(self) -> Dict[str, int]:
+        counts = {PENDING: 0, IN_PROGRESS: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            for entry in self.places.values():
+                counts[entry["status"]] += 1
+        return counts
+
+    def _append(self, record: Dict[str, Any]):
+        if self.path is None:
+            return
+        if self._log is None:
+            self._log = open(journal_log_path(self.path), "a", encoding="utf-8")
+        self._log.write(json.dumps(record) + "\n")
+        self._log.flush()
+
+    def _replay(self, log_path: str):
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash is the last one
+                    logger.warning(f"Ignoring a truncated record at the end of {log_path}")
+                    break
+                self._apply(record, log=False)
+
+    def _compact(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params, "places": self.places}, f)
+        os.replace(tmp_path, self.path)
+        # Records already in the JSON file may be replayed again if this is interrupted, which changes nothing
+        if self._log is not None:
+            self._log.close()
+        self._log = open(journal_log_path(self.path), "w", encoding="utf-8")
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from src.logger import get_logger
+from src.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_cache.sqlite")
+DEFAULT_MAX_SIZE_BYTES = 256 * 1024 * 1024
+# Writes after which the running size is read again from the file, to account for the other processes sharing it
+RESYNC_WRITES = 1000
+
+
+class LLMCache:
+    """
+    Persistent, content-addressed cache of LLM answers stored in SQLite.
+
+    Args:
+        path (str, optional): The SQLite file where answers are stored. Default is ".cache/llm_cache.sqlite".
+        max_size_bytes (int, optional): Once the stored answers exceed this size, the least recently used ones are
+            evicted. Default is 256MB.
+        enabled (bool, optional): If False, every lookup is a miss and nothing is stored. Default is True.
+
+    Notes:
+        - Keys are SHA-256 hashes of everything that determines an answer (model, prompt template, topic or
+          questions schema, input text), see `make_key`.
+        - The cache is safe to share between threads and processes.
+        - The total size is tracked as answers are stored, and only summed over the table when it may exceed the
+          budget or every `RESYNC_WRITES` writes.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._size = 0
+        self._writes = 0
+
+        if enabled:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+            self._size = self._total_size()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Hashes the parts that determine an LLM answer into a cache key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True, default=str)
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x1f")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached answer for `key`, if any, and marks it as recently used."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc("llm_cache_lookups", result="miss")
+                return None
+            self.hits += 1
+            metrics.inc("llm_cache_lookups", result="hit")
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str):
+        """Stores an answer, evicting the least recently used ones if the cache grows too large."""
+        if not self.enabled:
+            return
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._size += size - (replaced[0] if replaced else 0)
+            self._writes += 1
+            if self._size > self.max_size_bytes or self._writes % RESYNC_WRITES == 0:
+                self._size = self._total_size()
+                self._evict()
+            self._conn.commit()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def _evict(self):
+        total_size = self._size
+        if total_size <= self.max_size_bytes:
+            return
+
+        # Frees up to 90% of the budget, so that eviction doesn't run at every insert
+        to_free = total_size - int(self.max_size_bytes * 0.9)
+        freed, evicted = 0, []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+            if freed >= to_free:
+                break
+            evicted.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", evicted)
+        self._size -= freed
+        logger.debug(f"Evicted {len(evicted)} entries ({freed} bytes) from the LLM cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and the current size of the cache."""
+        stats = {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, "entries": 0, "size_bytes": 0}
+        if self.enabled:
+            with self._lock:
+                entries, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+                ).fetchone()
+            stats.update(entries=entries, size_bytes=size)
+        return stats
+
+    def clear(self):
+        """Removes every cached answer."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self._size = 0
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """
+    Returns the process-wide LLM cache.
+
+    Notes:
+        - Set LLM_CACHE=off in the environment to disable it, and LLM_CACHE_PATH / LLM_CACHE_MAX_MB to configure it.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_size_bytes=int(os.environ.get("LLM_CACHE_MAX_MB", DEFAULT_MAX_SIZE_BYTES // (1024 * 1024)))
+                * 1024
+                * 1024,
+                enabled=os.environ.get("LLM_CACHE", "on").lower() not in ("off", "0", "false", "no"),
+            )
+        return _cache
+
+
+def current_llm_cache() -> Optional[LLMCache]:
+    """Returns the process-wide LLM cache if something already opened it, without creating its file."""
+    with _cache_lock:
+        return _cache
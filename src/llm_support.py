@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Coroutine, Deque, Optional, Tuple
+
+import openai
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for rate limiting."""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """Returns the tiktoken encoding of a model, None if tiktoken is missing or can't download it."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Counts the tokens of a text with tiktoken, falling back to `estimate_tokens` if it isn't available (or offline)."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Tells whether an exception raised by an OpenAI-compatible client is a 429."""
+    if isinstance(error, openai.RateLimitError):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Tells whether an exception raised by an OpenAI-compatible client is worth retrying: a 429, a connection error or
+    timeout, or a 408, 409 or 5xx answer (the errors the OpenAI SDK retries itself).
+    """
+    if is_rate_limit_error(error) or isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in (408, 409) or (status_code is not None and status_code >= 500)
+
+
+class RateLimiter:
+    """
+    Async limiter enforcing requests-per-minute and tokens-per-minute budgets over a sliding 60s window.
+
+    Args:
+        requests_per_minute (Optional[int]): Maximum number of requests started in any 60s window. None disables it.
+        tokens_per_minute (Optional[int]): Maximum number of (estimated) tokens sent in any 60s window. None disables it.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._tokens_in_window = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now: float):
+        while self._events and now - self._events[0][0] >= self.WINDOW:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            wait = max(wait, self._events[0][0] + self.WINDOW - now)
+        if self.tokens_per_minute and self._events:
+            # A single request larger than the whole budget is let through once the window is empty
+            excess = self._tokens_in_window + tokens - self.tokens_per_minute
+            for timestamp, event_tokens in self._events:
+                if excess <= 0:
+                    break
+                excess -= event_tokens
+                wait = max(wait, timestamp + self.WINDOW - now)
+        return wait
+
+    async def acquire(self, tokens: int = 0):
+        """Waits until a request of `tokens` tokens fits in the budget, then books it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    break
+                logger.debug(f"Rate limiter waiting {wait:.2f}s")
+                await asyncio.sleep(wait)
+            self._events.append((time.monotonic(), tokens))
+            self._tokens_in_window += tokens
+
+
+def run_coroutine(coro: Coroutine) -> Any:
+    """
+    Runs a coroutine to completion from synchronous code.
+
+    Notes:
+        - Inside Jupyter an event loop is already running, so the coroutine is executed in a helper thread with its own loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    outcome = {}
+
+    def runner():
+        try:
+            outcome["result"] = asyncio.run(coro)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
@@ -0,0 +1,285 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Upper bounds (seconds) of the Prometheus histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Observations kept per histogram to compute percentiles
+MAX_SAMPLES = 10_000
+# Spans kept for the trace of the run
+MAX_SPANS = 50_000
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples: List[float] = []
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            # Keeps the most recent observations
+            self.samples[self.count % MAX_SAMPLES] = value
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def percentile(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(ordered[-1], 4) if ordered else 0.0,
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, histograms and timing spans of a run.
+
+    Notes:
+        - Every metric can carry labels (e.g. stage, model, command). Inside `place_context`, a "place" label is
+          added too, so that the JSON report breaks costs down per place.
+        - The Prometheus export drops the "place" label, to keep the number of series bounded.
+        - Places are labelled by URL while scraping and by name during analysis.
+        - Metrics accumulate over the process, until `reset` is called.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._spans: List[Dict[str, Any]] = []
+        self.started_at = time.time()
+
+    def _labels(self, labels: Dict[str, Any]) -> LabelKey:
+        place = getattr(self._local, "place", None)
+        if place is not None and "place" not in labels:
+            labels = {**labels, "place": place}
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        """Adds `value` to a counter."""
+        key = self._labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def total(self, name: str, **labels: Any) -> float:
+        """Sums a counter over the label sets including `labels`."""
+        wanted = {(key, str(value)) for key, value in labels.items()}
+        with self._lock:
+            return sum(value for key, value in self._counters.get(name, {}).items() if wanted.issubset(key))
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: Any):
+        """Records an observation (e.g. a duration in seconds) in a histogram."""
+        key = self._labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def place_context(self, place: str) -> Iterator[None]:
+        """Labels the metrics recorded by the current thread with the place being processed."""
+        previous = getattr(self._local, "place", None)
+        self._local.place = place
+        try:
+            yield
+        finally:
+            self._local.place = previous
+
+    @contextmanager
+    def span(self, stage: str, **labels: Any) -> Iterator[None]:
+        """Times a block: its duration goes to the "stage_seconds" histogram and the span to the run trace.
+        Spans are meant for threads: time coroutines with `observe("stage_seconds", ...)` instead."""
+        stack = getattr(self._local, "spans", None)
+        if stack is None:
+            stack = self._local.spans = []
+        parent = stack[-1] if stack else None
+        stack.append(stage)
+        started_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            stack.pop()
+            self.observe("stage_seconds", duration, stage=stage, **labels)
+            if error is not None:
+                self.inc("stage_errors", stage=stage, error=error, **labels)
+            with self._lock:
+                if len(self._spans) < MAX_SPANS:
+                    self._spans.append(
+                        {
+                            "stage": stage,
+                            "parent": parent,
+                            "place": getattr(self._local, "place", None),
+                            "thread": threading.current_thread().name,
+                            "start": round(started_at - self.started_at, 4),
+                            "duration": round(duration, 4),
+                            "error": error,
+                            **{key: str(value) for key, value in labels.items()},
+                        }
+                    )
+
+    def timed(self, stage: Optional[str] = None) -> Callable:
+        """Decorator wrapping every call of a function in a span named after the function."""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage or function.__name__):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._spans.clear()
+            self.started_at = time.time()
+
+    def report(self, include_spans: bool = False) -> Dict[str, Any]:
+        """
+        Builds the run report: counters and histograms per label set, totals per stage and per place, and the
+        wait, prefilter and LLM cache statistics (None if the run never opened the cache).
+        """
+        # Imported here as these modules record their own stats and some of them import this one
+        from src.llm_cache import current_llm_cache
+        from src.prefilter import prefilter_stats
+        from src.waits import wait_stats
+
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: [{"labels": dict(key), **histogram.summary()} for key, histogram in series.items()]
+                for name, series in self._histograms.items()
+            }
+            spans = list(self._spans)
+
+        # Time spent per stage, overall and per place
+        stages: Dict[str, Dict[str, float]] = {}
+        places: Dict[str, Dict[str, float]] = {}
+        for entry in histograms.get("stage_seconds", []):
+            stage = stages.setdefault(entry["labels"]["stage"], {"count": 0, "total_s": 0.0})
+            stage["count"] += entry["count"]
+            stage["total_s"] = round(stage["total_s"] + entry["sum"], 4)
+            place = entry["labels"].get("place")
+            if place is not None:
+                key = f"{entry['labels']['stage']}_s"
+                place_totals = places.setdefault(place, {})
+                place_totals[key] = round(place_totals.get(key, 0.0) + entry["sum"], 4)
+        for name, series in counters.items():
+            for entry in series:
+                place = entry["labels"].get("place")
+                if place is not None:
+                    place_totals = places.setdefault(place, {})
+                    place_totals[name] = place_totals.get(name, 0) + entry["value"]
+
+        cache = current_llm_cache()
+        report = {
+            "started_at": self.started_at,
+            "duration_s": round(time.time() - self.started_at, 3),
+            "stages": stages,
+            "places": places,
+            "counters": counters,
+            "histograms": histograms,
+            "waits": wait_stats.summary(),
+            "prefilter": prefilter_stats.summary(),
+            "llm_cache": cache.stats() if cache is not None else None,
+        }
+        if include_spans:
+            report["spans"] = spans
+        return report
+
+    def to_prometheus(self, prefix: str = "gmaps") -> str:
+        """Exports the counters and histograms in the Prometheus text format, summed over places."""
+        lines = []
+
+        def render(labels: LabelKey) -> str:
+            if not labels:
+                return ""
+            escaped = (
+                f'{key}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                for key, value in labels
+            )
+            return "{" + ",".join(escaped) + "}"
+
+        def without_place(key: LabelKey) -> LabelKey:
+            return tuple(item for item in key if item[0] != "place")
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                merged: Dict[LabelKey, float] = {}
+                for key, value in series.items():
+                    merged[without_place(key)] = merged.get(without_place(key), 0) + value
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for key, value in sorted(merged.items()):
+                    lines.append(f"{prefix}_{name}_total{render(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                merged_histograms: Dict[LabelKey, List[_Histogram]] = {}
+                for key, histogram in series.items():
+                    merged_histograms.setdefault(without_place(key), []).append(histogram)
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for key, histograms in sorted(merged_histograms.items()):
+                    buckets = histograms[0].buckets
+                    cumulative = 0
+                    for idx, bound in enumerate(buckets):
+                        cumulative += sum(histogram.bucket_counts[idx] for histogram in histograms)
+                        lines.append(f"{prefix}_{name}_bucket{render(key + (('le', str(bound)),))} {cumulative}")
+                    count = sum(histogram.count for histogram in histograms)
+                    lines.append(f"{prefix}_{name}_bucket{render(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{prefix}_{name}_sum{render(key)} {sum(histogram.sum for histogram in histograms)}")
+                    lines.append(f"{prefix}_{name}_count{render(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path_prefix: str, include_spans: bool = True):
+        """Writes the JSON run report to "<path_prefix>.json" and the Prometheus metrics to "<path_prefix>.prom"."""
+        if os.path.dirname(path_prefix):
+            os.makedirs(os.path.dirname(path_prefix), exist_ok=True)
+        with open(f"{path_prefix}.json", "w", encoding="utf-8") as f:
+            json.dump(self.report(include_spans=include_spans), f, indent=2)
+        with open(f"{path_prefix}.prom", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        logger.info(f"Metrics written to {path_prefix}.json and {path_prefix}.prom")
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,371 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import openai
+import pandas as pd
+from dotenv import load_dotenv
+from langchain_core.pydantic_v1 import BaseModel
+from tqdm import tqdm
+
+from src.clean_review import pick_topic_relevant_chunks_batch
+from src.driver import WebDriverManager
+from src.extract_multiple import HTTP_MAX_WORKERS, MAX_WORKERS, loads_urls
+from src.extract_reviews import extract_place
+from src.dedup import dedup_reviews
+from src.extract_support import simplify_url
+from src.llm_cache import get_llm_cache
+from src.llm_support import RateLimiter, run_coroutine
+from src.metrics import metrics
+from src.places_analysis import (
+    agenerate_insights,
+    aggregate_reviews,
+    create_insights_llm,
+    create_prompt_template,
+    format_questions,
+    generate_insights,
+    insights_cache_scope,
+    llm_endpoint,
+)
+from src.prefilter import prefilter_stats
+from src.sinks import RecordSink, open_sink
+from src.waits import wait_stats
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+CHUNK_WORKERS = 4
+INSIGHT_WORKERS = 4
+QUEUE_SIZE = 32
+
+# Tells a worker there is nothing left to consume
+_STOP = object()
+
+
+class _StageSink(RecordSink):
+    """Sink handed to `extract_place`: every page of raw reviews goes to the chunk extraction queue."""
+
+    def __init__(self, url: str, tracker: "_PlaceTracker", pages: "queue.Queue"):
+        super().__init__(chunk_size=1)
+        self.url = url
+        self.tracker = tracker
+        self.pages = pages
+
+    def append(self, records: Iterable[Dict[str, Any]]):
+        records = list(records)
+        if not records:
+            return
+        self.tracker.page_queued(self.url)
+        # Blocks while the queue is full, so the browsers never run too far ahead of the LLM
+        self.pages.put((self.url, records))
+        self.records_written += len(records)
+
+    def flush(self):
+        pass
+
+
+class _PlaceTracker:
+    """
+    Keeps the relevant reviews of each place until it is scraped and all of its pages went through
+    chunk extraction, then hands the place over to insight generation.
+    """
+
+    def __init__(self, places: "queue.Queue"):
+        self.places = places
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._scraped: set = set()
+        self._records: Dict[str, List[Dict[str, Any]]] = {}
+
+    def page_queued(self, url: str):
+        with self._lock:
+            self._pending[url] = self._pending.get(url, 0) + 1
+
+    def page_done(self, url: str, records: List[Dict[str, Any]]):
+        with self._lock:
+            self._pending[url] -= 1
+            self._records.setdefault(url, []).extend(records)
+            ready = self._pop_if_ready(url)
+        self._hand_over(url, ready)
+
+    def place_scraped(self, url: str):
+        with self._lock:
+            self._scraped.add(url)
+            ready = self._pop_if_ready(url)
+        self._hand_over(url, ready)
+
+    def _pop_if_ready(self, url: str) -> Optional[List[Dict[str, Any]]]:
+        if url not in self._scraped or self._pending.get(url, 0) > 0:
+            return None
+        self._scraped.discard(url)
+        self._pending.pop(url, None)
+        return self._records.pop(url, [])
+
+    def _hand_over(self, url: str, records: Optional[List[Dict[str, Any]]]):
+        # Outside of the lock: the put blocks while insight generation is behind
+        if records:
+            self.places.put((url, records))
+        elif records is not None:
+            logger.debug(f"No relevant reviews for {url}, nothing to analyse")
+
+
+def run_pipeline(
+    topic: Union[str, List[str]],
+    questions_structure: BaseModel,
+    limit: Optional[int] = None,
+    list_of_places_urls: Optional[List[str]] = None,
+    input_file: Optional[str] = None,
+    chunk_workers: int = CHUNK_WORKERS,
+    insight_workers: int = INSIGHT_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    reviews_output_file: Optional[str] = None,
+    insights_output_file: Optional[str] = None,
+    use_driver_pool: bool = True,
+    base_url: Optional[str] = None,
+    use_cache: bool = True,
+    metrics_path: Optional[str] = None,
+    engine: str = "selenium",
+    prefilter: bool = False,
+    synonyms: Optional[Union[List[str], Dict[str, List[str]]]] = None,
+    max_concurrency: Optional[int] = None,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    token_budget: Optional[int] = None,
+    deduplicate: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Scrapes, filters and analyses places with the three stages running at the same time.
+
+    Browsers only scrape the raw reviews, page after page. Each page flows through a bounded queue to a pool of
+    workers extracting the topic-relevant chunks with the LLM, and each place whose pages are all done flows through
+    another bounded queue to the workers generating its insights, while the other places are still being scraped.
+
+    Args:
+        topic (Union[str, List[str]]): The specific topic or keyword to search for in the reviews, or a list of
+            topics searched one after the other, as in `extract_place`.
+        questions_structure (BaseModel): Pydantic model describing the questions to answer for each place.
+        limit (Optional[int], optional): The maximum number of reviews to collect for each place. Default is None.
+        list_of_places_urls (Optional[List[str]], optional): The Google Maps place URLs to process. Default is None.
+        input_file (Optional[str], optional): A JSON file to load the URLs from. Default is None.
+        chunk_workers (int, optional): Number of threads extracting relevant chunks. Default is 4.
+        insight_workers (int, optional): Number of threads generating insights, when `max_concurrency` and
+            `token_budget` are not set. Default is 4.
+        queue_size (int, optional): Capacity of the queues between the stages (pages, then places). Default is 32.
+        reviews_output_file (Optional[str], optional): A .csv or .parquet file where relevant reviews are streamed.
+            Default is None (kept in memory).
+        insights_output_file (Optional[str], optional): A .csv or .parquet file where the insights of each place
+            are written as soon as they are ready. Default is None (kept in memory).
+        use_driver_pool (bool, optional): Whether to reuse a pool of warm browsers across places. Default is True.
+        base_url (Optional[str], optional): OpenAI-compatible endpoint for the chunks and the insights. Default is
+            None (OPENAI_BASE_URL, else the OpenAI API).
+        use_cache (bool, optional): Whether to use the on-disk LLM cache. Default is True.
+        metrics_path (Optional[str], optional): If given, the metrics of the run are written to
+            "<metrics_path>.json" and "<metrics_path>.prom" at the end. Default is None.
+        engine (str, optional): "selenium" or "http", see `extract_place`. Default is "selenium".
+        prefilter (bool, optional): Whether to score reviews locally before asking the LLM for their chunks, see
+            `pick_topic_relevant_chunks_batch`. Default is False.
+        synonyms (Optional[Union[List[str], Dict[str, List[str]]]], optional): Other words for the topic used by the
+            prefilter, or a dict mapping each topic to its synonyms. Default is None.
+        max_concurrency (Optional[int], optional): If set, the insights of all the places handed over are generated
+            in one event loop with at most this many requests in flight, as in `analyse_places`. Default is None.
+        requests_per_minute (Optional[int], optional): Requests-per-minute budget of the insights, shared by all the
+            places, with `max_concurrency` or `token_budget`. Default is None.
+        tokens_per_minute (Optional[int], optional): Tokens-per-minute budget of the insights, shared by all the
+            places, with `max_concurrency` or `token_budget`. Default is None.
+        token_budget (Optional[int], optional): Maximum number of prompt tokens per insights request, see
+            `analyse_places`. Default is None.
+        deduplicate (bool, optional): Whether to collapse exact and near duplicate reviews of each place before
+            generating its insights, see `analyse_places`. Default is False.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The relevant reviews, as `extract_places_batch` returns them, and the
+            insights, as `analyse_places` returns them.
+
+    Notes:
+        - The stage timings (time to the first analysed place, wall clock, pages and places through each stage)
+          are logged and stored in `attrs["pipeline_stats"]` of the insights DataFrame.
+        - Insights are generated as `analyse_places` does with the same arguments, place by place as each one is
+          handed over.
+        - With several topics, the relevant reviews get a "topic" column and each page has its chunks extracted for
+          the topic it was searched for. The insights of a place are generated once, over the reviews of all topics.
+    """
+    load_dotenv()
+    openai.api_key = os.environ.get("OPENAI_API_KEY")
+
+    urls = loads_urls(list_of_places_urls, input_file)
+    pages: queue.Queue = queue.Queue(maxsize=queue_size)
+    places: queue.Queue = queue.Queue(maxsize=queue_size)
+    tracker = _PlaceTracker(places)
+    reviews_sink = open_sink(reviews_output_file)
+    insights_sink = open_sink(insights_output_file)
+
+    concurrent = bool(max_concurrency or token_budget)
+    # Retries of transient errors are handled by agenerate_insights in concurrent mode
+    llm = create_insights_llm(base_url, max_retries=0 if concurrent else None)
+    structured_llm = llm.with_structured_output(questions_structure)
+    questions = format_questions(questions_structure)
+    prompt_template = create_prompt_template()
+    cache = get_llm_cache() if use_cache else None
+    cache_scope = insights_cache_scope(questions_structure, llm_endpoint(llm))
+
+    started = time.perf_counter()
+    stats = {"pages": 0, "relevant_reviews": 0, "places_analysed": 0, "first_insight_s": None}
+    stats_lock = threading.Lock()
+
+    def chunk_worker():
+        while True:
+            item = pages.get()
+            if item is _STOP:
+                return
+            url, records = item
+            relevant = []
+            try:
+                # The pages of each topic are searched apart, so all the records of a page share their topic
+                page_topic = records[0].get("topic", topic) if records else topic
+                with metrics.place_context(simplify_url(url)):
+                    texts = pick_topic_relevant_chunks_batch(
+                        texts=[r["review"] for r in records],
+                        topic=page_topic,
+                        use_cache=use_cache,
+                        prefilter=prefilter,
+                        synonyms=synonyms,
+                        base_url=base_url,
+                    )
+                relevant = [
+                    {**record, "review": text} for record, text in zip(records, texts) if text
+                ]
+                reviews_sink.append(relevant)
+            except Exception as e:
+                logger.error(f"Error extracting chunks for {url}: {e}")
+            finally:
+                with stats_lock:
+                    stats["pages"] += 1
+                    stats["relevant_reviews"] += len(relevant)
+                tracker.page_done(url, relevant)
+
+    def aggregate(records: List[Dict[str, Any]]) -> pd.DataFrame:
+        store = pd.DataFrame(records)
+        if deduplicate:
+            store = dedup_reviews(store, by="name")
+        return aggregate_reviews(store)
+
+    def record_insights(results: Dict[str, Dict[str, Any]]):
+        insights_sink.append(results.values())
+        with stats_lock:
+            stats["places_analysed"] += len(results)
+            if results and stats["first_insight_s"] is None:
+                stats["first_insight_s"] = round(time.perf_counter() - started, 3)
+
+    def insight_worker():
+        while True:
+            item = places.get()
+            if item is _STOP:
+                return
+            url, records = item
+            try:
+                results = generate_insights(
+                    aggregate(records), prompt_template, structured_llm, questions, cache=cache, cache_scope=cache_scope
+                )
+                record_insights(results)
+            except Exception as e:
+                logger.error(f"Error generating insights for {url}: {e}")
+
+    async def analyse_handed_over_places():
+        # One event loop for all the places, so that they share the concurrency and the rate limits
+        semaphore = asyncio.Semaphore(max_concurrency or 1)
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        loop = asyncio.get_running_loop()
+        tasks = set()
+
+        async def analyse_place(url: str, records: List[Dict[str, Any]]):
+            try:
+                results, _ = await agenerate_insights(
+                    aggregate(records),
+                    prompt_template,
+                    structured_llm,
+                    questions,
+                    cache=cache,
+                    cache_scope=cache_scope,
+                    token_budget=token_budget,
+                    map_llm=llm,
+                    semaphore=semaphore,
+                    limiter=limiter,
+                )
+                record_insights(results)
+            except Exception as e:
+                logger.error(f"Error generating insights for {url}: {e}")
+
+        while True:
+            item = await loop.run_in_executor(None, places.get)
+            if item is _STOP:
+                break
+            task = asyncio.ensure_future(analyse_place(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    def insight_loop():
+        run_coroutine(analyse_handed_over_places())
+
+    def scrape(url: str):
+        try:
+            extract_place(
+                topic, url, limit, sink=_StageSink(url, tracker, pages), extract_chunks=False, engine=engine
+            )
+        finally:
+            tracker.place_scraped(url)
+
+    chunk_threads = [threading.Thread(target=chunk_worker, daemon=True) for _ in range(chunk_workers)]
+    if concurrent:
+        insight_threads = [threading.Thread(target=insight_loop, daemon=True)]
+    else:
+        insight_threads = [threading.Thread(target=insight_worker, daemon=True) for _ in range(insight_workers)]
+    for thread in chunk_threads + insight_threads:
+        thread.start()
+
+    use_driver_pool = use_driver_pool and engine == "selenium"
+    driver_manager = WebDriverManager()
+    try:
+        if use_driver_pool and urls:
+            driver_manager.start_pool(size=min(MAX_WORKERS, len(urls)))
+        with ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS if engine == "http" else MAX_WORKERS) as executor:
+            futures = {executor.submit(scrape, url): url for url in urls}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Scraping Places", postfix="\n"):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error processing {futures[future]}: {e}")
+    finally:
+        if use_driver_pool:
+            driver_manager.shutdown_pool()
+        # Each stage drains its queue before the next one is told to stop
+        for _ in chunk_threads:
+            pages.put(_STOP)
+        for thread in chunk_threads:
+            thread.join()
+        for _ in insight_threads:
+            places.put(_STOP)
+        for thread in insight_threads:
+            thread.join()
+        reviews_sink.close()
+        insights_sink.close()
+
+    stats["places"] = len(urls)
+    stats["wall_clock_s"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Pipeline stats: {stats}")
+    logger.info(f"Wait stats: {wait_stats.summary()}")
+    logger.info(f"Prefilter stats: {prefilter_stats.summary()}")
+    if metrics_path:
+        metrics.write_report(metrics_path)
+
+    reviews_store = reviews_sink.to_dataframe()
+    insights = insights_sink.to_dataframe()
+    if "name" in insights.columns:
+        insights.index = insights["name"].tolist()
+    insights.attrs["pipeline_stats"] = stats
+    return reviews_store, insights
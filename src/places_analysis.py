@@ -1,31 +1,133 @@
 from dotenv import load_dotenv
 import os
+import json
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+import numpy as np
 import pandas as pd
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple, Union
 import openai
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage
 from langchain_core.pydantic_v1 import BaseModel
 
+from src.batch_api import (
+    POLL_INTERVAL,
+    batch_summary,
+    completion_content,
+    read_batch_results,
+    submit_batch,
+    wait_for_batch,
+    write_batch_file,
+)
+from src.dedup import COUNT_COLUMN, dedup_reviews
+from src.llm_cache import LLMCache, get_llm_cache
+from src.llm_support import RateLimiter, count_tokens, is_rate_limit_error, is_transient_error, run_coroutine
 from src.logger import get_logger
+from src.metrics import metrics
+from src.sinks import open_sink
+from src.storage import PARTITION_ROWS, PLACE_ID_COLUMN, iter_place_partitions, join_places, resolve_dataset
 
 logger = get_logger(__name__)
-   
-def aggregate_reviews(store: pd.DataFrame) -> pd.DataFrame:
+
+INSIGHTS_MODEL = "gpt-4o-2024-08-06"
+# Aggregated reviews as sent in the prompt, when they differ from the returned "review" column
+PROMPT_REVIEWS_COLUMN = "prompt_reviews"
+
+def aggregate_reviews(store: pd.DataFrame, places: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """
     Aggregate reviews by place name, combining multiple reviews into one string.
     
     Args:
         store (pd.DataFrame): DataFrame containing the reviews data.
+        places (Optional[pd.DataFrame], optional): The places table, when `store` is a normalized reviews table
+            (see `src.storage.normalize_reviews`). Default is None.
     
     Returns:
         pd.DataFrame: DataFrame with aggregated reviews by place name.
+
+    Notes:
+        - Reviews standing for several duplicates (a "count" column, see `dedup_reviews`) are marked with how many
+          similar reviews they represent in a "prompt_reviews" column, the text sent to the LLM, while the "review"
+          column keeps the reviews as they are.
+        - Normalized reviews are grouped by their place ID alone, and the place details are joined afterwards.
+          Flat reviews with a "place_id" column are grouped by it too, so that places sharing a name stay apart.
+        - Missing place details are aggregated as empty strings.
     """
-    return (
-        store.groupby(["name", "description", "address", "phone", "web"])["review"]
-        .apply(lambda x: "\n\n".join(x))
-        .reset_index()
-    )
+    columns = ["review"]
+    if COUNT_COLUMN in store.columns:
+        repeated = store[COUNT_COLUMN] > 1
+        store = store.assign(**{PROMPT_REVIEWS_COLUMN: store["review"].fillna("").astype(str)})
+        store.loc[repeated, PROMPT_REVIEWS_COLUMN] += (
+            " [" + store.loc[repeated, COUNT_COLUMN].astype(str) + " similar reviews]"
+        )
+        columns.append(PROMPT_REVIEWS_COLUMN)
+    if places is not None:
+        aggregated = join_reviews(store, [PLACE_ID_COLUMN], sort=False, columns=columns)
+        aggregated = join_places(aggregated, places, ["name", "description", "address", "phone", "web"])
+        return aggregated.fillna({column: "" for column in ["description", "address", "phone", "web"]})
+    # Details missing from a place (read back from a file as NaN) would drop its reviews from the groups
+    details = ["description", "address", "phone", "web"]
+    store = store.assign(**{column: store[column].fillna("").astype(str) for column in details})
+    by = ["name"] + details
+    if PLACE_ID_COLUMN in store.columns and store[PLACE_ID_COLUMN].notna().all():
+        by = [PLACE_ID_COLUMN] + by
+    return join_reviews(store, by, columns=columns)
+
+
+def prompt_reviews(row: pd.Series) -> str:
+    """The aggregated reviews of a place as sent to the LLM (see `aggregate_reviews`)."""
+    return row[PROMPT_REVIEWS_COLUMN] if PROMPT_REVIEWS_COLUMN in row.index else row["review"]
+
+
+def insight_key(row: pd.Series) -> str:
+    """What the insights of an aggregated place are keyed by: its place ID when known, else its name."""
+    if PLACE_ID_COLUMN in row.index and pd.notna(row[PLACE_ID_COLUMN]):
+        return str(row[PLACE_ID_COLUMN])
+    return row["name"]
+
+
+def _ordered_insights(
+    results: Dict[str, Dict[str, Any]], aggregated_reviews: pd.DataFrame
+) -> Dict[str, Dict[str, Any]]:
+    # Keeps the same ordering as the sequential version
+    keys = [insight_key(row) for _, row in aggregated_reviews.iterrows()]
+    return {key: results[key] for key in keys if key in results}
+
+
+def join_reviews(
+    store: pd.DataFrame,
+    by: List[str],
+    sort: bool = True,
+    separator: str = "\n\n",
+    columns: Sequence[str] = ("review",),
+) -> pd.DataFrame:
+    """
+    Joins the reviews of each group of rows into one string, like `groupby(by)["review"].apply(separator.join)`,
+    for each of the text `columns`.
+
+    Notes:
+        - Rows are ordered by group once, and each group is joined from a slice of the sorted texts, instead of
+          building a Series per group.
+        - As with `groupby`, rows with a missing key are dropped.
+    """
+    groups = store.groupby(by, sort=sort, observed=True).ngroup().to_numpy()
+    order = np.argsort(groups, kind="stable")
+    order = order[groups[order] >= 0]
+    if not len(order):
+        return pd.DataFrame(columns=by + list(columns))
+
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    aggregated = store[by].iloc[order[starts]].reset_index(drop=True)
+    for column in columns:
+        texts = store[column].fillna("").astype(str).to_numpy(dtype=object)[order]
+        aggregated[column] = [separator.join(texts[start:end]) for start, end in zip(starts, ends)]
+    return aggregated
 
 def create_prompt_template() -> PromptTemplate:
     """
@@ -47,13 +149,53 @@ def create_prompt_template() -> PromptTemplate:
     """
     return PromptTemplate.from_template(template)
 
+
+def create_map_prompt_template() -> PromptTemplate:
+    """
+    Create the prompt template used to condense a shard of the reviews of a large place into notes.
+
+    Returns:
+        PromptTemplate: The generated prompt template.
+    """
+    template = """
+    You are an expert review analyzer. You will be given a part of the reviews of a place. Extract concise notes with all the information useful to answer the following questions, keeping contrasting opinions and how recent they are.
+    All your notes are in english, even if the review language is different.
+
+    {questions}
+
+    Reviews: {reviews}
+    """
+    return PromptTemplate.from_template(template)
+
+
+def split_reviews(reviews: str, token_budget: int, model: str = INSIGHTS_MODEL) -> List[str]:
+    """
+    Splits aggregated reviews into shards of at most `token_budget` tokens, cutting only between paragraphs.
+
+    Notes:
+        - A single paragraph larger than the budget ends up alone in its (oversized) shard.
+    """
+    shards, current, current_tokens = [], [], 0
+    for paragraph in reviews.split("\n\n"):
+        tokens = count_tokens(paragraph, model)
+        if current and current_tokens + tokens > token_budget:
+            shards.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        shards.append("\n\n".join(current))
+    return shards
+
 from langchain_core.runnables import Runnable
 
 def generate_insights(
     aggregated_reviews: pd.DataFrame, 
     prompt_template: PromptTemplate, 
     structured_llm: Runnable,
-    questions: str
+    questions: str,
+    cache: Optional[LLMCache] = None,
+    cache_scope: str = "",
 ) -> Dict[str, Dict[str, Any]]:
     """
     Generate insights for each place by analyzing the reviews with a language model.
@@ -62,67 +204,596 @@ def generate_insights(
         aggregated_reviews (pd.DataFrame): DataFrame with aggregated reviews.
         prompt_template (PromptTemplate): The prompt template used for the analysis.
         structured_llm (Any): The language model to generate structured output.
+        questions (str): Formatted string of questions to be asked in the prompt.
+        cache (Optional[LLMCache], optional): Cache of previous answers. Default is None (no caching).
+        cache_scope (str, optional): What identifies the model and output schema in the cache keys. Default is "".
     
     Returns:
-        Dict[str, Dict[str, Any]]: Dictionary containing insights for each place.
+        Dict[str, Dict[str, Any]]: Dictionary containing insights for each place, keyed by `insight_key`.
     """
     results = {}
     for _, row in aggregated_reviews.iterrows():
-        reviews = row["review"]
+        reviews = prompt_reviews(row)
         place_name = row["name"]
+        key = insight_key(row)
 
         formatted_prompt = prompt_template.format(reviews=reviews, questions=questions)
 
+        cache_key = cache.make_key(cache_scope, formatted_prompt) if cache else None
+        cached = cache.get(cache_key) if cache else None
+        if cached is not None:
+            results[key] = _insight_record(json.loads(cached), row)
+            logger.debug(f"Insights for {place_name} found in cache.")
+            continue
+
         try:
-            response = structured_llm.invoke(formatted_prompt)  # type: BaseModel
+            with metrics.place_context(place_name), metrics.span("generate_insights"):
+                response = structured_llm.invoke(formatted_prompt)  # type: BaseModel
+                _record_insight_usage("generate_insights", formatted_prompt, response.dict(), place_name)
 
             # Store the result in the dictionary
-            results[place_name] = {
-                **response.dict(),
-                **row[["name", "description", "address", "phone", "web", "review"]].to_dict(),
-            }
+            results[key] = _insight_record(response.dict(), row)
+            if cache:
+                cache.set(cache_key, json.dumps(response.dict()))
             logger.debug(f"Insights generated for {place_name}.")
         except Exception as e:
+            metrics.inc("llm_failures", stage="generate_insights", model=INSIGHTS_MODEL, place=place_name)
             logger.error(f"Error generating insights for {place_name}: {e}")
 
     return results
 
 
-def analyse_places(store: pd.DataFrame, questions_structure: BaseModel) -> pd.DataFrame:
+def _record_insight_usage(stage: str, prompt: str, answer: Any, place: str):
+    # The structured output hides the usage of the response, so tokens are counted locally
+    metrics.inc("llm_requests", stage=stage, model=INSIGHTS_MODEL, place=place)
+    metrics.inc("llm_tokens", count_tokens(prompt), stage=stage, model=INSIGHTS_MODEL, direction="in", place=place)
+    metrics.inc(
+        "llm_tokens", count_tokens(json.dumps(answer)), stage=stage, model=INSIGHTS_MODEL, direction="out", place=place
+    )
+
+
+def _insight_record(answer: Dict[str, Any], row: pd.Series) -> Dict[str, Any]:
+    place_columns = [PLACE_ID_COLUMN] if PLACE_ID_COLUMN in row.index else []
+    return {
+        **answer,
+        **row[place_columns + ["name", "description", "address", "phone", "web", "review"]].to_dict(),
+    }
+
+
+@dataclass
+class InsightRunStats:
+    """Timings collected by `agenerate_insights`."""
+
+    wall_clock: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    retries: int = 0
+    failures: int = 0
+
+    def summary(self) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "wall_clock_s": round(self.wall_clock, 3),
+            "requests": len(latencies),
+            "retries": self.retries,
+            "failures": self.failures,
+            "latency_mean_s": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "latency_p50_s": round(percentile(0.5), 3),
+            "latency_p95_s": round(percentile(0.95), 3),
+            "latency_max_s": round(latencies[-1], 3) if latencies else 0.0,
+        }
+
+
+async def agenerate_insights(
+    aggregated_reviews: pd.DataFrame,
+    prompt_template: PromptTemplate,
+    structured_llm: Runnable,
+    questions: str,
+    max_concurrency: int = 8,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    max_retries: int = 5,
+    cache: Optional[LLMCache] = None,
+    cache_scope: str = "",
+    token_budget: Optional[int] = None,
+    map_llm: Optional[Runnable] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    limiter: Optional[RateLimiter] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], InsightRunStats]:
+    """
+    Concurrent version of `generate_insights`, keeping at most `max_concurrency` requests in flight.
+
+    Args:
+        aggregated_reviews (pd.DataFrame): DataFrame with aggregated reviews.
+        prompt_template (PromptTemplate): The prompt template used for the analysis.
+        structured_llm (Runnable): The language model to generate structured output.
+        questions (str): Formatted string of questions to be asked in the prompt.
+        max_concurrency (int, optional): Maximum number of requests in flight. Default is 8.
+        requests_per_minute (Optional[int], optional): Requests-per-minute budget. Default is None (unlimited).
+        tokens_per_minute (Optional[int], optional): Tokens-per-minute budget, based on estimated prompt size. Default is None (unlimited).
+        max_retries (int, optional): How many times a request is retried after a transient error (429, connection
+            error, timeout or 5xx) before giving up. Default is 5.
+        cache (Optional[LLMCache], optional): Cache of previous answers. Default is None (no caching).
+        cache_scope (str, optional): What identifies the model and output schema in the cache keys. Default is "".
+        token_budget (Optional[int], optional): Maximum number of prompt tokens per request. Places whose prompt fits
+            are sent whole; larger ones are split into shards condensed by `map_llm` (map), whose notes are then
+            analysed as a whole (reduce). Default is None (every place is sent whole).
+        map_llm (Optional[Runnable], optional): The plain language model used for the map step. Required with `token_budget`.
+        semaphore (Optional[asyncio.Semaphore], optional): A semaphore shared with other calls running in the same
+            event loop, used instead of `max_concurrency`. Default is None.
+        limiter (Optional[RateLimiter], optional): A rate limiter shared with other calls running in the same event
+            loop, used instead of `requests_per_minute` and `tokens_per_minute`. Default is None.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], InsightRunStats]: Insights for each place, as in `generate_insights`, and run timings.
+            With a `token_budget`, each place also reports the prompt tokens sent for it in "tokens_sent".
+
+    Notes:
+        - Transient errors (see `is_transient_error`) are retried with exponential backoff and jitter; any other error
+          only drops the affected place.
+    """
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+    limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+    stats = InsightRunStats()
+    results = {}
+    map_prompt_template = create_map_prompt_template()
+
+    async def call_llm(
+        runnable: Runnable, prompt: str, scope: str, tokens_sent: List[int], stage: str, place: str
+    ) -> Any:
+        """Calls the LLM (or the cache) and returns a JSON-serializable answer. Raises on non-retriable errors"""
+        cache_key = cache.make_key(scope, prompt) if cache else None
+        cached = cache.get(cache_key) if cache else None
+        if cached is not None:
+            return json.loads(cached)
+
+        tokens = count_tokens(prompt)
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                await limiter.acquire(tokens)
+                tokens_sent[0] += tokens
+                started = time.perf_counter()
+                try:
+                    response = await runnable.ainvoke(prompt)
+                    stats.latencies.append(time.perf_counter() - started)
+                    metrics.observe("stage_seconds", time.perf_counter() - started, stage=stage, place=place)
+                    answer = response.content if isinstance(response, BaseMessage) else response.dict()
+                    _record_insight_usage(stage, prompt, answer, place)
+                    if cache:
+                        cache.set(cache_key, json.dumps(answer))
+                    return answer
+                except Exception as e:
+                    stats.latencies.append(time.perf_counter() - started)
+                    if is_transient_error(e) and attempt < max_retries:
+                        stats.retries += 1
+                        metrics.inc("llm_retries", stage=stage, model=INSIGHTS_MODEL, place=place)
+                        backoff = min(60, 2 ** attempt) + random.uniform(0, 1)
+                        reason = "Rate limited" if is_rate_limit_error(e) else f"Transient error ({type(e).__name__})"
+                        logger.debug(f"{reason}, retrying in {backoff:.1f}s")
+                        await asyncio.sleep(backoff)
+                        continue
+                    metrics.inc("llm_failures", stage=stage, model=INSIGHTS_MODEL, place=place)
+                    raise
+
+    async def condense(reviews: str, tokens_sent: List[int], place: str) -> str:
+        """Map step, repeated on the notes until they fit in the budget"""
+        overhead = count_tokens(prompt_template.format(reviews="", questions=questions))
+        shard_budget = max(token_budget - overhead, 1)
+        for _ in range(3):
+            if count_tokens(reviews) <= shard_budget:
+                break
+            shards = split_reviews(reviews, shard_budget)
+            notes = await asyncio.gather(
+                *(
+                    call_llm(
+                        map_llm,
+                        map_prompt_template.format(reviews=shard, questions=questions),
+                        map_scope,
+                        tokens_sent,
+                        "map_reviews",
+                        place,
+                    )
+                    for shard in shards
+                )
+            )
+            reviews = "\n\n".join(notes)
+        else:
+            if count_tokens(reviews) > shard_budget:
+                logger.warning("Review notes still exceed the token budget after 3 map rounds, sending them anyway")
+        return reviews
+
+    async def analyse_row(row: pd.Series):
+        place_name = row["name"]
+        key = insight_key(row)
+        tokens_sent = [0]
+        try:
+            reviews = prompt_reviews(row)
+            if token_budget:
+                reviews = await condense(reviews, tokens_sent, place_name)
+            formatted_prompt = prompt_template.format(reviews=reviews, questions=questions)
+            answer = await call_llm(
+                structured_llm, formatted_prompt, cache_scope, tokens_sent, "generate_insights", place_name
+            )
+        except Exception as e:
+            stats.failures += 1
+            logger.error(f"Error generating insights for {place_name}: {e}")
+            return
+
+        results[key] = _insight_record(answer, row)
+        if token_budget:
+            results[key]["tokens_sent"] = tokens_sent[0]
+            logger.debug(f"Insights generated for {place_name}, {tokens_sent[0]} prompt tokens sent.")
+        else:
+            logger.debug(f"Insights generated for {place_name}.")
+
+    if token_budget and map_llm is None:
+        raise ValueError("A map_llm is required to analyse places with a token_budget")
+    map_scope = f"map:{cache_scope}"
+
+    started = time.perf_counter()
+    await asyncio.gather(*(analyse_row(row) for _, row in aggregated_reviews.iterrows()))
+    stats.wall_clock = time.perf_counter() - started
+
+    return _ordered_insights(results, aggregated_reviews), stats
+
+
+def create_insights_llm(base_url: Optional[str] = None, max_retries: Optional[int] = None) -> ChatOpenAI:
+    """Creates the chat model used for insights, optionally against another OpenAI-compatible endpoint."""
+    llm_kwargs = {"base_url": base_url} if base_url else {}
+    if max_retries is not None:
+        llm_kwargs["max_retries"] = max_retries
+    return ChatOpenAI(model=INSIGHTS_MODEL, **llm_kwargs)
+
+
+def format_questions(questions_structure: BaseModel) -> str:
+    """Lists the descriptions of the fields of the questions structure, numbered, one per line."""
+    return "\n".join(
+        [
+            f"{idx}. {field.field_info.description}"
+            for idx, field in enumerate(questions_structure.__fields__.values())
+        ]
+    )
+
+
+def insights_response_format(questions_structure: BaseModel) -> Dict[str, Any]:
+    """The structured output format asking the model for an answer matching the questions."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": questions_structure.__name__, "schema": questions_structure.schema()},
+    }
+
+
+def generate_insights_batch(
+    aggregated_reviews: pd.DataFrame,
+    prompt_template: PromptTemplate,
+    questions_structure: BaseModel,
+    questions: str,
+    client: openai.OpenAI,
+    cache: Optional[LLMCache] = None,
+    cache_scope: str = "",
+    batch_id: Optional[str] = None,
+    batch_file: Optional[str] = None,
+    poll_interval: float = POLL_INTERVAL,
+    timeout: Optional[float] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Batch API version of `generate_insights`: every place is sent in a single batch, answered within 24 hours.
+
+    Args:
+        aggregated_reviews (pd.DataFrame): DataFrame with aggregated reviews.
+        prompt_template (PromptTemplate): The prompt template used for the analysis.
+        questions_structure (BaseModel): Pydantic model describing the questions, which the answers must match.
+        questions (str): Formatted string of questions to be asked in the prompt.
+        client (openai.OpenAI): The client of the endpoint the batch is submitted to.
+        cache (Optional[LLMCache], optional): Cache of previous answers. Default is None (no caching).
+        cache_scope (str, optional): What identifies the model and output schema in the cache keys. Default is "".
+        batch_id (Optional[str], optional): A batch already submitted for these places, to wait for instead of
+            submitting a new one. Default is None.
+        batch_file (Optional[str], optional): Where to write the batch input file. Default is None (a temporary file).
+        poll_interval (float, optional): Seconds between two polls of the batch. Default is 30.
+        timeout (Optional[float], optional): Seconds after which to stop waiting. Default is None.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]: Insights for each place, as in `generate_insights`, and
+            the ID, status and request counts of the batch.
+
+    Raises:
+        TimeoutError: If the batch is still running after `timeout` seconds: call again with its `batch_id`.
+
+    Notes:
+        - Requests are identified by their cache key, so places with the same prompt are sent once and a batch can
+          be resumed from its ID as long as the reviews and questions are the same.
+        - Places found in the cache are not sent, and the answers of the batch are cached.
+        - Places whose request failed are logged and left out, as in `generate_insights`.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    pending: List[Tuple[str, str, str, pd.Series]] = []
+    requests: Dict[str, Dict[str, Any]] = {}
+    response_format = insights_response_format(questions_structure)
+    for _, row in aggregated_reviews.iterrows():
+        place_name = row["name"]
+        key = insight_key(row)
+        formatted_prompt = prompt_template.format(reviews=prompt_reviews(row), questions=questions)
+        cache_key = LLMCache.make_key(cache_scope, formatted_prompt)
+        cached = cache.get(cache_key) if cache else None
+        if cached is not None:
+            results[key] = _insight_record(json.loads(cached), row)
+            logger.debug(f"Insights for {place_name} found in cache.")
+            continue
+        pending.append((key, place_name, cache_key, row))
+        requests.setdefault(
+            cache_key,
+            {
+                "model": INSIGHTS_MODEL,
+                "messages": [{"role": "user", "content": formatted_prompt}],
+                "response_format": response_format,
+            },
+        )
+
+    if not pending:
+        return results, {"batch_id": batch_id, "status": "not needed", "total": 0, "completed": 0, "failed": 0}
+    if batch_id is None:
+        batch_id = submit_batch(client, write_batch_file(requests.items(), batch_file), {"stage": "analyse_places"})
+    else:
+        logger.info(f"Resuming batch {batch_id} for {len(requests)} requests")
+
+    batch = wait_for_batch(client, batch_id, poll_interval=poll_interval, timeout=timeout)
+    completions, failures = read_batch_results(client, batch)
+    for completion in completions.values():
+        usage = completion.get("usage") or {}
+        metrics.inc("llm_requests", stage="generate_insights_batch", model=INSIGHTS_MODEL)
+        metrics.inc(
+            "llm_tokens",
+            usage.get("prompt_tokens", 0),
+            stage="generate_insights_batch",
+            model=INSIGHTS_MODEL,
+            direction="in",
+        )
+        metrics.inc(
+            "llm_tokens",
+            usage.get("completion_tokens", 0),
+            stage="generate_insights_batch",
+            model=INSIGHTS_MODEL,
+            direction="out",
+        )
+
+    for key, place_name, cache_key, row in pending:
+        try:
+            if cache_key not in completions:
+                raise ValueError(failures.get(cache_key, "missing from the batch results"))
+            answer = questions_structure.parse_raw(completion_content(completions[cache_key]) or "").dict()
+        except Exception as e:
+            metrics.inc("llm_failures", stage="generate_insights_batch", model=INSIGHTS_MODEL, place=place_name)
+            logger.error(f"Error generating insights for {place_name}: {e}")
+            continue
+        results[key] = _insight_record(answer, row)
+        if cache:
+            cache.set(cache_key, json.dumps(answer))
+
+    return _ordered_insights(results, aggregated_reviews), batch_summary(batch)
+
+
+def insights_cache_scope(questions_structure: BaseModel, endpoint: Optional[str] = None) -> str:
+    """What identifies the endpoint, the model and the output schema in the cache keys of the insights."""
+    return json.dumps([INSIGHTS_MODEL, questions_structure.schema()] + ([endpoint] if endpoint else []), sort_keys=True)
+
+
+def llm_endpoint(llm: ChatOpenAI) -> str:
+    """The base URL the chat model sends its requests to, resolved from the environment if none was given."""
+    return str(llm.root_client.base_url)
+
+
+def analyse_places(
+    store: Union[pd.DataFrame, str],
+    questions_structure: BaseModel,
+    max_concurrency: Optional[int] = None,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    base_url: Optional[str] = None,
+    use_cache: bool = True,
+    token_budget: Optional[int] = None,
+    deduplicate: bool = False,
+    places: Optional[pd.DataFrame] = None,
+    output_file: Optional[str] = None,
+    materialize: bool = True,
+    partition_rows: int = PARTITION_ROWS,
+    batch_api: bool = False,
+    batch_id: Optional[str] = None,
+    batch_file: Optional[str] = None,
+    poll_interval: float = POLL_INTERVAL,
+    batch_timeout: Optional[float] = None,
+) -> Optional[pd.DataFrame]:
     """
     Main function to analyze museum reviews for audio guides and generate insights.
     
     Args:
-        store (pd.DataFrame): DataFrame containing the reviews data.
-        env_path (str): Path to the .env file with environment variables.
+        store (Union[pd.DataFrame, str]): DataFrame containing the reviews data, or the path of a .csv or .parquet
+            file of reviews (or of a directory written by `src.storage.save_dataset`) to analyse without loading it.
+        questions_structure (BaseModel): Pydantic model describing the questions to answer for each place.
+        max_concurrency (Optional[int], optional): If set, places are analysed concurrently with at most this many
+            requests in flight. Default is None (one place at a time).
+        requests_per_minute (Optional[int], optional): Requests-per-minute budget for the concurrent mode. Default is None.
+        tokens_per_minute (Optional[int], optional): Tokens-per-minute budget for the concurrent mode. Default is None.
+        base_url (Optional[str], optional): OpenAI-compatible endpoint to use instead of the default one
+            (e.g. a local fake server). Default is None.
+        use_cache (bool, optional): Whether to reuse answers stored in the on-disk LLM cache for identical
+            model, prompt, questions and reviews. Default is True.
+        token_budget (Optional[int], optional): If set, no request carries more than about this many prompt tokens:
+            places whose reviews don't fit are analysed with a map-reduce over shards of their reviews, and the
+            prompt tokens sent for each place are reported in a "tokens_sent" column. Default is None.
+        deduplicate (bool, optional): Whether to collapse exact and near duplicate reviews of each place before
+            sending them, the prompt noting how many each kept review stands for. The returned "review" column then
+            holds one review of each group. Default is False.
+        places (Optional[pd.DataFrame], optional): The places table, when `store` is a normalized reviews table (see
+            `src.storage.normalize_reviews`). Default is None.
+        output_file (Optional[str], optional): With a path `store`, a .csv or .parquet file where the insights are
+            written as each partition of places is analysed. Default is None (kept in memory).
+        materialize (bool, optional): With a path `store`, whether to return the insights, read back from
+            `output_file`. Default is True.
+        partition_rows (int, optional): With a path `store`, the approximate number of reviews loaded at a time.
+            Default is 50,000.
+        batch_api (bool, optional): Whether to send all the places in a single request of the Batch API, at a lower
+            price and outside of the rate limits, and wait for its results (see `generate_insights_batch`). Default
+            is False.
+        batch_id (Optional[str], optional): The ID of a batch submitted by a previous run over the same reviews, to
+            wait for instead of submitting a new one. Implies `batch_api`. Default is None.
+        batch_file (Optional[str], optional): Where to write the batch input file. Default is None (a temporary file).
+        poll_interval (float, optional): Seconds between two polls of the batch. Default is 30.
+        batch_timeout (Optional[float], optional): Seconds after which to stop waiting for the batch, raising a
+            TimeoutError with its ID. Default is None (until the batch ends, within 24 hours).
     
     Returns:
-        pd.DataFrame: Dataframe containing insights for each museum.
+        Optional[pd.DataFrame]: Dataframe containing insights for each museum, indexed by place ID when the reviews
+            have one (with a "place_id" column), else by name, or None if `materialize` is False.
+
+    Notes:
+        - In concurrent or token-budgeted mode the run timings (wall clock, per-request latency percentiles, retries)
+          are logged and stored in `DataFrame.attrs["insight_stats"]`.
+        - The token-budgeted mode runs one request at a time unless `max_concurrency` is set.
+        - A path `store` is read in partitions holding all the reviews of their places (see
+          `src.storage.iter_place_partitions`), each deduplicated (with `deduplicate`), aggregated and analysed before the next one is
+          read, so memory stays bounded by the partition size.
+        - In batch mode the ID, status and request counts of the batch are stored in `DataFrame.attrs["batch"]`.
+          It cannot be combined with a path `store` or a `token_budget`.
+
+    Raises:
+        ValueError: If the batch mode is combined with a path `store` or a `token_budget`.
+        TimeoutError: If the batch is still running after `batch_timeout` seconds.
     """
+    batch_api = batch_api or batch_id is not None
+    if batch_api and (isinstance(store, str) or token_budget):
+        raise ValueError("The batch mode analyses a DataFrame of reviews, without token_budget")
+
     # Load environment variables and initialize OpenAI API
     load_dotenv()
 
     openai.api_key = os.environ.get("OPENAI_API_KEY")
 
-    # Aggregate reviews
-    aggregated_reviews = aggregate_reviews(store)
-
-    # Initialize OpenAI LLM
-    llm = ChatOpenAI(model="gpt-4o-2024-08-06")
+    # Initialize OpenAI LLM, retries of transient errors being handled by agenerate_insights in concurrent mode
+    llm = create_insights_llm(base_url, max_retries=0 if max_concurrency or token_budget else None)
     structured_llm = llm.with_structured_output(questions_structure)
 
     # Define questions
-    questions = "\n".join(
-        [
-            f"{idx}. {field.field_info.description}"
-            for idx, field in enumerate(questions_structure.__fields__.values())
-        ]
-    )
+    questions = format_questions(questions_structure)
 
     # Create prompt template
     prompt_template = create_prompt_template()
 
-    # Generate insights
-    results = generate_insights(aggregated_reviews, prompt_template, structured_llm, questions)
+    cache = get_llm_cache() if use_cache else None
+    cache_scope = insights_cache_scope(questions_structure, llm_endpoint(llm))
+
+    def analyse(store: pd.DataFrame, places: Optional[pd.DataFrame]) -> Tuple[Dict[str, Dict[str, Any]], Any]:
+        # Aggregate reviews
+        if deduplicate:
+            store = dedup_reviews(store, by=PLACE_ID_COLUMN if places is not None else "name")
+        aggregated_reviews = aggregate_reviews(store, places)
+
+        # Generate insights
+        if batch_api:
+            return generate_insights_batch(
+                aggregated_reviews,
+                prompt_template,
+                questions_structure,
+                questions,
+                openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=base_url),
+                cache=cache,
+                cache_scope=cache_scope,
+                batch_id=batch_id,
+                batch_file=batch_file,
+                poll_interval=poll_interval,
+                timeout=batch_timeout,
+            )
+        if not max_concurrency and not token_budget:
+            results = generate_insights(
+                aggregated_reviews, prompt_template, structured_llm, questions, cache=cache, cache_scope=cache_scope
+            )
+            return results, None
+        return run_coroutine(
+            agenerate_insights(
+                aggregated_reviews,
+                prompt_template,
+                structured_llm,
+                questions,
+                max_concurrency=max_concurrency or 1,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+                cache=cache,
+                cache_scope=cache_scope,
+                token_budget=token_budget,
+                map_llm=llm,
+            )
+        )
+
+    if isinstance(store, str):
+        return _analyse_partitions(store, analyse, places, output_file, materialize, partition_rows, cache)
+
+    results, stats = analyse(store, places)
+    if batch_api:
+        logger.info(f"Batch stats: {stats}")
+    elif stats is not None:
+        logger.info(f"Insight generation stats: {stats.summary()}")
+    if cache:
+        logger.info(f"LLM cache stats: {cache.stats()}")
+
+    analysis_store = pd.DataFrame.from_dict(results, orient="index")
+    if batch_api:
+        analysis_store.attrs["batch"] = stats
+    elif stats is not None:
+        analysis_store.attrs["insight_stats"] = stats.summary()
+    return analysis_store
+
+
+def _analyse_partitions(
+    path: str,
+    analyse: Callable[[pd.DataFrame, Optional[pd.DataFrame]], Tuple[Dict[str, Dict[str, Any]], Any]],
+    places: Optional[pd.DataFrame],
+    output_file: Optional[str],
+    materialize: bool,
+    partition_rows: int,
+    cache: Optional[LLMCache],
+) -> Optional[pd.DataFrame]:
+    """Runs `analyse` over the place partitions of a reviews file, writing the insights of each partition as soon as
+    it is done."""
+    reviews_path, dataset_places = resolve_dataset(path)
+    places = places if places is not None else dataset_places
+    sink = open_sink(output_file)
+    run_stats = InsightRunStats()
+    partitions = 0
+    try:
+        for partition in iter_place_partitions(reviews_path, max_rows=partition_rows, places=places):
+            if places is None and PLACE_ID_COLUMN in partition.columns and "name" not in partition.columns:
+                raise ValueError(f"{path} holds normalized reviews: pass their places table with `places`")
+            results, stats = analyse(partition, places)
+            sink.append(results.values())
+            sink.flush()
+            partitions += 1
+            if stats is not None:
+                run_stats.wall_clock += stats.wall_clock
+                run_stats.latencies.extend(stats.latencies)
+                run_stats.retries += stats.retries
+                run_stats.failures += stats.failures
+            logger.debug(f"Analysed partition {partitions} of {path}: {len(results)} places")
+    finally:
+        sink.close()
+
+    logger.info(f"Analysed {sink.records_written} places of {path} in {partitions} partitions")
+    if run_stats.latencies:
+        logger.info(f"Insight generation stats: {run_stats.summary()}")
+    if cache:
+        logger.info(f"LLM cache stats: {cache.stats()}")
+    if not materialize:
+        return None
 
-    return pd.DataFrame.from_dict(results, orient="index")
+    analysis_store = sink.to_dataframe()
+    for column in (PLACE_ID_COLUMN, "name"):
+        if column in analysis_store.columns and analysis_store[column].notna().all():
+            analysis_store.index = analysis_store[column].tolist()
+            break
+    if run_stats.latencies:
+        analysis_store.attrs["insight_stats"] = run_stats.summary()
+    return analysis_store
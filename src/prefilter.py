@@ -0,0 +1,190 @@
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+DROP = "drop"
+LOCAL = "local"
+ESCALATE = "llm"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reviews containing the whole topic and scoring at least this much per topic word get their sentences extracted
+# locally: a single mention in an average-length review scores about 1 per word
+LOCAL_SCORE_THRESHOLD = 1.5
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_TOKEN_RE = re.compile(r"\w+")
+# Verb endings removed by `_stem`, with the shortest stem each may leave
+_VERB_SUFFIXES = (("ing", 4), ("ed", 4))
+# Endings that are not plurals, e.g. "glass", "bus" or "analysis"
+_NOT_PLURAL = ("ss", "us", "is")
+_VOWELS = "aeiou"
+
+
+def normalize(text: str) -> str:
+    """Lowercases and strips accents, so that "Guidé" and "guide" match."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(text) if sentence.strip()]
+
+
+def topic_terms(topic: str, synonyms: Optional[Iterable[str]] = None) -> List[str]:
+    """Returns the distinct words of the topic and of its synonyms."""
+    terms = []
+    for phrase in [topic, *(synonyms or [])]:
+        for token in tokenize(phrase):
+            if token not in terms:
+                terms.append(token)
+    return terms
+
+
+def _stem(token: str) -> str:
+    # Light suffix stripping, compared whole: "guide" matches "guides", "guided" and the Italian "guida", while
+    # "bar" matches "bars" but not "barely" or "barcelona". The plural "s" goes first and the final vowel after it, so
+    # that "glass" and "glasses", "bus" and "buses" or "box" and "boxes" match, and "audio" is left alone
+    for suffix, min_stem in _VERB_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_stem:
+            return token[: -len(suffix)]
+    if token.endswith("s") and not token.endswith(_NOT_PLURAL) and len(token) > 3:
+        token = token[:-1]
+    if len(token) > 3 and token[-1] in "aeio" and token[-2] not in _VOWELS:
+        token = token[:-1]
+    return token
+
+
+@dataclass
+class PrefilterDecision:
+    """What to do with a review: drop it, keep the sentences extracted locally, or escalate it to the LLM."""
+
+    action: str
+    score: float
+    text: Optional[str] = None
+
+
+class PrefilterRecorder:
+    """Thread-safe record of the prefilter decisions and of the LLM work they avoided."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def record(self, dropped: int, local: int, escalated: int, requests_avoided: int):
+        with self._lock:
+            for key, value in (
+                ("dropped", dropped),
+                ("local", local),
+                ("escalated", escalated),
+                ("llm_requests_avoided", requests_avoided),
+            ):
+                self._counts[key] = self._counts.get(key, 0) + value
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {"dropped": 0, "local": 0, "escalated": 0, "llm_requests_avoided": 0, **self._counts}
+        counts["llm_reviews_avoided"] = counts["dropped"] + counts["local"]
+        return counts
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+prefilter_stats = PrefilterRecorder()
+
+
+def prefilter_reviews(
+    texts: List[str],
+    topic: str,
+    synonyms: Optional[Iterable[str]] = None,
+    local_threshold: float = LOCAL_SCORE_THRESHOLD,
+    drop_unmatched: bool = False,
+) -> List[PrefilterDecision]:
+    """
+    Scores a batch of reviews against a topic with BM25 and decides which ones need the LLM.
+
+    Args:
+        texts (List[str]): The RAW reviews.
+        topic (str): The topic the reviews must talk about.
+        synonyms (Optional[Iterable[str]], optional): Other words or phrases meaning the topic (e.g. translations).
+            Default is None.
+        local_threshold (float, optional): Minimum BM25 score, per word of the topic, for a review containing all of
+            them to have its matching sentences extracted locally. Default is 1.5.
+        drop_unmatched (bool, optional): Whether to drop the reviews where no topic (or synonym) word appears at all,
+            instead of sending them to the LLM. They may still talk about the topic in other words or languages, so
+            only drop them with synonyms covering those. Default is False.
+
+    Returns:
+        List[PrefilterDecision]: One decision per review, in the same order:
+            - "drop" when no topic (or synonym) word appears at all, with `drop_unmatched`;
+            - "local", with the matching sentences as text, when the review clearly talks about the topic;
+            - "llm" for everything in between.
+
+    Notes:
+        - The IDF is computed over the batch, so pass whole pages of reviews at once.
+        - Words match when their stems are equal (see `_stem`), never on a mere common prefix.
+    """
+    terms = topic_terms(topic, synonyms)
+    if not texts or not terms:
+        return [PrefilterDecision(ESCALATE, 0.0) for _ in texts]
+
+    stems = [_stem(term) for term in terms]
+    topic_stems = {_stem(term) for term in tokenize(topic)}
+    tokenized = [tokenize(text or "") for text in texts]
+    stem_columns: Dict[str, List[int]] = {}
+    for col, stem in enumerate(stems):
+        stem_columns.setdefault(stem, []).append(col)
+
+    # Term frequencies as a (reviews x terms) matrix: each distinct word of the batch is stemmed once, then the
+    # occurrences of the words matching a term are summed per review with numpy
+    words = np.array([token for tokens in tokenized for token in tokens], dtype=object)
+    reviews = np.repeat(np.arange(len(texts)), [len(tokens) for tokens in tokenized])
+    distinct, occurrences = np.unique(words, return_inverse=True)
+    matches = np.zeros((len(distinct), len(stems)))
+    for idx, token in enumerate(distinct):
+        matches[idx, stem_columns.get(_stem(token), [])] = 1
+    matching = matches.any(axis=1)[occurrences]
+    tf = np.zeros((len(texts), len(stems)))
+    np.add.at(tf, reviews[matching], matches[occurrences[matching]])
+
+    lengths = np.array([max(len(tokens), 1) for tokens in tokenized], dtype=float)
+    document_frequency = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(texts) - document_frequency + 0.5) / (document_frequency + 0.5))
+    # Results of a review search mostly contain the topic: its words must not weigh nothing
+    idf = np.maximum(idf, 1.0)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / lengths.mean())
+    scores = (idf * tf * (BM25_K1 + 1) / (tf + norm[:, None])).sum(axis=1)
+    has_whole_topic = (tf[:, [stems.index(stem) for stem in topic_stems if stem in stems]] > 0).all(axis=1)
+
+    decisions = []
+    for idx, text in enumerate(texts):
+        if scores[idx] <= 0:
+            decisions.append(PrefilterDecision(DROP if drop_unmatched else ESCALATE, 0.0))
+        elif has_whole_topic[idx] and scores[idx] >= local_threshold * len(topic_stems):
+            sentences = [
+                sentence
+                for sentence in split_sentences(text)
+                if any(_stem(token) in stem_columns for token in tokenize(sentence))
+            ]
+            decisions.append(PrefilterDecision(LOCAL, float(scores[idx]), " ".join(sentences)))
+        else:
+            decisions.append(PrefilterDecision(ESCALATE, float(scores[idx])))
+    return decisions
@@ -0,0 +1,194 @@
+import os
+import re
+from typing import Dict, List, Optional, Set, Union
+
+import pandas as pd
+
+from src.extract_multiple import extract_places_batch, loads_urls
+from src.extract_support import SCRAPED_AT_COLUMN
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PUBLISHED_AT_COLUMN = "published_at"
+# Maps shows review dates relative to the moment the page is loaded, e.g. "a year ago" or "Edited 10 months ago"
+RELATIVE_DATE_PATTERN = re.compile(r"\b(a|an|one|\d+)\s+(minute|hour|day|week|month|year)s?\s+ago\b")
+_OFFSETS = {
+    "minute": lambda amount: pd.Timedelta(minutes=amount),
+    "hour": lambda amount: pd.Timedelta(hours=amount),
+    "day": lambda amount: pd.Timedelta(days=amount),
+    "week": lambda amount: pd.Timedelta(weeks=amount),
+    "month": lambda amount: pd.DateOffset(months=amount),
+    "year": lambda amount: pd.DateOffset(years=amount),
+}
+
+
+def parse_relative_date(text: Optional[str], now: Optional[pd.Timestamp] = None) -> Optional[pd.Timestamp]:
+    """
+    Turns a relative review date into an absolute timestamp.
+
+    Args:
+        text (Optional[str]): The date as shown by Maps, e.g. "a week ago", "10 months ago" or "Edited a year ago".
+        now (Optional[pd.Timestamp], optional): When the date was read. Default is None (now).
+
+    Returns:
+        Optional[pd.Timestamp]: The estimated publication time, or None if the text is not a relative date.
+
+    Notes:
+        - The estimate is only as precise as the unit Maps shows: "a year ago" may be anything from 12 to 23 months.
+    """
+    if not isinstance(text, str):
+        return None
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    text = text.strip().lower()
+    if text in ("just now", "a moment ago", "moments ago"):
+        return now
+    if text == "yesterday":
+        return now - pd.Timedelta(days=1)
+
+    match = RELATIVE_DATE_PATTERN.search(text)
+    if match is None:
+        return None
+    amount = 1 if match.group(1) in ("a", "an", "one") else int(match.group(1))
+    return now - _OFFSETS[match.group(2)](amount)
+
+
+def add_review_timestamps(store: pd.DataFrame, scraped_at: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Adds the estimated publication time of the reviews ("published_at"), parsed from their relative "date" as of
+    when each row was scraped ("scraped_at", stamped as its page was collected). Rows without a "scraped_at" get
+    `scraped_at` (default now)."""
+    scraped_at = pd.Timestamp.now() if scraped_at is None else pd.Timestamp(scraped_at)
+    store = store.copy()
+    if SCRAPED_AT_COLUMN in store.columns:
+        store[SCRAPED_AT_COLUMN] = pd.to_datetime(store[SCRAPED_AT_COLUMN], errors="coerce").fillna(scraped_at)
+    else:
+        store[SCRAPED_AT_COLUMN] = scraped_at
+    if "date" in store.columns:
+        # Only a handful of distinct strings ("a week ago", ...) need parsing for each page
+        keys = store[["date", SCRAPED_AT_COLUMN]].astype({"date": object})
+        unique = keys.dropna(subset=["date"]).drop_duplicates()
+        unique[PUBLISHED_AT_COLUMN] = [parse_relative_date(date, at) for date, at in unique.itertuples(index=False)]
+        parsed = keys.merge(unique, how="left", on=["date", SCRAPED_AT_COLUMN])
+        store[PUBLISHED_AT_COLUMN] = pd.to_datetime(parsed[PUBLISHED_AT_COLUMN].to_numpy())
+    else:
+        store[PUBLISHED_AT_COLUMN] = pd.NaT
+    return store
+
+
+def known_review_ids(store: pd.DataFrame) -> Dict[str, Set[str]]:
+    """Returns the IDs of the reviews stored for each place URL."""
+    if store.empty or "review_id" not in store.columns or "place_url" not in store.columns:
+        return {}
+    stored = store.dropna(subset=["review_id"])
+    return {url: set(ids) for url, ids in stored.groupby("place_url")["review_id"]}
+
+
+def merge_reviews(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Appends new reviews to a stored dataset, without duplicating the reviews it already has.
+
+    Notes:
+        - Reviews are identified by place URL and review ID (and topic, when there is a topic column). The stored
+          row is kept when a review is in both.
+        - Rows without a review ID are all kept.
+    """
+    if existing.empty:
+        return new.reset_index(drop=True)
+    if new.empty:
+        return existing.reset_index(drop=True)
+    merged = pd.concat([existing, new], ignore_index=True)
+    if "review_id" not in merged.columns:
+        return merged
+    key = ["place_url", "review_id"] + (["topic"] if "topic" in merged.columns else [])
+    duplicated = merged.duplicated(subset=key, keep="first") & merged["review_id"].notna()
+    return merged[~duplicated].reset_index(drop=True)
+
+
+def load_reviews(path: str) -> pd.DataFrame:
+    """Loads a .csv or .parquet dataset of reviews, empty if the file does not exist."""
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype={"review_id": str})
+
+
+def _write_reviews(store: pd.DataFrame, path: str):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written next to the dataset and moved over it, so that an interrupted write keeps the previous one
+    tmp_path = f"{path}.tmp"
+    if path.endswith(".parquet"):
+        store.to_parquet(tmp_path, index=False)
+    else:
+        store.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def refresh_places(
+    topic: Union[str, List[str]],
+    dataset_path: str,
+    list_of_places_urls: Optional[List[str]] = None,
+    input_file: Optional[str] = None,
+    limit: Optional[int] = None,
+    engine: str = "selenium",
+    use_driver_pool: bool = True,
+    metrics_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Collects the reviews posted since the dataset was last updated and merges them into it.
+
+    Args:
+        topic (Union[str, List[str]]): The topic (or topics) the dataset was collected for.
+        dataset_path (str): The .csv or .parquet dataset of reviews to update. It is created if it does not exist.
+        list_of_places_urls (Optional[List[str]], optional): The places to refresh. Default is None.
+        input_file (Optional[str], optional): A JSON file to load the places from. Default is None: without it nor
+            `list_of_places_urls`, the places already in the dataset are refreshed.
+        limit (Optional[int], optional): The maximum number of new reviews to collect per place. Default is None.
+        engine (str, optional): "selenium" or "http", see `extract_place`. Default is "selenium".
+        use_driver_pool (bool, optional): Whether to reuse a pool of warm browsers across places. Default is True.
+        metrics_path (Optional[str], optional): Where to write the metrics of the run, see `extract_places_batch`.
+            Default is None.
+
+    Returns:
+        pd.DataFrame: The updated dataset, as written to `dataset_path`.
+
+    Notes:
+        - Reviews are sorted by newest and each place stops at the first review already in the dataset, so only the
+          new reviews are scraped and sent to the LLM. Places not in the dataset yet are collected in full.
+        - New rows get "scraped_at" and "published_at" (parsed from the relative "date") columns, so that their
+          dates stay meaningful in later runs.
+        - The stop relies on the dataset holding the newest reviews of each place: a dataset collected with a
+          `limit` on the most relevant reviews is refreshed down to its first stored review.
+    """
+    existing = load_reviews(dataset_path)
+    if list_of_places_urls or input_file:
+        urls = loads_urls(list_of_places_urls, input_file)
+    elif not existing.empty and "place_url" in existing.columns:
+        urls = existing["place_url"].dropna().unique().tolist()
+    else:
+        raise ValueError(f"No places to refresh: {dataset_path} is empty and no URLs were given")
+
+    known = known_review_ids(existing)
+    logger.info(f"Refreshing {len(urls)} places, {sum(url in known for url in urls)} of them already stored")
+
+    # Only for rows that were not stamped as they were collected
+    scraped_at = pd.Timestamp.now()
+    new = extract_places_batch(
+        topic,
+        limit,
+        list_of_places_urls=urls,
+        use_driver_pool=use_driver_pool,
+        engine=engine,
+        sort="newest",
+        stop_at_review_ids=known,
+        metrics_path=metrics_path,
+    )
+    new = add_review_timestamps(new, scraped_at) if not new.empty else new
+
+    merged = merge_reviews(existing, new)
+    _write_reviews(merged, dataset_path)
+    logger.info(f"Added {len(merged) - len(existing)} new reviews to {dataset_path} ({len(merged)} in total)")
+    return merged
@@ -0,0 +1,225 @@
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class RecordSink:
+    """
+    Append-only destination for extracted records (one dict per row), buffered and flushed in chunks.
+
+    Args:
+        chunk_size (int, optional): Number of buffered records that triggers a flush. Default is 1000.
+
+    Notes:
+        - Sinks are thread-safe, so several extractors can append to the same one.
+        - The records are only turned into a DataFrame when `to_dataframe` is called.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.records_written = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def append(self, records: Iterable[Dict[str, Any]]):
+        """Adds records to the sink, flushing them if the buffer is full."""
+        with self._lock:
+            self._buffer.extend(records)
+            if len(self._buffer) >= self.chunk_size:
+                self._flush_locked()
+
+    def append_dataframe(self, frame: pd.DataFrame):
+        """Adds the rows of an already built DataFrame, written as their own chunk."""
+        if frame.empty:
+            return
+        with self._lock:
+            self._flush_locked()
+            self._write(frame)
+            self.records_written += len(frame)
+
+    def flush(self):
+        """Writes the buffered records."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        chunk = pd.DataFrame(self._buffer)
+        self._buffer = []
+        self._write(chunk)
+        self.records_written += len(chunk)
+
+    def _write(self, chunk: pd.DataFrame):
+        raise NotImplementedError
+
+    def close(self):
+        """Flushes the remaining records and releases the underlying file, if any."""
+        self.flush()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Materializes every record written so far as a single DataFrame."""
+        raise NotImplementedError
+
+    def __enter__(self) -> "RecordSink":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemorySink(RecordSink):
+    """Keeps the flushed chunks in memory and concatenates them once, on demand."""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        self._chunks: List[pd.DataFrame] = []
+
+    def _write(self, chunk: pd.DataFrame):
+        self._chunks.append(chunk)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        self.flush()
+        if not self._chunks:
+            return pd.DataFrame()
+        return pd.concat(self._chunks, ignore_index=True)
+
+
+class CSVSink(RecordSink):
+    """
+    Appends chunks to a CSV file.
+
+    Args:
+        path (str): The CSV file to write. Its columns are fixed by the first chunk, unless `columns` is given.
+        chunk_size (int, optional): Number of buffered records that triggers a flush. Default is 1000.
+        columns (Optional[List[str]], optional): The columns of the file. Default is None.
+        append (bool, optional): Whether to append to an existing file instead of overwriting it. Default is False.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        columns: Optional[List[str]] = None,
+        append: bool = False,
+    ):
+        super().__init__(chunk_size)
+        self.path = path
+        self.columns = columns
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.columns = self.columns or list(pd.read_csv(path, nrows=0).columns)
+            self._has_header = True
+        else:
+            self._has_header = False
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+
+    def _write(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        extra = set(chunk.columns) - set(self.columns)
+        if extra:
+            logger.error(f"Dropping columns not present in {self.path}: {sorted(extra)}")
+        chunk.reindex(columns=self.columns).to_csv(
+            self.path, mode="a", header=not self._has_header, index=False
+        )
+        self._has_header = True
+
+    def to_dataframe(self) -> pd.DataFrame:
+        self.flush()
+        if not self._has_header:
+            return pd.DataFrame(columns=self.columns)
+        return pd.read_csv(self.path)
+
+
+class ParquetSink(RecordSink):
+    """
+    Writes chunks as row groups of a Parquet file (requires pyarrow).
+
+    Args:
+        path (str): The Parquet file to write. Its schema is fixed by the first chunk, columns without any value in
+            it being typed as strings.
+        chunk_size (int, optional): Number of buffered records that triggers a flush. Default is 1000.
+
+    Notes:
+        - The file is only complete (and readable) once the sink is closed, which `to_dataframe` does.
+    """
+
+    def __init__(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if pa is None:
+            raise ImportError("pyarrow is required to write Parquet files: pip install pyarrow")
+        super().__init__(chunk_size)
+        self.path = path
+        self._writer = None
+        self._closed = False
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _write(self, chunk: pd.DataFrame):
+        if self._closed:
+            raise ValueError(f"Cannot write to {self.path}, the sink is closed")
+        if self._writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            # A column without any value in the first chunk (e.g. no place has a phone yet) would be typed null,
+            # rejecting the values of the next chunks: such columns are stored as strings
+            schema = pa.schema(
+                [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema],
+                metadata=table.schema.metadata,
+            )
+            table = table.cast(schema)
+            self._writer = pq.ParquetWriter(self.path, schema)
+        else:
+            chunk = chunk.reindex(columns=self._writer.schema.names)
+            table = pa.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._closed = True
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # A Parquet file is only readable once its footer is written
+        self.close()
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+        return pd.read_parquet(self.path)
+
+
+def open_sink(
+    path: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE, append: bool = False
+) -> RecordSink:
+    """
+    Opens the sink matching a file path: Parquet for ".parquet", CSV for ".csv" and in-memory if no path is given.
+
+    Raises:
+        ValueError: If the file extension is not supported, or if appending is asked for a Parquet file.
+    """
+    if path is None:
+        return MemorySink(chunk_size)
+    if path.endswith(".parquet"):
+        if append:
+            raise ValueError(f"Cannot append to the Parquet file {path}, use a .csv output")
+        return ParquetSink(path, chunk_size)
+    if path.endswith(".csv"):
+        return CSVSink(path, chunk_size, append=append)
+    raise ValueError(f"Unsupported output format for {path}, use .csv or .parquet")
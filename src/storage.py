@@ -0,0 +1,288 @@
+import math
+import os
+import shutil
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from src.extract_support import place_id_from_url
+from src.sinks import CSVSink
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PLACE_ID_COLUMN = "place_id"
+# The details of `extract_place_info`, repeated on every review row of the flat format
+PLACE_COLUMNS = ["place_url", "name", "description", "address", "phone", "web"]
+# Review columns with few distinct values, stored as categories
+CATEGORY_COLUMNS = ["date", "topic"]
+DATETIME_COLUMNS = ["published_at", "scraped_at"]
+PLACES_FILE = "places"
+REVIEWS_FILE = "reviews"
+# Rows of a partition of `iter_place_partitions`, and rows read from the dataset at a time
+PARTITION_ROWS = 50_000
+READ_CHUNK_ROWS = 10_000
+
+
+def compact_reviews(reviews: pd.DataFrame, place_ids: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Types the columns of a reviews table: categorical place ID, date and topic, small integer score and datetime
+    timestamps.
+
+    Args:
+        reviews (pd.DataFrame): The reviews, with a "place_id" column.
+        place_ids (Optional[List[str]], optional): The categories of the place IDs, e.g. the IDs of the places table.
+            Default is None (the IDs found in the reviews).
+    """
+    reviews = reviews.copy()
+    if PLACE_ID_COLUMN in reviews.columns:
+        reviews[PLACE_ID_COLUMN] = pd.Categorical(reviews[PLACE_ID_COLUMN].astype("string"), categories=place_ids)
+    if "score" in reviews.columns:
+        reviews["score"] = pd.to_numeric(reviews["score"], errors="coerce").round().astype("Int8")
+    if "review_id" in reviews.columns:
+        reviews["review_id"] = reviews["review_id"].astype("string")
+    for column in CATEGORY_COLUMNS:
+        if column in reviews.columns:
+            reviews[column] = reviews[column].astype("category")
+    for column in DATETIME_COLUMNS:
+        if column in reviews.columns:
+            reviews[column] = pd.to_datetime(reviews[column], errors="coerce")
+    return reviews
+
+
+def normalize_reviews(store: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits a flat store of reviews, carrying the place details on every row, into a places table and a reviews table.
+
+    Args:
+        store (pd.DataFrame): Reviews as `extract_places_batch` returns them.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The places (one row per place ID, with the place details) and the reviews
+            (the other columns, referencing their place by a categorical "place_id").
+
+    Notes:
+        - Place IDs are the feature IDs of the place URLs (see `place_id_from_url`), so they do not change between
+          runs collecting the same places.
+    """
+    if PLACE_ID_COLUMN not in store.columns:
+        if "place_url" not in store.columns:
+            raise ValueError("The reviews have neither a place_id nor a place_url column")
+        # Only the distinct URLs need parsing
+        urls = store["place_url"].astype("string")
+        ids = {url: place_id_from_url(url) for url in urls.dropna().unique()}
+        store = store.assign(**{PLACE_ID_COLUMN: urls.map(ids)})
+
+    place_columns = [column for column in PLACE_COLUMNS if column in store.columns]
+    places = (
+        store[[PLACE_ID_COLUMN] + place_columns]
+        .dropna(subset=[PLACE_ID_COLUMN])
+        .drop_duplicates(subset=[PLACE_ID_COLUMN])
+        .reset_index(drop=True)
+    )
+    reviews = store.drop(columns=place_columns)
+    reviews = compact_reviews(reviews, places[PLACE_ID_COLUMN].tolist()).reset_index(drop=True)
+    logger.debug(f"Normalized {len(reviews)} reviews of {len(places)} places")
+    return places, reviews
+
+
+def join_places(
+    reviews: pd.DataFrame, places: pd.DataFrame, columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Adds the details of their place to reviews (or to any table with a "place_id" column).
+
+    Args:
+        reviews (pd.DataFrame): The reviews.
+        places (pd.DataFrame): The places table.
+        columns (Optional[List[str]], optional): The place columns to add. Default is None (all of them).
+
+    Returns:
+        pd.DataFrame: The reviews, in the same order, with the place columns after the place ID.
+    """
+    columns = [column for column in (columns or places.columns) if column != PLACE_ID_COLUMN]
+    details = places.set_index(PLACE_ID_COLUMN)[columns]
+    keys = reviews[PLACE_ID_COLUMN].astype("string")
+    joined = details.reindex(keys).reset_index(drop=True)
+    joined.index = reviews.index
+
+    position = reviews.columns.get_loc(PLACE_ID_COLUMN) + 1
+    return pd.concat([reviews.iloc[:, :position], joined, reviews.iloc[:, position:]], axis=1)
+
+
+def denormalize_reviews(places: pd.DataFrame, reviews: pd.DataFrame) -> pd.DataFrame:
+    """Rebuilds the flat store of `normalize_reviews`, with the place details on every row."""
+    flat = join_places(reviews, places)
+    return flat[
+        [column for column in flat.columns if column not in PLACE_COLUMNS and column != PLACE_ID_COLUMN]
+        + [column for column in PLACE_COLUMNS if column in flat.columns]
+    ]
+
+
+def save_dataset(places: pd.DataFrame, reviews: pd.DataFrame, directory: str, file_format: str = "parquet"):
+    """
+    Writes the places and reviews tables to "<directory>/places.<format>" and "<directory>/reviews.<format>".
+
+    Args:
+        places (pd.DataFrame): The places table.
+        reviews (pd.DataFrame): The reviews table.
+        directory (str): Where to write the tables.
+        file_format (str, optional): "parquet" (requires pyarrow, keeps the column types) or "csv". Default is
+            "parquet".
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if file_format not in ("parquet", "csv"):
+        raise ValueError(f"Unsupported format {file_format}, use parquet or csv")
+    os.makedirs(directory, exist_ok=True)
+    for name, table in ((PLACES_FILE, places), (REVIEWS_FILE, reviews)):
+        path = os.path.join(directory, f"{name}.{file_format}")
+        if file_format == "parquet":
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+    logger.info(f"Saved {len(places)} places and {len(reviews)} reviews to {directory}")
+
+
+def load_dataset(directory: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads the places and reviews tables written by `save_dataset`, in Parquet or CSV.
+
+    Raises:
+        FileNotFoundError: If the directory holds no places table.
+    """
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"No dataset directory at {directory}")
+    reviews_path, places = resolve_dataset(directory)
+    if reviews_path.endswith(".parquet"):
+        reviews = pd.read_parquet(reviews_path)
+    else:
+        reviews = pd.read_csv(reviews_path, dtype={PLACE_ID_COLUMN: str, "review_id": str})
+    # CSV loses the types, and Parquet the categories of places without reviews
+    return places, compact_reviews(reviews, places[PLACE_ID_COLUMN].tolist())
+
+
+def resolve_dataset(path: str) -> Tuple[str, Optional[pd.DataFrame]]:
+    """
+    Resolves a path to reviews: a flat .csv or .parquet file, or a directory written by `save_dataset`.
+
+    Returns:
+        Tuple[str, Optional[pd.DataFrame]]: The file of the reviews, and the places table for a `save_dataset`
+            directory (None for a flat file).
+
+    Raises:
+        FileNotFoundError: If there are no reviews at the path.
+    """
+    if not os.path.isdir(path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No reviews at {path}")
+        return path, None
+    for file_format in ("parquet", "csv"):
+        places_path = os.path.join(path, f"{PLACES_FILE}.{file_format}")
+        if os.path.exists(places_path):
+            places = (
+                pd.read_parquet(places_path)
+                if file_format == "parquet"
+                else pd.read_csv(places_path, dtype={PLACE_ID_COLUMN: str})
+            )
+            return os.path.join(path, f"{REVIEWS_FILE}.{file_format}"), places
+    raise FileNotFoundError(f"No {PLACES_FILE}.parquet or {PLACES_FILE}.csv in {path}")
+
+
+def iter_review_chunks(path: str, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Reads a .csv or .parquet file of reviews `chunk_rows` rows at a time."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet files: pip install pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={PLACE_ID_COLUMN: str, "review_id": str})
+    else:
+        raise ValueError(f"Unsupported format for {path}, use .csv or .parquet")
+
+
+def count_rows(path: str) -> int:
+    """Counts the rows of a .csv or .parquet file without loading it. Reviews spanning several lines of a CSV are
+    counted once per line."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet files: pip install pyarrow")
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, "rb") as f:
+        return max(0, sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1)
+
+
+def place_key(columns: List[str]) -> str:
+    """The column identifying the place of a review: "place_id", else "name" (as `aggregate_reviews` groups flat
+    reviews), else "place_url"."""
+    for column in (PLACE_ID_COLUMN, "name", "place_url"):
+        if column in columns:
+            return column
+    raise ValueError("The reviews have no place_id, name or place_url column")
+
+
+def iter_place_partitions(
+    path: str,
+    max_rows: int = PARTITION_ROWS,
+    chunk_rows: int = READ_CHUNK_ROWS,
+    places: Optional[pd.DataFrame] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the reviews of a file in partitions holding all the reviews of their places, so that places can be
+    processed one partition at a time whatever the size of the file.
+
+    Args:
+        path (str): A .csv or .parquet file of reviews, flat or normalized.
+        max_rows (int, optional): Approximate number of rows of a partition. Default is 50,000.
+        chunk_rows (int, optional): Number of rows read at a time. Default is 10,000.
+        places (Optional[pd.DataFrame], optional): The places table of normalized reviews, whose IDs become the
+            categories of the "place_id" of each partition. Default is None.
+
+    Notes:
+        - A file of up to `max_rows` rows is a single partition. Larger files are read once, chunk by chunk, and
+          their rows spilled to temporary partition files by a hash of their place key (see `place_key`), which are
+          then read back one at a time. Memory is bounded by the largest partition.
+        - A place with more than `max_rows` reviews makes its partition larger than `max_rows`.
+    """
+    partitions = max(1, math.ceil(count_rows(path) / max_rows))
+    if partitions == 1:
+        chunks = list(iter_review_chunks(path, chunk_rows))
+        if chunks:
+            yield _typed_partition(pd.concat(chunks, ignore_index=True), places)
+        return
+
+    spill_dir = tempfile.mkdtemp(prefix="reviews_partitions_")
+    try:
+        sinks = [CSVSink(os.path.join(spill_dir, f"{idx}.csv")) for idx in range(partitions)]
+        for chunk in iter_review_chunks(path, chunk_rows):
+            key = chunk[place_key(list(chunk.columns))].astype("string")
+            buckets = pd.util.hash_pandas_object(key, index=False).to_numpy() % partitions
+            for idx, rows in chunk.groupby(buckets, sort=False):
+                sinks[idx].append_dataframe(rows)
+        for sink in sinks:
+            sink.close()
+        logger.debug(f"Spilled the reviews of {path} to {partitions} partitions")
+
+        for sink in sinks:
+            if sink.records_written:
+                yield _typed_partition(
+                    pd.read_csv(sink.path, dtype={PLACE_ID_COLUMN: str, "review_id": str}), places
+                )
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _typed_partition(reviews: pd.DataFrame, places: Optional[pd.DataFrame]) -> pd.DataFrame:
+    if places is None:
+        return reviews
+    return compact_reviews(reviews, places[PLACE_ID_COLUMN].tolist())
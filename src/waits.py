@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support.wait import WebDriverWait
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_POLL_FREQUENCY = 0.1
+DEFAULT_IDLE_MS = 500
+
+# Installs (once per page) a MutationObserver tracking the last DOM change, and reports how long the DOM
+# and the network (last completed resource) have been quiet.
+IDLE_PROBE_JS = """
+if (!window.__gmapsWaitProbe) {
+    window.__gmapsWaitProbe = {lastMutation: performance.now()};
+    performance.setResourceTimingBufferSize(10000);
+    new MutationObserver(() => { window.__gmapsWaitProbe.lastMutation = performance.now(); })
+        .observe(document.body, {childList: true, subtree: true, characterData: true});
+}
+const now = performance.now();
+const lastResponse = performance.getEntriesByType("resource")
+    .reduce((latest, entry) => Math.max(latest, entry.responseEnd), 0);
+return {domIdleMs: now - window.__gmapsWaitProbe.lastMutation, networkIdleMs: now - lastResponse};
+"""
+
+COUNT_ELEMENTS_JS = "return document.querySelectorAll(arguments[0]).length;"
+
+
+class WaitRecorder:
+    """Thread-safe record of how long each kind of wait actually took."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, label: str, elapsed: float, timed_out: bool):
+        with self._lock:
+            stats = self._stats.setdefault(
+                label, {"count": 0, "total_s": 0.0, "max_s": 0.0, "timeouts": 0}
+            )
+            stats["count"] += 1
+            stats["total_s"] += elapsed
+            stats["max_s"] = max(stats["max_s"], elapsed)
+            stats["timeouts"] += int(timed_out)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns, for each wait label, how many waits happened, their total, mean and max duration and the timeouts."""
+        with self._lock:
+            return {
+                label: {
+                    **stats,
+                    "total_s": round(stats["total_s"], 3),
+                    "mean_s": round(stats["total_s"] / stats["count"], 3),
+                    "max_s": round(stats["max_s"], 3),
+                }
+                for label, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+wait_stats = WaitRecorder()
+
+
+def wait_until(
+    driver: WebDriver,
+    condition: Callable[[WebDriver], Any],
+    timeout: float = DEFAULT_TIMEOUT,
+    label: str = "wait",
+    poll_frequency: float = DEFAULT_POLL_FREQUENCY,
+    raise_on_timeout: bool = False,
+) -> Any:
+    """
+    Waits until `condition(driver)` returns a truthy value and records how long it took.
+
+    Args:
+        driver (WebDriver): The WebDriver to poll.
+        condition (Callable[[WebDriver], Any]): The condition to wait for.
+        timeout (float, optional): Maximum number of seconds to wait. Default is 10.
+        label (str, optional): Name under which the wait is recorded in `wait_stats`. Default is "wait".
+        poll_frequency (float, optional): Seconds between two checks of the condition. Default is 0.1.
+        raise_on_timeout (bool, optional): Whether to raise TimeoutException when the condition is never met. Default is False.
+
+    Returns:
+        Any: The last value returned by the condition, None on timeout.
+    """
+    started = time.perf_counter()
+    try:
+        result = WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(condition)
+        wait_stats.record(label, time.perf_counter() - started, timed_out=False)
+        return result
+    except TimeoutException:
+        elapsed = time.perf_counter() - started
+        wait_stats.record(label, elapsed, timed_out=True)
+        logger.debug(f"Wait '{label}' timed out after {elapsed:.2f}s")
+        if raise_on_timeout:
+            raise
+        return None
+
+
+def wait_for_dom_idle(
+    driver: WebDriver,
+    idle_ms: int = DEFAULT_IDLE_MS,
+    timeout: float = DEFAULT_TIMEOUT,
+    label: str = "dom_idle",
+) -> bool:
+    """Waits until neither the DOM nor the network has changed for `idle_ms` milliseconds. Returns False on timeout"""
+
+    def is_idle(driver: WebDriver) -> bool:
+        probe = driver.execute_script(IDLE_PROBE_JS)
+        return probe["domIdleMs"] >= idle_ms and probe["networkIdleMs"] >= idle_ms
+
+    return bool(wait_until(driver, is_idle, timeout=timeout, label=label))
+
+
+def wait_for_count_change(
+    driver: WebDriver,
+    css_selector: str,
+    previous_count: int,
+    timeout: float = DEFAULT_TIMEOUT,
+    label: str = "count_change",
+) -> int:
+    """Waits until the number of elements matching `css_selector` differs from `previous_count`, and returns the new count"""
+
+    def count_changed(driver: WebDriver) -> Optional[tuple[int]]:
+        count = driver.execute_script(COUNT_ELEMENTS_JS, css_selector)
+        # Wrapped in a tuple so that a change to 0 elements still counts as met
+        return (count,) if count != previous_count else None
+
+    result = wait_until(driver, count_changed, timeout=timeout, label=label)
+    return previous_count if result is None else result[0]
@@ -0,0 +1,334 @@
+"""
+Durable work queue to spread place extraction over several worker processes, on one or more hosts.
+
+Usage:
+    python -m src.work_queue enqueue --queue output/queue.sqlite --input-file output/example_places.json --topic "aperol spritz" --limit 50
+    python -m src.work_queue work --queue output/queue.sqlite --output-dir output/reviews --threads 3
+    python -m src.work_queue status --queue output/queue.sqlite
+"""
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_LEASE_TIMEOUT = 15 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    """
+    Queue of place URLs stored in SQLite, from which workers lease places, process them and ack them.
+
+    Args:
+        path (str): The SQLite file holding the queue.
+        lease_timeout (float, optional): Seconds after which a lease that was neither renewed nor acked expires, and the
+            place goes back to the queue (its worker is considered dead). Default is 15 minutes.
+        max_attempts (int, optional): How many times a place is leased before being marked as failed. Default is 3.
+
+    Notes:
+        - Each operation runs in its own short transaction, so the queue can be shared by many processes.
+        - To share it across hosts, the file must live on a filesystem with working locks (SQLite over NFS is not
+          reliable); otherwise run the workers on one host.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS places ("
+                "url TEXT PRIMARY KEY, topic TEXT NOT NULL, review_limit INTEGER, status TEXT NOT NULL, "
+                "worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, collected INTEGER, "
+                "error TEXT, enqueued_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS places_status ON places (status, lease_expires)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def enqueue(self, urls: List[str], topic: str, limit: Optional[int] = None) -> int:
+        """Adds places to the queue, ignoring the ones already in it. Returns the number of places added."""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.execute("SELECT COUNT(*) FROM places").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO places (url, topic, review_limit, status, enqueued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(url, topic, limit, PENDING, now, now) for url in urls],
+            )
+            added = conn.execute("SELECT COUNT(*) FROM places").fetchone()[0] - before
+        logger.debug(f"Enqueued {added} new places in {self.path}")
+        return added
+
+    def lease(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Leases the next place to process: a pending one, or one whose lease expired.
+
+        Returns:
+            Optional[Dict[str, Any]]: The url, topic and limit of the place, or None if there is nothing to do.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # Expired leases that used all their attempts are given up
+            conn.execute(
+                "UPDATE places SET status = ?, error = 'Lease expired too many times', updated_at = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT url, topic, review_limit FROM places "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY attempts, enqueued_at LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE places SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE url = ?",
+                (LEASED, worker_id, now + self.lease_timeout, now, row[0]),
+            )
+        return {"url": row[0], "topic": row[1], "limit": row[2]}
+
+    def renew(self, url: str, worker_id: str) -> bool:
+        """Extends the lease of a place still being processed. Returns False if the lease was lost."""
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE places SET lease_expires = ?, updated_at = ? WHERE url = ? AND worker = ? AND status = ?",
+                (now + self.lease_timeout, now, url, worker_id, LEASED),
+            ).rowcount
+        return updated == 1
+
+    def ack(self, url: str, worker_id: str, collected: int) -> bool:
+        """Marks a place leased by this worker as done. Returns False if the lease was lost."""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE places SET status = ?, collected = ?, error = NULL, updated_at = ? "
+                "WHERE url = ? AND worker = ? AND status = ?",
+                (DONE, collected, time.time(), url, worker_id, LEASED),
+            ).rowcount
+        return updated == 1
+
+    def nack(self, url: str, worker_id: str, error: str):
+        """Gives a leased place back to the queue, or marks it as failed once it used all its attempts."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE places SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, "
+                "lease_expires = NULL, updated_at = ? WHERE url = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, error, time.time(), url, worker_id),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of places in each status."""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM places GROUP BY status").fetchall()
+        return {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+
+def enqueue_places(
+    queue_path: str,
+    topic: str,
+    limit: Optional[int] = None,
+    list_of_places_urls: Optional[List[str]] = None,
+    input_file: Optional[str] = None,
+) -> int:
+    """
+    Adds the places loaded with `loads_urls` to a work queue, to be processed by `run_worker`.
+
+    Args:
+        queue_path (str): The SQLite file holding the queue.
+        topic (str): The topic to search for in the reviews of these places.
+        limit (Optional[int], optional): The maximum number of reviews to collect for each place. Default is None.
+        list_of_places_urls (Optional[List[str]], optional): A list of Google Maps place URLs. Default is None.
+        input_file (Optional[str], optional): The file path to load a list of URLs from a JSON file. Default is None.
+
+    Returns:
+        int: The number of places added to the queue.
+    """
+    from src.extract_multiple import loads_urls
+
+    return WorkQueue(queue_path).enqueue(loads_urls(list_of_places_urls, input_file), topic, limit)
+
+
+def run_worker(
+    queue_path: str,
+    output_dir: str,
+    worker_id: Optional[str] = None,
+    threads: int = 1,
+    lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+    max_places: Optional[int] = None,
+    use_driver_pool: bool = True,
+    engine: str = "selenium",
+) -> int:
+    """
+    Processes places from a work queue with `extract_place` until the queue is drained.
+
+    Args:
+        queue_path (str): The SQLite file holding the queue.
+        output_dir (str): Directory where the worker writes its reviews, in "<worker_id>.csv".
+        worker_id (Optional[str], optional): Identifier of the worker. Default is "<hostname>-<pid>-<random>".
+        threads (int, optional): Number of places processed in parallel by this worker, each with its own browser. Default is 1.
+        lease_timeout (float, optional): Seconds after which the place of a dead worker goes back to the queue. Default is 15 minutes.
+        max_places (Optional[int], optional): Stop after processing this many places. Default is None (until drained).
+        use_driver_pool (bool, optional): Whether to reuse warm browsers across places. Default is True.
+        engine (str, optional): "selenium" or "http", see `extract_place`. With "http" no browser pool is started.
+            Default is "selenium".
+
+    Returns:
+        int: The number of places processed by this worker.
+
+    Notes:
+        - Leases are renewed while a place is being processed, so slow places are not handed to another worker.
+        - A place's reviews are written and flushed before the place is acked: a worker dying mid-place writes nothing
+          for it, and the place is processed again once its lease expires.
+        - A place whose lease was lost (it expired and another worker took it) is not written, so its reviews are
+          only written by the worker holding its lease.
+    """
+    from src.driver import WebDriverManager
+    from src.extract_reviews import extract_place
+    from src.journal import FAILED as PLACE_FAILED, RunJournal
+    from src.sinks import MemorySink, CSVSink
+
+    queue = WorkQueue(queue_path, lease_timeout=lease_timeout)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    sink = CSVSink(os.path.join(output_dir, f"{worker_id}.csv"), append=True)
+    leased = 0
+    leased_lock = threading.Lock()
+
+    use_driver_pool = use_driver_pool and engine == "selenium"
+    driver_manager = WebDriverManager()
+
+    def keep_lease(url: str, done: threading.Event, lost: threading.Event):
+        while not done.wait(lease_timeout / 3):
+            if not queue.renew(url, worker_id):
+                logger.error(f"Lost the lease on {url}")
+                lost.set()
+                return
+
+    def work_loop():
+        nonlocal leased
+        while True:
+            with leased_lock:
+                if max_places is not None and leased >= max_places:
+                    return
+                item = queue.lease(worker_id)
+                if item is None:
+                    return
+                leased += 1
+
+            url = item["url"]
+            done, lost = threading.Event(), threading.Event()
+            threading.Thread(target=keep_lease, args=(url, done, lost), daemon=True).start()
+            try:
+                # extract_place skips places on browser errors, the in-memory journal tells them apart
+                place_sink, journal = MemorySink(), RunJournal(None)
+                extract_place(item["topic"], url, item["limit"], sink=place_sink, journal=journal, engine=engine)
+                if journal.status(url) == PLACE_FAILED:
+                    queue.nack(url, worker_id, journal.places[url]["error"])
+                    continue
+                # Another worker owns a place whose lease was lost, its rows are dropped to avoid duplicates
+                if lost.is_set() or not queue.renew(url, worker_id):
+                    logger.warning(f"Worker {worker_id} lost the lease on {url}, dropping its reviews")
+                    continue
+                reviews = place_sink.to_dataframe()
+                sink.append_dataframe(reviews)
+                sink.flush()
+                if not queue.ack(url, worker_id, len(reviews)):
+                    logger.warning(f"Worker {worker_id} lost the lease on {url} while writing its reviews")
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on {url}: {e}")
+                queue.nack(url, worker_id, str(e))
+            finally:
+                done.set()
+
+    logger.debug(f"Worker {worker_id} started on {queue_path} with {threads} threads")
+    try:
+        if use_driver_pool:
+            driver_manager.start_pool(size=threads)
+        workers = [threading.Thread(target=work_loop) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        if use_driver_pool:
+            driver_manager.shutdown_pool()
+        sink.close()
+
+    logger.debug(f"Worker {worker_id} processed {leased} places. Queue: {queue.counts()}")
+    return leased
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add places to the queue")
+    enqueue_parser.add_argument("--queue", required=True)
+    enqueue_parser.add_argument("--input-file", required=True)
+    enqueue_parser.add_argument("--topic", required=True)
+    enqueue_parser.add_argument("--limit", type=int, default=None)
+
+    work_parser = subparsers.add_parser("work", help="Process places until the queue is drained")
+    work_parser.add_argument("--queue", required=True)
+    work_parser.add_argument("--output-dir", required=True)
+    work_parser.add_argument("--worker-id", default=None)
+    work_parser.add_argument("--threads", type=int, default=1)
+    work_parser.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+    work_parser.add_argument("--max-places", type=int, default=None)
+    work_parser.add_argument("--engine", default="selenium", help="Review fetch engine: selenium or http")
+
+    status_parser = subparsers.add_parser("status", help="Show how many places are in each status")
+    status_parser.add_argument("--queue", required=True)
+
+    args = parser.parse_args()
+    if args.command == "enqueue":
+        print(f"Enqueued {enqueue_places(args.queue, args.topic, args.limit, input_file=args.input_file)} places")
+    elif args.command == "work":
+        run_worker(
+            args.queue,
+            args.output_dir,
+            worker_id=args.worker_id,
+            threads=args.threads,
+            lease_timeout=args.lease_timeout,
+            max_places=args.max_places,
+            engine=args.engine,
+        )
+    else:
+        print(WorkQueue(args.queue).counts())
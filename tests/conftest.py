@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The modules are imported as `src.*` from the root of the repository, as in the notebooks and benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+from benchmarks.fixture_server import FixtureServer  # noqa: E402
+import src.llm_cache  # noqa: E402
+from src.llm_cache import LLMCache  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def fixture_server():
+    server = FixtureServer(places=2, reviews_per_place=45, page_size=10, page_latency=0).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    server = FakeOpenAIServer().start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch):
+    """A fresh process-wide LLM cache, stored in the temporary directory of the test."""
+    cache = LLMCache(path=str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(src.llm_cache, "_cache", cache)
+    return cache
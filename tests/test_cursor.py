@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+import src.extract_support
+from src.extract_reviews import _collect_reviews
+from src.extract_support import (
+    BULK_EXTRACT_REVIEWS_JS,
+    DISCOVER_NEW_REVIEWS_JS,
+    REVIEW_ID_ATTRIBUTE,
+    ReviewCursor,
+    discover_reviews,
+)
+from src.journal import RunJournal
+from src.sinks import MemorySink
+
+URL = "https://www.google.com/maps/place/fake"
+
+
+class FakeReview:
+    def __init__(self, review_id: str):
+        self.attributes = {REVIEW_ID_ATTRIBUTE: review_id}
+
+
+class FakeReviewsPage:
+    """Stands for the reviews tab of a place: reviews load `page_size` at a time, when the last one is scrolled to."""
+
+    def __init__(self, count: int, page_size: int = 10):
+        self.reviews = [FakeReview(f"review-{idx}") for idx in range(count)]
+        self.page_size = page_size
+        self.loaded = page_size
+
+    def execute_script(self, script, *args):
+        if script == DISCOVER_NEW_REVIEWS_JS:
+            _, id_attribute, cursor_attribute, token, max_count = args
+            fresh = [el for el in self.reviews[: self.loaded] if el.attributes.get(cursor_attribute) != token]
+            if not fresh:
+                self.loaded = min(self.loaded + self.page_size, len(self.reviews))
+                return []
+            found = []
+            for el in fresh[:max_count]:
+                el.attributes[cursor_attribute] = token
+                found.append([el, el.attributes[id_attribute]])
+            return found
+        if script == BULK_EXTRACT_REVIEWS_JS:
+            elements, _ = args
+            review = {"review": "Nice visit", "date": "a week ago", "score": 5}
+            return json.dumps([{"review_id": el.attributes[REVIEW_ID_ATTRIBUTE], **review} for el in elements])
+        raise AssertionError(f"Unexpected script: {script[:40]}")
+
+
+@pytest.fixture
+def reviews_page(monkeypatch):
+    page = FakeReviewsPage(45)
+
+    class FakeDriverManager:
+        def get_driver(self, headless=True):
+            return page
+
+    monkeypatch.setattr(src.extract_support, "WebDriverManager", FakeDriverManager)
+    return page
+
+
+def discover_all(cursor, limit=None):
+    discovered = []
+    while True:
+        elements = discover_reviews(cursor=cursor, limit=limit, new_reviews_timeout=0.2)
+        if not elements:
+            return discovered
+        discovered.extend(el.attributes[REVIEW_ID_ATTRIBUTE] for el in elements)
+
+
+def test_discovers_every_review_once(reviews_page):
+    cursor = ReviewCursor()
+    assert discover_all(cursor) == [f"review-{idx}" for idx in range(45)]
+    assert cursor.exhausted
+    assert cursor.last_review_id == "review-44"
+
+
+def test_resumes_from_a_seeded_cursor(reviews_page):
+    # Seeded with more reviews than the first two pages hold: the passes finding only seen reviews keep scrolling
+    seen = [f"review-{idx}" for idx in range(25)]
+    cursor = ReviewCursor(seen_ids=seen)
+    cursor.discovered = len(seen)
+
+    assert discover_all(cursor) == [f"review-{idx}" for idx in range(25, 45)]
+    assert cursor.exhausted
+    assert cursor.discovered == 45
+
+
+def test_stops_at_the_limit_without_exhausting(reviews_page):
+    cursor = ReviewCursor(seen_ids=[f"review-{idx}" for idx in range(5)])
+    cursor.discovered = 5
+
+    assert discover_all(cursor, limit=20) == [f"review-{idx}" for idx in range(5, 20)]
+    assert not cursor.exhausted
+
+
+def test_stops_at_a_stored_review(reviews_page):
+    cursor = ReviewCursor(stop_ids=["review-12"])
+
+    assert discover_all(cursor) == [f"review-{idx}" for idx in range(12)]
+    assert cursor.reached_stop
+    assert not cursor.exhausted
+
+
+def test_collection_of_a_resumed_place_completes(reviews_page, tmp_path):
+    journal = RunJournal(str(tmp_path / "reviews.csv.journal.json"))
+    journal.start([URL])
+    journal.record_progress(URL, [f"review-{idx}" for idx in range(25)], 25, "review-24")
+
+    cursor = ReviewCursor(seen_ids=journal.seen_review_ids(URL))
+    cursor.discovered = len(cursor.seen_ids)
+    sink = MemorySink()
+    collected, completed = _collect_reviews(
+        "guide", {"place_url": URL, "name": "Fake"}, None, sink, cursor, journal, extract_chunks=False
+    )
+
+    assert (collected, completed) == (20, True)
+    assert sink.to_dataframe()["review_id"].tolist() == [f"review-{idx}" for idx in range(25, 45)]
+    assert journal.collected(URL) == 45
+    assert len(journal.seen_review_ids(URL)) == 45
@@ -0,0 +1,37 @@
+import pandas as pd
+
+from src.dedup import COUNT_COLUMN, dedup_reviews, near_duplicate_groups
+
+REVIEW = (
+    "We spent the whole afternoon in the museum, the paintings were stunning and the staff were kind, "
+    "the audio guide was worth every cent and the garden cafe was a lovely place to rest before leaving. "
+    "The rooms on the first floor hold the sculptures, and the temporary exhibition about the history of the "
+    "building was well explained, with short videos and plenty of benches for the children."
+)
+# Lightly edited, as copy-pasted reviews often are
+EDITED = REVIEW.replace("plenty of", "lots of")
+OTHER = "Long queue at the entrance and tickets were far too expensive for such a small collection of sculptures."
+
+
+def test_groups_exact_and_near_duplicates():
+    clusters = near_duplicate_groups([REVIEW, OTHER, REVIEW.upper(), EDITED])
+
+    assert clusters.tolist() == [0, 1, 0, 0]
+
+
+def test_duplicates_are_limited_to_their_group():
+    clusters = near_duplicate_groups([REVIEW, REVIEW], groups=["place-a", "place-b"])
+
+    assert clusters.tolist() == [0, 1]
+
+
+def test_empty_input():
+    assert near_duplicate_groups([]).tolist() == []
+
+
+def test_dedup_reviews_counts_the_collapsed_reviews():
+    store = pd.DataFrame({"name": ["A", "A", "A", "B"], "review": [REVIEW, EDITED, OTHER, REVIEW]})
+    deduplicated = dedup_reviews(store, by="name")
+
+    assert deduplicated["review"].tolist() == [REVIEW, OTHER, REVIEW]
+    assert deduplicated[COUNT_COLUMN].tolist() == [2, 1, 1]
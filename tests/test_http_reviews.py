@@ -0,0 +1,72 @@
+import pytest
+
+from benchmarks.fixture_server import listugcposts_payload
+from src.extract_support import ReviewCursor
+from src.http_reviews import HttpEngineError, fetch_place, iter_review_pages, parse_reviews_payload
+
+REVIEWS = [
+    {"id": "review-1", "text": "The audio guide was great.", "date": "a week ago", "score": 5},
+    {"id": "review-2", "text": "", "date": "a year ago", "score": 2},
+]
+
+
+def test_parses_a_page_of_reviews():
+    reviews, token = parse_reviews_payload(listugcposts_payload(REVIEWS, "next"))
+
+    assert reviews == [
+        {"review_id": "review-1", "review": "The audio guide was great.", "date": "a week ago", "score": 5},
+        {"review_id": "review-2", "review": "", "date": "a year ago", "score": 2},
+    ]
+    assert token == "next"
+
+
+def test_last_page_has_no_token():
+    assert parse_reviews_payload(listugcposts_payload(REVIEWS, None))[1] is None
+
+
+@pytest.mark.parametrize("text", ["<html>Not found</html>", ")]}'\n{}", ")]}'\n[null, null, [[[null]]]]"])
+def test_rejects_unexpected_responses(text):
+    with pytest.raises(HttpEngineError):
+        parse_reviews_payload(text)
+
+
+def test_fetches_the_place(fixture_server):
+    place_info, place_id = fetch_place(fixture_server.place_urls()[0])
+
+    assert place_id == fixture_server.place_id(0)
+    assert place_info["name"] == "Fixture Museum 0"
+    assert place_info["address"] == "Via Fixture 0, Roma"
+
+
+def test_pages_through_every_review(fixture_server):
+    place_url = fixture_server.place_urls()[0]
+    cursor = ReviewCursor()
+    pages = list(iter_review_pages(place_url, fixture_server.place_id(0), "guide", cursor, page_size=10))
+
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 5]
+    assert cursor.discovered == 45
+    assert cursor.exhausted
+
+
+def test_resumes_from_a_seeded_cursor(fixture_server):
+    place_url = fixture_server.place_urls()[1]
+    seen = [f"fixture-place-1-review-{idx}" for idx in range(25)]
+    cursor = ReviewCursor(seen_ids=seen)
+    cursor.discovered = len(seen)
+
+    pages = list(iter_review_pages(place_url, fixture_server.place_id(1), "guide", cursor, page_size=10))
+
+    assert [review["review_id"] for page in pages for review in page] == [
+        f"fixture-place-1-review-{idx}" for idx in range(25, 45)
+    ]
+    assert cursor.exhausted
+
+
+def test_stops_at_the_limit(fixture_server):
+    cursor = ReviewCursor()
+    pages = list(
+        iter_review_pages(fixture_server.place_urls()[0], fixture_server.place_id(0), "guide", cursor, 15, page_size=10)
+    )
+
+    assert sum(len(page) for page in pages) == 15
+    assert not cursor.exhausted
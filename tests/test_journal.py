@@ -0,0 +1,82 @@
+import os
+
+from src.journal import DONE, FAILED, IN_PROGRESS, PENDING, RunJournal, journal_log_path
+
+URLS = ["https://www.google.com/maps/place/a", "https://www.google.com/maps/place/b"]
+
+
+def test_resumes_partial_places(tmp_path):
+    path = str(tmp_path / "reviews.csv.journal.json")
+    journal = RunJournal(path)
+    journal.start(URLS, topic="guide", limit=None)
+    journal.mark_in_progress(URLS[0])
+    journal.record_progress(URLS[0], ["r1", "r2"], 2, "r2")
+    journal.record_progress(URLS[0], ["r1", "r2", "r3"], 3, "r3")
+    journal.mark_done(URLS[1], 7)
+
+    # Nothing compacted since the start: the progress is read back from the log
+    resumed = RunJournal(path)
+    assert resumed.status(URLS[0]) == IN_PROGRESS
+    assert resumed.seen_review_ids(URLS[0]) == ["r1", "r2", "r3"]
+    assert resumed.collected(URLS[0]) == 3
+    assert resumed.places[URLS[0]]["last_review_id"] == "r3"
+    assert resumed.urls_to_process(URLS) == [URLS[0]]
+    assert resumed.summary() == {PENDING: 0, IN_PROGRESS: 1, DONE: 1, FAILED: 0}
+
+
+def test_logs_only_new_review_ids(tmp_path):
+    path = str(tmp_path / "reviews.csv.journal.json")
+    journal = RunJournal(path)
+    journal.start(URLS)
+    ids = [f"r{idx}" for idx in range(100)]
+    for end in range(10, 101, 10):
+        journal.record_progress(URLS[0], ids[:end], end, ids[end - 1])
+
+    with open(journal_log_path(path), encoding="utf-8") as f:
+        logged = f.read()
+    assert logged.count('"r0"') == 1
+    assert RunJournal(path).seen_review_ids(URLS[0]) == ids
+
+
+def test_ignores_a_truncated_log_line(tmp_path):
+    path = str(tmp_path / "reviews.csv.journal.json")
+    journal = RunJournal(path)
+    journal.start(URLS)
+    journal.record_progress(URLS[0], ["r1"], 1, "r1")
+    with open(journal_log_path(path), "a", encoding="utf-8") as f:
+        f.write('{"url": "https://www.google.com/maps/place/a", "add_ids": ["r')
+
+    assert RunJournal(path).seen_review_ids(URLS[0]) == ["r1"]
+
+
+def test_compaction_empties_the_log(tmp_path):
+    path = str(tmp_path / "reviews.csv.journal.json")
+    journal = RunJournal(path)
+    journal.start(URLS)
+    journal.record_progress(URLS[0], ["r1", "r2"], 2, "r2", topic="guide")
+    journal.compact()
+
+    assert os.path.getsize(journal_log_path(path)) == 0
+    assert RunJournal(path).seen_review_ids(URLS[0], topic="guide") == ["r1", "r2"]
+
+
+def test_topics_are_tracked_apart(tmp_path):
+    journal = RunJournal(str(tmp_path / "reviews.csv.journal.json"))
+    journal.start(URLS)
+    journal.record_progress(URLS[0], ["r1"], 1, "r1", topic="guide")
+    journal.record_progress(URLS[0], ["r2"], 2, "r2", topic="tickets")
+    journal.mark_topic_done(URLS[0], "guide")
+
+    assert journal.topic_done(URLS[0], "guide")
+    assert not journal.topic_done(URLS[0], "tickets")
+    assert journal.seen_review_ids(URLS[0], topic="guide") == []
+    assert journal.seen_review_ids(URLS[0], topic="tickets") == ["r2"]
+
+
+def test_in_memory_journal():
+    journal = RunJournal(None)
+    journal.start(URLS)
+    journal.record_progress(URLS[0], ["r1"], 1, "r1")
+    journal.mark_done(URLS[0], 1)
+
+    assert journal.urls_to_process(URLS) == [URLS[1]]
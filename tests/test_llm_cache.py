@@ -0,0 +1,69 @@
+from src.clean_review import pick_topic_relevant_chunks_batch
+from src.llm_cache import LLMCache
+from src.metrics import metrics
+
+# Long enough to be sent to the LLM
+LONG_REVIEWS = [
+    "The audio guide was great, it told the story of every painting in the rooms we walked through. " * 3,
+    "Tickets were expensive and the queue was long, but the garden and the cafe made up for the wait. " * 3,
+]
+
+
+def test_stores_and_finds_answers(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"))
+    key = cache.make_key("model", "prompt", {"topic": "guide"}, "text")
+
+    assert cache.get(key) is None
+    cache.set(key, "answer")
+    assert cache.get(key) == "answer"
+    assert cache.stats() == {"enabled": True, "hits": 1, "misses": 1, "entries": 1, "size_bytes": 6}
+    # Persisted for the next runs
+    assert LLMCache(path=str(tmp_path / "cache.sqlite")).get(key) == "answer"
+
+
+def test_keys_depend_on_every_part():
+    assert LLMCache.make_key("model", "prompt", "text") != LLMCache.make_key("model", "prompt", "other text")
+    assert LLMCache.make_key("ab", "c") != LLMCache.make_key("a", "bc")
+
+
+def test_evicts_the_least_recently_used_answers(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"), max_size_bytes=100)
+    for idx in range(5):
+        cache.set(f"key-{idx}", "x" * 30)
+        cache.get("key-0")
+
+    assert cache.get("key-0") is not None
+    assert cache.get("key-1") is None
+    assert cache.stats()["size_bytes"] <= 100
+
+
+def test_disabled_cache(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"), enabled=False)
+    cache.set("key", "answer")
+
+    assert cache.get("key") is None
+    assert not (tmp_path / "cache.sqlite").exists()
+
+
+def test_chunks_are_answered_from_the_cache(fake_openai, llm_cache, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    calls = fake_openai.calls
+    first = pick_topic_relevant_chunks_batch(LONG_REVIEWS, "audio guide", base_url=fake_openai.base_url)
+    assert fake_openai.calls > calls
+    calls = fake_openai.calls
+    second = pick_topic_relevant_chunks_batch(LONG_REVIEWS, "audio guide", base_url=fake_openai.base_url)
+
+    # The fake endpoint echoes the reviews as their chunks
+    assert first == LONG_REVIEWS
+    assert second == first
+    assert fake_openai.calls == calls
+    assert llm_cache.stats()["entries"] == 2
+
+
+def test_metrics_report_does_not_open_the_cache(monkeypatch):
+    import src.llm_cache
+
+    monkeypatch.setattr(src.llm_cache, "_cache", None)
+
+    assert metrics.report()["llm_cache"] is None
+    assert src.llm_cache._cache is None
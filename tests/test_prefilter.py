@@ -0,0 +1,56 @@
+import pytest
+
+from src.prefilter import DROP, ESCALATE, LOCAL, _stem, prefilter_reviews, topic_terms
+
+
+@pytest.mark.parametrize(
+    "word, inflected",
+    [
+        ("guide", "guides"),
+        ("guide", "guided"),
+        ("guide", "guida"),
+        ("glass", "glasses"),
+        ("bus", "buses"),
+        ("box", "boxes"),
+        ("ticket", "tickets"),
+        ("price", "prices"),
+    ],
+)
+def test_inflections_share_their_stem(word, inflected):
+    assert _stem(word) == _stem(inflected)
+
+
+@pytest.mark.parametrize("word", ["audio", "glass", "bus", "analysis", "bar"])
+def test_words_without_inflection_are_kept(word):
+    assert _stem(word) == word
+
+
+def test_prefixes_do_not_match():
+    assert _stem("bar") not in {_stem("barely"), _stem("barcelona")}
+
+
+def test_topic_terms_are_distinct_words():
+    assert topic_terms("Audio guide", ["audioguida", "guide"]) == ["audio", "guide", "audioguida"]
+
+
+def test_decisions():
+    texts = [
+        "Great visit. The audio guide was excellent and the audio guides are free! The cafe was closed.",
+        "The queue was long and the tickets expensive, but the paintings were stunning.",
+        "The guide was nice, the rest of the visit was long and tiring, with many rooms closed.",
+        # The IDF is computed over the batch, as over a page of reviews
+        "Lovely garden and a small shop near the exit.",
+        "Too crowded on Sundays, come early in the morning.",
+        "Staff at the desk were rude.",
+    ]
+    decisions = prefilter_reviews(texts, "audio guide", drop_unmatched=True)
+
+    assert [decision.action for decision in decisions] == [LOCAL, DROP, ESCALATE, DROP, DROP, DROP]
+    assert decisions[0].text == "The audio guide was excellent and the audio guides are free!"
+    assert decisions[1].score == 0
+
+
+def test_unmatched_reviews_are_escalated_by_default():
+    decisions = prefilter_reviews(["Nothing about it here.", ""], "audio guide")
+
+    assert [decision.action for decision in decisions] == [ESCALATE, ESCALATE]
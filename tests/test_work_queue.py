@@ -0,0 +1,51 @@
+from src.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+URLS = ["https://www.google.com/maps/place/a", "https://www.google.com/maps/place/b"]
+
+
+def test_leases_each_place_once(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    assert queue.enqueue(URLS, "guide", limit=10) == 2
+    assert queue.enqueue(URLS, "guide", limit=10) == 0
+
+    first = queue.lease("worker-1")
+    second = queue.lease("worker-2")
+
+    assert {first["url"], second["url"]} == set(URLS)
+    assert first["topic"] == "guide" and first["limit"] == 10
+    assert queue.lease("worker-3") is None
+    assert queue.counts() == {PENDING: 0, LEASED: 2, DONE: 0, FAILED: 0}
+
+
+def test_acks_only_its_own_lease(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.enqueue(URLS[:1], "guide")
+    url = queue.lease("worker-1")["url"]
+
+    assert not queue.ack(url, "worker-2", 5)
+    assert queue.ack(url, "worker-1", 5)
+    assert queue.counts()[DONE] == 1
+
+
+def test_expired_leases_go_back_to_the_queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_timeout=-1, max_attempts=2)
+    queue.enqueue(URLS[:1], "guide")
+
+    assert queue.lease("worker-1")["url"] == URLS[0]
+    # The first worker died: its lease expired and the place is leased again
+    assert queue.lease("worker-2")["url"] == URLS[0]
+    assert not queue.renew(URLS[0], "worker-1")
+    # Out of attempts
+    assert queue.lease("worker-3") is None
+    assert queue.counts()[FAILED] == 1
+
+
+def test_failed_places_are_retried_until_their_last_attempt(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+    queue.enqueue(URLS[:1], "guide")
+
+    queue.nack(queue.lease("worker-1")["url"], "worker-1", "Timeout")
+    assert queue.counts()[PENDING] == 1
+    queue.nack(queue.lease("worker-1")["url"], "worker-1", "Timeout")
+    assert queue.counts()[FAILED] == 1
+    assert queue.lease("worker-1") is None